@@ -6,16 +6,27 @@ import sys
 import time
 import datetime
 import io
-import zipfile
-import re
 import shutil
+import threading
+import importlib.util
 import pandas as pd
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from flask import Flask, jsonify, request, send_from_directory, send_file
+from flask import Flask, Response, jsonify, request, send_from_directory, send_file
 from flask_cors import CORS
 from flask_restx import Api, Resource, fields, reqparse
 import werkzeug.utils
 from dotenv import load_dotenv
+from utils.helpers import (
+    create_session_cache, remove_session_images, iter_zip, split_nonempty_lines, create_http_session,
+    write_records_to_excel, build_route_report
+)
+from utils.json_provider import init_json, dumps_bytes
+from utils.ocr_cache import get_ocr_result_cache
+from services.material_service import invalidate_materials_cache
+from services.ocr_engines import (
+    INVOICE_OCR_WORKERS, can_preload_engines, cnocr_ocr, easyocr_readtext, get_cnocr, get_easyocr_reader,
+    get_paddleocr, paddleocr_ocr, release_gpu_memory
+)
 
 # Load environment variables
 load_dotenv()
@@ -28,16 +39,18 @@ except ImportError as e:
     googlemaps = None
 
 try:
-    from supabase_client import supabase
+    # 每次使用時才呼叫 get_supabase()：客戶端延遲建立，建立失敗的話下一個請求會重試
+    from supabase_client import get_supabase
 except ImportError as e:
     print(f"Warning: {e}. Some features may not work.")
-    supabase = None
+    def get_supabase():
+        return None
 
 try:
-    from gmap_robot import GoogleMapsRobot
+    from gmap_robot import process_routes_concurrently
 except ImportError as e:
     print(f"Warning: {e}. Some features may not work.")
-    GoogleMapsRobot = None
+    process_routes_concurrently = None
 
 # --- OCR 相關套件 (延遲導入以加快啟動) ---
 # Import these only when OCR功能 is actually needed
@@ -45,7 +58,7 @@ except ImportError as e:
 try:
     import cv2
     import numpy as np
-    from pdf2image import convert_from_path
+    from utils.pdf_render import detect_invoice_boxes, iter_pdf_pages
     # 從原本的 OCR 工具導入設定變數
     # 請確保 param.py 與 app.py 在同一個資料夾中
     from param import *
@@ -54,10 +67,12 @@ except ImportError as e:
     print(f"Warning: OCR dependencies not fully available: {e}")
     OCR_IMPORTS_AVAILABLE = False
 
-# Lazy import OCR engines - these will be imported only when init_ocr_engines() is called
-CnOcr = None
-easyocr = None
-PaddleOCR = None
+# Rust-based Excel reader used by pandas' 'calamine' engine (pandas >= 2.2); only checked, pandas imports it
+if importlib.util.find_spec('python_calamine') is not None:
+    EXCEL_READ_ENGINE = 'calamine'
+else:
+    print("Warning: python_calamine not installed. Falling back to openpyxl/xlrd for Excel reading.")
+    EXCEL_READ_ENGINE = None
 
 # --- 解決 Flask 在 Windows 中 print() 可能產生的亂碼問題 ---
 try:
@@ -83,6 +98,8 @@ api = Api(
     doc='/docs/',
     prefix='/api'
 )
+# JSON 回應改用 orjson 序列化（未安裝時沿用標準 json）
+init_json(app, api)
 
 # --- 路徑設定 ---
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -91,14 +108,29 @@ app.config['UPLOAD_FOLDER'] = os.path.join(basedir, 'uploads')
 app.config['REPORTS_FOLDER'] = os.path.join(basedir, 'reports')
 app.config['TEMP_IMG_FOLDER'] = os.path.join(basedir, 'temp_imgs')
 app.config['CROPPED_RECEIPTS_FOLDER'] = os.path.join(basedir, 'cropped_receipts')
+# 發票裁切圖直接在記憶體中辨識；除錯時可設 OCR_SAVE_CROPS=true 另存到 cropped_receipts
+app.config['OCR_SAVE_CROPS'] = os.getenv('OCR_SAVE_CROPS', 'False').lower() == 'true'
+# 前端有 nginx/Apache 時可改由伺服器以 X-Sendfile 直接傳檔（預設關閉，gunicorn 會用 sendfile 傳送檔案）
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', 'False').lower() == 'true'
 
 # --- 全域物件 ---
 GOOGLE_MAPS_API_KEY = os.getenv("MAPS_API_KEY")
-gmaps = googlemaps.Client(key=GOOGLE_MAPS_API_KEY) if GOOGLE_MAPS_API_KEY and googlemaps else None
-SESSION_RESULTS_CACHE = {}
+# 共用連線池的 requests.Session，避免每次呼叫 Google Maps API 都重新握手
+gmaps = googlemaps.Client(
+    key=GOOGLE_MAPS_API_KEY, requests_session=create_http_session()
+) if GOOGLE_MAPS_API_KEY and googlemaps else None
+# 路線結果快取：LRU 上限 SESSION_CACHE_MAXSIZE 筆，被淘汰的 session 會在背景刪除截圖
+SESSION_RESULTS_CACHE = create_session_cache(
+    maxsize=int(os.getenv("SESSION_CACHE_MAXSIZE", "100")),
+    on_evict=remove_session_images
+)
+# 已產生的 Excel 報表（連同產生它的結果一起保存，結果換了就重建）
+EXCEL_EXPORT_CACHE = create_session_cache(maxsize=int(os.getenv("SESSION_CACHE_MAXSIZE", "100")))
 
 # OCR 引擎 (延遲初始化)
 ocr_engines = { "cnocr": None, "easyocr": None, "paddleocr": None }
+# 多個請求 / 背景工作同時第一次辨識時，只讓一個線程初始化引擎
+_ocr_engines_lock = threading.Lock()
 
 # ======================================================================
 # --- OCR 核心邏輯 (100% 移植自 gas_helper.py) ---
@@ -106,156 +138,102 @@ ocr_engines = { "cnocr": None, "easyocr": None, "paddleocr": None }
 
 def init_ocr_engines():
     """初始化所有 OCR 引擎。"""
-    global CnOcr, easyocr, PaddleOCR
-
-    if ocr_engines["cnocr"] is None:
+    if ocr_engines["cnocr"] is not None:
+        return
+    with _ocr_engines_lock:
+        if ocr_engines["cnocr"] is not None:
+            return
         print("首次使用，正在初始化 OCR 引擎 (可能需要幾分鐘)...")
 
-        # Lazy import OCR libraries here (not at module level)
-        if CnOcr is None:
-            try:
-                from cnocr import CnOcr as CnOcrClass
-                CnOcr = CnOcrClass
-                print("CnOCR library imported successfully")
-            except ImportError as e:
-                print(f"Failed to import CnOCR: {e}")
-
-        if easyocr is None:
-            try:
-                import easyocr as easyocr_module
-                easyocr = easyocr_module
-                print("EasyOCR library imported successfully")
-            except ImportError as e:
-                print(f"Failed to import EasyOCR: {e}")
-
-        if PaddleOCR is None:
-            try:
-                from paddleocr import PaddleOCR as PaddleOCRClass
-                PaddleOCR = PaddleOCRClass
-                print("PaddleOCR library imported successfully")
-            except ImportError as e:
-                print(f"Failed to import PaddleOCR: {e}")
-
-        # 初始化 CnOcr - 使用 try/except 處理可能的導入問題
-        if CnOcr:
-            try:
-                ocr_engines["cnocr"] = CnOcr()
-                print("CnOCR 初始化成功！")
-            except Exception as e:
-                print(f"CnOCR 初始化失敗: {e}")
-                ocr_engines["cnocr"] = None
-        else:
-            print("CnOCR not available, skipping")
-
-        # 初始化 EasyOCR
-        if easyocr:
-            try:
-                ocr_engines["easyocr"] = easyocr.Reader(['ch_tra', 'en'])
-                print("EasyOCR 初始化成功！")
-            except Exception as e:
-                print(f"EasyOCR 初始化失敗: {e}")
-                ocr_engines["easyocr"] = None
-        else:
-            print("EasyOCR not available, skipping")
-
-        # 初始化 PaddleOCR - 處理版本兼容性問題
-        if PaddleOCR:
+        # 引擎由 services.ocr_engines 建立並在整個 process 共用，OCR 套件也在那裡才延遲匯入
+        for name, factory in (("cnocr", get_cnocr), ("easyocr", get_easyocr_reader), ("paddleocr", get_paddleocr)):
             try:
-                # 先嘗試不使用已棄用的參數
-                ocr_engines["paddleocr"] = PaddleOCR(use_textline_orientation=False, lang='ch')
-                print("PaddleOCR 初始化成功！")
+                ocr_engines[name] = factory()
+                print(f"{name} 初始化成功！")
             except Exception as e:
-                print(f"PaddleOCR 初始化失敗 (新版): {e}")
-                try:
-                    # 回退到舊版參數
-                    ocr_engines["paddleocr"] = PaddleOCR(use_angle_cls=False, lang='ch')
-                    print("PaddleOCR 初始化成功 (舊版)！")
-                except Exception as e2:
-                    print(f"PaddleOCR 完全初始化失敗: {e2}")
-                    ocr_engines["paddleocr"] = None
-        else:
-            print("PaddleOCR not available, skipping")
+                print(f"{name} 初始化失敗: {e}")
+                ocr_engines[name] = None
 
         print("OCR 引擎初始化完成！")
 
-def detect_invoices_from_pdf(pdf_path: str) -> list:
-    """從 PDF 中分割出所有發票圖片。"""
-    os.makedirs(app.config['TEMP_IMG_FOLDER'], exist_ok=True)
-    os.makedirs(app.config['CROPPED_RECEIPTS_FOLDER'], exist_ok=True)
-    invoice_images = []
-    images = convert_from_path(pdf_path, dpi=300)
-    for i, img in enumerate(images):
+def iter_invoices_from_pdf(pdf_path: str):
+    """逐頁從 PDF 中分割出發票圖片，依序產生 (名稱, BGR 陣列)。"""
+    if app.config['OCR_SAVE_CROPS']:
+        os.makedirs(app.config['CROPPED_RECEIPTS_FOLDER'], exist_ok=True)
+    # 逐頁直接轉成陣列，裁切後的發票也留在記憶體中交給 OCR
+    for i, image in enumerate(iter_pdf_pages(pdf_path, dpi=300)):
         page_filename = f'page_{i + 1}.png'
-        img_path = os.path.join(app.config['TEMP_IMG_FOLDER'], page_filename)
-        img.save(img_path, 'PNG')
-        image = cv2.imread(img_path)
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        bin_img = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 25, 15)
-        height, width = gray.shape[:2]
-        scale = max(width, height) / 1000
-        ksize = int(30 * scale)
-        ksize = max(20, min(ksize, 80))
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (ksize, ksize))
-        dilated = cv2.dilate(bin_img, kernel, iterations=1)
-        contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        boxes = [cv2.boundingRect(c) for c in contours if cv2.contourArea(c) > 5000]
-        boxes = sorted(boxes, key=lambda b: (b[1], b[0]))
+        # 在縮小的灰階圖上找發票區塊，座標換算回原圖再裁切
+        boxes = detect_invoice_boxes(image, 5000)
         for j, (x, y, w, h) in enumerate(boxes):
             crop_img = image[y:y + h, x:x + w]
-            crop_path = os.path.join(app.config['CROPPED_RECEIPTS_FOLDER'], f'{page_filename}_block{j}.png')
-            cv2.imwrite(crop_path, crop_img)
-            invoice_images.append(crop_path)
-    return invoice_images
+            crop_name = f'{page_filename}_block{j}.png'
+            if app.config['OCR_SAVE_CROPS']:
+                cv2.imwrite(os.path.join(app.config['CROPPED_RECEIPTS_FOLDER'], crop_name), crop_img)
+            yield crop_name, crop_img
+
+def detect_invoices_from_pdf(pdf_path: str) -> list:
+    """從 PDF 中分割出所有發票圖片，回傳 (名稱, BGR 陣列) 的列表。"""
+    # 複製裁切圖，整頁陣列才能在裁切後釋放
+    return [(crop_name, crop_img.copy()) for crop_name, crop_img in iter_invoices_from_pdf(pdf_path)]
 
 def detect_fuel_type(text_combined: str) -> str:
     """從文字中偵測燃油種類。"""
-    matches = []
-    for wrong, correct in fuel_fuzzy_mapping.items():
-        text_combined = text_combined.replace(wrong, correct)
-    for fuel in fuel_keywords:
-        if fuel in text_combined:
-            mapped = fuel_mapping.get(fuel, fuel)
-            matches.append((fuel, mapped))
-    if matches:
-        return sorted(matches, key=lambda x: -len(x[0]))[0][1]
+    # 一次掃描修正所有燃油誤判字
+    text_combined = normalize_fuel_text(text_combined)
+    # 關鍵字已依長度排序，第一個命中的就是最長（最具體）的那個
+    fuel = find_longest_fuel_keyword(text_combined)
+    if fuel:
+        return fuel_mapping.get(fuel, fuel)
     return None
 
-def extract_invoice_info(img_path: str) -> dict:
-    """從單張發票圖片中擷取資訊 (完整版)。"""
-    cnocr_lines = [''.join(block['text']) for block in ocr_engines["cnocr"].ocr(img_path)]
-    zh_lines = ocr_engines["easyocr"].readtext(img_path, detail=0)
+def extract_invoice_info(crop_name: str, image) -> dict:
+    """從單張發票圖片 (BGR 陣列) 中擷取資訊 (完整版)。"""
+    # 相同內容的發票圖片直接沿用先前的 OCR 結果
+    ocr_cache = get_ocr_result_cache()
+    image_digest = ocr_cache.array_digest(image)
+    cnocr_result = ocr_cache.get_or_run(image_digest, "cnocr", lambda: cnocr_ocr(ocr_engines["cnocr"], image))
+    cnocr_lines = [''.join(block['text']) for block in cnocr_result]
+    zh_lines = ocr_cache.get_or_run(
+        image_digest, "easyocr", lambda: easyocr_readtext(ocr_engines["easyocr"], image))
     all_lines = cnocr_lines + zh_lines
     invoice_number, date, quantity, fuel_type, address = None, None, None, None, None
 
-    for line in cnocr_lines:
-        if not invoice_number and (match := invoice_number_pattern.search(line)): invoice_number = match.group()
-        if not date and (match := date_pattern.search(line)): date = match.group()
-
+    # 一次走完所有文字行：發票號碼、日期只看 CnOCR 行，地址只看 EasyOCR 行；
+    # 數量與地址的備用規則只記下第一個候選，主要規則整份都沒找到時才採用
+    num_cnocr_lines = len(cnocr_lines)
+    first_quantity, fallback_address = None, None
     for i, line in enumerate(all_lines):
-        if not quantity and any(k in line for k in fuel_keywords):
-            if (match := quantity_pattern.search(line)): quantity = match.group(1); break
-            if (match := quantity_fallback_pattern.search(line)): quantity = match.group(); break
-            if i + 1 < len(all_lines):
-                next_line = all_lines[i + 1]
-                if (match := quantity_pattern.search(next_line)): quantity = match.group(1); break
-                if (match := quantity_fallback_pattern.search(next_line)): quantity = match.group(); break
-
-    if not quantity:
-        for line in all_lines:
-            if (match := quantity_pattern.search(line)): quantity = match.group(1); break
+        if i < num_cnocr_lines:
+            if not invoice_number and (match := invoice_number_pattern.search(line)): invoice_number = match.group()
+            if not date and (match := date_pattern.search(line)): date = match.group()
+        elif not address:
+            if search_address(line): address = line
+            elif fallback_address is None and '號' in line and has_district_keyword(line) and any_digit_pattern.search(line): fallback_address = line
+
+        if not quantity:
+            if fuel_keyword_pattern.search(line):
+                if (match := quantity_pattern.search(line)): quantity = match.group(1)
+                elif (match := quantity_fallback_pattern.search(line)): quantity = match.group()
+                elif i + 1 < len(all_lines):
+                    next_line = all_lines[i + 1]
+                    if (match := quantity_pattern.search(next_line)): quantity = match.group(1)
+                    elif (match := quantity_fallback_pattern.search(next_line)): quantity = match.group()
+            if first_quantity is None and (match := quantity_pattern.search(line)): first_quantity = match.group(1)
+
+        if invoice_number and date and quantity and address: break
+
+    quantity = quantity or first_quantity
+    address = address or fallback_address
 
     all_text_combined = ' '.join(all_lines)
     fuel_type = detect_fuel_type(all_text_combined)
 
-    for line in zh_lines:
-        if not address and (match := address_pattern.search(line)): address = line; break
-    if not address:
-        for line in zh_lines:
-            if any(keyword in line for keyword in district_keywords) and '號' in line and re.search(r'\d+', line): address = line; break
-
     # --- 關鍵：完整的 PaddleOCR 備用方案 ---
-    if not all([invoice_number, date, quantity, fuel_type, address]) and ocr_engines["paddleocr"] is not None:
-        paddle_result = ocr_engines["paddleocr"].ocr(img_path) # 修正：移除 cls=False
+    # PaddleOCR 只補發票號碼、日期、數量、油種；只缺地址時呼叫它也補不到，直接略過
+    if not (invoice_number and date and quantity and fuel_type) and ocr_engines["paddleocr"] is not None:
+        paddle_result = ocr_cache.get_or_run(
+            image_digest, "paddleocr:ch", lambda: paddleocr_ocr(ocr_engines["paddleocr"], image)) # 修正：移除 cls=False
         if paddle_result and paddle_result[0]:
             paddle_lines = [line[1][0] for line in paddle_result[0]]
             if not invoice_number:
@@ -273,33 +251,32 @@ def extract_invoice_info(img_path: str) -> dict:
 
     # --- 關鍵：完整的資料清理 ---
     if address:
-        replacements = {'半禹锈娜': '萬巒鄉', '号': '號', '锈': '', '娜': '', '潮洲': '潮州', '川': '州', '鎖': '鎮'}
-        for wrong, right in replacements.items(): address = address.replace(wrong, right)
+        address = clean_address(address)
     if invoice_number and not invoice_number_pattern.fullmatch(invoice_number): invoice_number = None
     if date and not date_pattern.fullmatch(date): date = None
     if quantity:
         try: float(quantity)
         except ValueError: quantity = None
-    if fuel_type and fuel_type not in fuel_mapping.values(): fuel_type = None
-    if address and (len(address) < 6 or '號' not in address or not any(city in address for city in district_keywords)): address = None
+    if fuel_type and fuel_type not in fuel_types: fuel_type = None
+    if address and (len(address) < 6 or '號' not in address or not has_district_keyword(address)): address = None
 
     print(f"  > OCR 結果: {invoice_number}, {date}, {fuel_type}, {quantity}, {address}")
     return {
-        '頁數': os.path.basename(img_path), '發票號碼': invoice_number, '日期': date,
+        '頁數': crop_name, '發票號碼': invoice_number, '日期': date,
         '種類': fuel_type, '數量': quantity, '地址': address, '備註': ''
     }
 
-def process_single_invoice_thread_safe(img_path: str, thread_id: int) -> dict:
+def process_single_invoice_thread_safe(crop_name: str, image, thread_id: int) -> dict:
     """線程安全的單張發票處理函數。"""
     try:
-        print(f"  🧵 Thread {thread_id}: Processing {os.path.basename(img_path)}")
-        result = extract_invoice_info(img_path)
-        print(f"  ✅ Thread {thread_id}: Completed {os.path.basename(img_path)} - Invoice: {result.get('發票號碼', 'None')}")
+        print(f"  🧵 Thread {thread_id}: Processing {crop_name}")
+        result = extract_invoice_info(crop_name, image)
+        print(f"  ✅ Thread {thread_id}: Completed {crop_name} - Invoice: {result.get('發票號碼', 'None')}")
         return result
     except Exception as e:
-        print(f"  ❌ Thread {thread_id}: Error processing {os.path.basename(img_path)}: {e}")
+        print(f"  ❌ Thread {thread_id}: Error processing {crop_name}: {e}")
         return {
-            '頁數': os.path.basename(img_path), '發票號碼': None, '日期': None,
+            '頁數': crop_name, '發票號碼': None, '日期': None,
             '種類': None, '數量': None, '地址': None, '備註': f'處理錯誤: {str(e)}'
         }
 
@@ -307,43 +284,47 @@ def process_invoice_pdf(pdf_path: str) -> tuple[str, list]:
     """整合的多線程 OCR 處理流程，回傳報告路徑和結果資料。"""
     init_ocr_engines()
     print(f"正在處理 PDF: {pdf_path}")
-    invoice_images = detect_invoices_from_pdf(pdf_path)
-    num_invoices = len(invoice_images)
-    print(f"分割出 {num_invoices} 張發票，開始多線程 OCR 辨識...")
 
-    # 動態決定線程數量：最多4個線程，但不超過發票數量
-    max_workers = min(4, num_invoices, os.cpu_count() or 4)
-    print(f"🚀 使用 {max_workers} 個線程進行並行處理...")
+    # 最多 INVOICE_OCR_WORKERS 個線程（共用同一組 OCR 引擎）；線程池只在有發票排隊時才建立新線程
+    max_workers = INVOICE_OCR_WORKERS
+    print(f"🚀 使用最多 {max_workers} 個線程，邊分割發票邊進行 OCR 辨識...")
 
-    results = [None] * num_invoices  # 預分配結果列表以保持順序
+    # 主線程渲染、裁切下一頁的同時，前面頁面的發票已在 OCR；
+    # 最多 2 倍線程數的發票排隊等待，避免整份 PDF 的裁切圖同時堆在記憶體
+    pending = threading.BoundedSemaphore(max_workers * 2)
+    futures = []  # 依發票順序保存，結果順序與頁面一致
     start_time = time.time()
 
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # 提交所有任務
-        future_to_index = {
-            executor.submit(process_single_invoice_thread_safe, img_path, i + 1): i
-            for i, img_path in enumerate(invoice_images)
-        }
+        for i, (crop_name, image) in enumerate(iter_invoices_from_pdf(pdf_path)):
+            pending.acquire()
+            future = executor.submit(process_single_invoice_thread_safe, crop_name, image, i + 1)
+            future.add_done_callback(lambda _: pending.release())
+            futures.append(future)
+
+        num_invoices = len(futures)
+        print(f"分割出 {num_invoices} 張發票，等待 OCR 辨識完成...")
 
-        # 收集結果並保持原始順序
         completed_count = 0
-        for future in as_completed(future_to_index):
-            index = future_to_index[future]
-            results[index] = future.result()
+        for future in as_completed(futures):
             completed_count += 1
             progress = (completed_count / num_invoices) * 100
             print(f"  📊 進度: {completed_count}/{num_invoices} ({progress:.1f}%)")
+        results = [future.result() for future in futures]
 
     processing_time = time.time() - start_time
-    print(f"🎉 多線程處理完成！耗時: {processing_time:.2f}秒 (平均: {processing_time/num_invoices:.2f}秒/張)")
+    # 這份 PDF 的中間張量不再需要，把 PyTorch 快取的 GPU 記憶體還給驅動程式
+    release_gpu_memory()
+    print(f"🎉 多線程處理完成！耗時: {processing_time:.2f}秒 (平均: {processing_time/max(num_invoices, 1):.2f}秒/張)")
 
-    df = pd.DataFrame(results)
     report_filename = f'ocr_report_{int(time.time())}.xlsx'
     report_path = os.path.join(app.config['REPORTS_FOLDER'], report_filename)
-    df.to_excel(report_path, index=False)
+    # 直接逐列寫入 xlsxwriter (constant_memory)，不必先建 DataFrame
+    write_records_to_excel(report_path, results)
     print(f"報告已產生: {report_path}")
     if os.path.exists(app.config['TEMP_IMG_FOLDER']): shutil.rmtree(app.config['TEMP_IMG_FOLDER'])
-    if os.path.exists(app.config['CROPPED_RECEIPTS_FOLDER']): shutil.rmtree(app.config['CROPPED_RECEIPTS_FOLDER'])
+    # OCR_SAVE_CROPS 時保留裁切圖供除錯檢視
+    if not app.config['OCR_SAVE_CROPS'] and os.path.exists(app.config['CROPPED_RECEIPTS_FOLDER']): shutil.rmtree(app.config['CROPPED_RECEIPTS_FOLDER'])
     return report_path, results
 
 # ======================================================================
@@ -467,6 +448,7 @@ class HelloWorld(Resource):
     @ns_general.marshal_with(hello_model)
     def get(self):
         """Test API connection and database status"""
+        supabase = get_supabase()
         if supabase: 
             return {"message": "哈囉！我來自成功連線到 Supabase 的 Python 後端！"}
         else: 
@@ -477,6 +459,7 @@ class HealthCheck(Resource):
     @ns_general.doc('health_check')
     def get(self):
         """Check service health and status"""
+        supabase = get_supabase()
         try:
             # Test database connection
             db_status = 'connected'
@@ -532,6 +515,39 @@ class ServiceInfo(Resource):
             }
         }
 
+# 批次比對時同時送出的 Supabase 查詢數
+BATCH_MATCH_WORKERS = 8
+
+def match_material_query(original_name):
+    """以名稱搜尋單一材料，轉成前端期望的比對結果格式"""
+    supabase = get_supabase()
+    # 使用正確的欄位名稱進行搜尋
+    response = supabase.table('materials').select('material_id, material_name, carbon_footprint, declaration_unit, data_source').ilike('material_name', f'%{original_name}%').limit(5).execute()
+    search_results = response.data if response.data else []
+    
+    # 轉換格式以符合前端期望
+    formatted_matches = []
+    for material in search_results:
+        formatted_matches.append({
+            "name": material.get('material_name', ''),
+            "id": material.get('material_id', ''),
+            "carbon_footprint": material.get('carbon_footprint', 0),
+            "declaration_unit": material.get('declaration_unit', ''),
+            "data_source": material.get('data_source', ''),
+            "score": 0.8  # 暫時給一個固定分數
+        })
+    
+    return {
+        "query": original_name,
+        "matches": formatted_matches,
+        "default": 0 if formatted_matches else None
+    }
+
+def match_materials_batch_queries(queries):
+    """並行送出每筆查詢（每筆都是一次網路往返），結果依原查詢順序回傳"""
+    with ThreadPoolExecutor(max_workers=min(BATCH_MATCH_WORKERS, len(queries))) as executor:
+        return list(executor.map(match_material_query, queries))
+
 @ns_materials.route('/match-batch')
 class MaterialMatchBatch(Resource):
     @ns_materials.doc('match_materials_batch')
@@ -541,6 +557,7 @@ class MaterialMatchBatch(Resource):
     @ns_materials.marshal_with(success_response_model)
     def post(self):
         """Batch match materials against database"""
+        supabase = get_supabase()
         if not supabase: 
             api.abort(500, "資料庫連線失敗")
         
@@ -549,30 +566,8 @@ class MaterialMatchBatch(Resource):
         if not queries: 
             api.abort(400, "沒有收到任何查詢資料")
         
-        all_results = []
         try:
-            for original_name in queries:
-                # 使用正確的欄位名稱進行搜尋
-                response = supabase.table('materials').select('material_id, material_name, carbon_footprint, declaration_unit, data_source').ilike('material_name', f'%{original_name}%').limit(5).execute()
-                search_results = response.data if response.data else []
-                
-                # 轉換格式以符合前端期望
-                formatted_matches = []
-                for material in search_results:
-                    formatted_matches.append({
-                        "name": material.get('material_name', ''),
-                        "id": material.get('material_id', ''),
-                        "carbon_footprint": material.get('carbon_footprint', 0),
-                        "declaration_unit": material.get('declaration_unit', ''),
-                        "data_source": material.get('data_source', ''),
-                        "score": 0.8  # 暫時給一個固定分數
-                    })
-                
-                all_results.append({ 
-                    "query": original_name,
-                    "matches": formatted_matches,
-                    "default": 0 if formatted_matches else None
-                })
+            all_results = match_materials_batch_queries(queries)
             
             return {
                 "success": True,
@@ -585,30 +580,13 @@ class MaterialMatchBatch(Resource):
 # Legacy route for backward compatibility
 @app.route('/materials/match-batch', methods=['POST'])
 def match_materials_batch():
+    supabase = get_supabase()
     if not supabase: return jsonify({"success": False, "error": "資料庫連線失敗"}), 500
     data = request.get_json()
     queries = data.get('queries', []) if data else []
     if not queries: return jsonify({"success": False, "error": "沒有收到任何查詢資料"}), 400
-    all_results = []
     try:
-        for original_name in queries:
-            response = supabase.table('materials').select('material_id, material_name, carbon_footprint, declaration_unit, data_source').ilike('material_name', f'%{original_name}%').limit(5).execute()
-            search_results = response.data if response.data else []
-            formatted_matches = []
-            for material in search_results:
-                formatted_matches.append({
-                    "name": material.get('material_name', ''),
-                    "id": material.get('material_id', ''),
-                    "carbon_footprint": material.get('carbon_footprint', 0),
-                    "declaration_unit": material.get('declaration_unit', ''),
-                    "data_source": material.get('data_source', ''),
-                    "score": 0.8
-                })
-            all_results.append({ 
-                "query": original_name,
-                "matches": formatted_matches,
-                "default": 0 if formatted_matches else None
-            })
+        all_results = match_materials_batch_queries(queries)
         return jsonify({"success": True, "data": all_results})
     except Exception as e:
         print(f"批次比對時發生錯誤: {e}")
@@ -617,9 +595,10 @@ def match_materials_batch():
 @ns_materials.route('/all')
 class MaterialsAll(Resource):
     @ns_materials.doc('get_all_materials')
-    @ns_materials.marshal_with(success_response_model)
+    @ns_materials.response(200, 'Success', success_response_model)
     def get(self):
         """Get all materials from database using the material service"""
+        supabase = get_supabase()
         if not supabase:
             api.abort(500, "資料庫連線失敗")
         
@@ -629,28 +608,30 @@ class MaterialsAll(Resource):
             material_service = MaterialService(supabase)
             
             print("🔄 Using MaterialService to fetch all materials...")
+            # 先取得完整材料庫（優先使用快取）再回應，查詢失敗時回傳 500 而不是截斷的 JSON
             all_materials = material_service.get_all_materials()
-            
-            return {
-                "success": True,
-                "data": all_materials,
-                "total_count": len(all_materials)
-            }
         except Exception as e:
             print(f"獲取所有材料時發生錯誤: {e}")
             api.abort(500, f"獲取材料時發生錯誤: {e}")
+        
+        # 一次編碼整個回應（有 orjson 時使用 orjson），不經過 marshal 逐筆轉換
+        return Response(
+            dumps_bytes({"success": True, "message": None, "data": all_materials}),
+            mimetype='application/json'
+        )
 
 @ns_materials.route('/count')
 class MaterialsCount(Resource):
     @ns_materials.doc('get_materials_count')
     def get(self):
         """Get total count of materials in database"""
+        supabase = get_supabase()
         if not supabase:
             api.abort(500, "資料庫連線失敗")
         
         try:
             # Get exact count using Supabase count feature
-            response = supabase.table('materials').select('*', count='exact').limit(1).execute()
+            response = supabase.table('materials').select('material_id', count='exact').limit(1).execute()
             
             return {
                 "success": True,
@@ -667,6 +648,7 @@ class MaterialsSearch(Resource):
     @ns_materials.marshal_with(success_response_model)
     def get(self):
         """Search materials by query"""
+        supabase = get_supabase()
         if not supabase:
             api.abort(500, "資料庫連線失敗")
         
@@ -701,6 +683,7 @@ class Materials(Resource):
     @ns_materials.marshal_with(success_response_model)
     def post(self):
         """Create a new material"""
+        supabase = get_supabase()
         if not supabase:
             api.abort(500, "資料庫連線失敗")
         
@@ -728,6 +711,7 @@ class Materials(Resource):
             }
             
             response = supabase.table('materials').insert(material_data).execute()
+            invalidate_materials_cache()
             
             if response.data:
                 return {
@@ -748,6 +732,7 @@ class MaterialById(Resource):
     @ns_materials.marshal_with(success_response_model)
     def get(self, material_id):
         """Get material by ID"""
+        supabase = get_supabase()
         if not supabase:
             api.abort(500, "資料庫連線失敗")
         
@@ -771,6 +756,7 @@ class MaterialById(Resource):
     @ns_materials.marshal_with(success_response_model)
     def put(self, material_id):
         """Update material by ID"""
+        supabase = get_supabase()
         if not supabase:
             api.abort(500, "資料庫連線失敗")
         
@@ -797,6 +783,7 @@ class MaterialById(Resource):
                 api.abort(400, "沒有提供有效的更新數據")
             
             response = supabase.table('materials').update(update_data).eq('material_id', material_id).execute()
+            invalidate_materials_cache()
             
             if response.data and len(response.data) > 0:
                 return {
@@ -815,6 +802,7 @@ class MaterialById(Resource):
     @ns_materials.marshal_with(success_response_model)
     def delete(self, material_id):
         """Delete material by ID"""
+        supabase = get_supabase()
         if not supabase:
             api.abort(500, "資料庫連線失敗")
         
@@ -827,6 +815,7 @@ class MaterialById(Resource):
             
             # Delete the material
             response = supabase.table('materials').delete().eq('material_id', material_id).execute()
+            invalidate_materials_cache()
             
             return {
                 "success": True,
@@ -871,6 +860,7 @@ def download_excel_template():
 
             # Define styles
             from openpyxl.styles import Font, PatternFill, Border, Side
+            from openpyxl.utils import get_column_letter
 
             # Header style - required columns
             required_fill = PatternFill(start_color="FFE6E6", end_color="FFE6E6", fill_type="solid")
@@ -892,8 +882,9 @@ def download_excel_template():
                     cell.fill = optional_fill
                     cell.font = optional_font
 
-                # Auto-adjust column width
-                worksheet.column_dimensions[cell.column_letter].width = 20
+            # Auto-adjust column width
+            for col_num in range(1, len(df.columns) + 1):
+                worksheet.column_dimensions[get_column_letter(col_num)].width = 20
 
         output.seek(0)
 
@@ -933,6 +924,7 @@ def download_match_template():
 
             # Define styles
             from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
+            from openpyxl.utils import get_column_letter
 
             # Header style - required column
             required_fill = PatternFill(start_color="FFE6E6", end_color="FFE6E6", fill_type="solid")
@@ -948,9 +940,12 @@ def download_match_template():
             # Apply styles to headers
             required_columns = ['材料名稱']
 
+            header_alignment = Alignment(horizontal='center', vertical='center')
+            column_widths = {'材料名稱': 25, '備註': 30}
+
             for col_num, column in enumerate(df.columns, 1):
                 cell = worksheet.cell(row=1, column=col_num)
-                cell.alignment = Alignment(horizontal='center', vertical='center')
+                cell.alignment = header_alignment
 
                 if column in required_columns:
                     cell.fill = required_fill
@@ -960,12 +955,7 @@ def download_match_template():
                     cell.font = optional_font
 
                 # Auto-adjust column width
-                if column == '材料名稱':
-                    worksheet.column_dimensions[cell.column_letter].width = 25
-                elif column == '備註':
-                    worksheet.column_dimensions[cell.column_letter].width = 30
-                else:
-                    worksheet.column_dimensions[cell.column_letter].width = 15
+                worksheet.column_dimensions[get_column_letter(col_num)].width = column_widths.get(column, 15)
 
             # Style example data rows
             for row_num in range(2, 5):  # Rows 2-4 (example data)
@@ -1005,9 +995,9 @@ def preview_excel_materials():
         # Create BytesIO object
         excel_buffer = io.BytesIO(file_content)
 
-        # Determine engine based on file extension
+        # Prefer calamine (reads both .xlsx and .xls); otherwise pick by file extension
         filename = file.filename.lower()
-        engine = 'openpyxl' if filename.endswith('.xlsx') else 'xlrd'
+        engine = EXCEL_READ_ENGINE or ('openpyxl' if filename.endswith('.xlsx') else 'xlrd')
 
         print(f"Using pandas engine: {engine}")
 
@@ -1030,43 +1020,57 @@ def preview_excel_materials():
         preview_data = []
         validation_errors = []
 
-        for index, row in df.iterrows():
+        # Precompute column values once instead of per-row Series lookups
+        material_names = df['material_name'].astype(str).str.strip().tolist()
+        carbon_footprints = df['carbon_footprint'].tolist()
+        declaration_units = df['declaration_unit'].astype(str).str.strip().tolist()
+        optional_values = {
+            field: df[field].astype(str).str.strip().where(df[field].notna(), '').tolist()
+            for field in optional_columns
+            if field in df.columns and field != 'announcement_year'
+        }
+        year_present = year_values = None
+        if 'announcement_year' in df.columns:
+            year_present = df['announcement_year'].notna().tolist()
+            year_values = pd.to_numeric(df['announcement_year'], errors='coerce').tolist()
+
+        for i, index in enumerate(df.index):
             row_data = {}
             row_errors = []
 
             try:
                 # Required fields
-                row_data['material_name'] = str(row['material_name']).strip()
+                row_data['material_name'] = material_names[i]
                 if not row_data['material_name'] or row_data['material_name'].lower() == 'nan':
                     row_errors.append("Material name cannot be empty")
 
                 try:
-                    row_data['carbon_footprint'] = float(row['carbon_footprint'])
+                    row_data['carbon_footprint'] = float(carbon_footprints[i])
                     if row_data['carbon_footprint'] < 0:
                         row_errors.append("Carbon footprint must be non-negative")
                 except (ValueError, TypeError):
                     row_errors.append("Invalid carbon footprint value")
                     row_data['carbon_footprint'] = None
 
-                row_data['declaration_unit'] = str(row['declaration_unit']).strip()
+                row_data['declaration_unit'] = declaration_units[i]
                 if not row_data['declaration_unit'] or row_data['declaration_unit'].lower() == 'nan':
                     row_errors.append("Declaration unit cannot be empty")
 
                 # Optional fields
                 for field in optional_columns:
-                    if field in df.columns and pd.notna(row[field]):
-                        if field == 'announcement_year':
-                            try:
-                                row_data[field] = int(float(row[field]))
-                                if row_data[field] < 1900 or row_data[field] > 2100:
-                                    row_errors.append("Invalid announcement year")
-                            except (ValueError, TypeError):
+                    if field == 'announcement_year':
+                        if year_present and year_present[i]:
+                            if pd.isna(year_values[i]):
                                 row_errors.append("Invalid announcement year format")
                                 row_data[field] = None
+                            else:
+                                row_data[field] = int(year_values[i])
+                                if row_data[field] < 1900 or row_data[field] > 2100:
+                                    row_errors.append("Invalid announcement year")
                         else:
-                            row_data[field] = str(row[field]).strip()
+                            row_data[field] = ''
                     else:
-                        row_data[field] = ''
+                        row_data[field] = optional_values[field][i] if field in optional_values else ''
 
                 # Add row index and validation status
                 row_data['row_index'] = index + 2  # Excel rows start at 2 (accounting for header)
@@ -1117,6 +1121,7 @@ def preview_excel_materials():
 @app.route('/api/materials/import-excel', methods=['POST'])
 def import_materials_from_excel():
     """Import materials from previewed Excel data"""
+    supabase = get_supabase()
     if not supabase:
         return jsonify({"error": "Database connection not available"}), 500
 
@@ -1194,16 +1199,15 @@ class GMapProcess(Resource):
         if not origin or not destinations_text: 
             api.abort(400, "必須提供出發地和目的地。")
         
-        destinations = [addr.strip() for addr in destinations_text.split('\n') if addr.strip()]
+        destinations = split_nonempty_lines(destinations_text)
         session_id = f"session_{int(time.time())}"
         today_str = datetime.now().strftime("%Y-%m-%d")
         image_folder_path = os.path.join(app.config['SCREENSHOTS_FOLDER'], today_str, session_id)
         os.makedirs(image_folder_path, exist_ok=True)
         
         try:
-            # 使用Google Maps機器人
-            robot = GoogleMapsRobot(headless=True)
-            robot_results = robot.process_multiple_routes(origin, destinations, image_folder_path)
+            # 使用Google Maps機器人（從 driver 池借用多個已啟動的瀏覽器同時查詢）
+            robot_results = process_routes_concurrently(origin, destinations, image_folder_path)
             
             # 轉換結果格式以符合前端期望
             results = []
@@ -1233,22 +1237,35 @@ class GMapProcess(Resource):
 def download_excel(session_id):
     session_data = SESSION_RESULTS_CACHE.get(session_id)
     if not session_data: return "Session not found or expired.", 404
-    export_data = [{"起始點": item['origin'], "終點": item['destination'], "距離": item['distance'], "圖片名稱": item['image_filename']} for item in session_data]
-    df = pd.DataFrame(export_data)
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer: df.to_excel(writer, index=False, sheet_name='路線距離報告')
-    output.seek(0)
-    return send_file(output, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', as_attachment=True, download_name=f'google_maps_report_{session_id}.xlsx')
+    # 同一批結果重複下載時直接沿用先前產生的報表
+    cached = EXCEL_EXPORT_CACHE.get(session_id)
+    if cached and cached[0] is session_data:
+        content = cached[1]
+    else:
+        # 與 /api/gmap 路由共用同一個 xlsxwriter 報表產生器與欄位定義
+        content = build_route_report(session_data)
+        EXCEL_EXPORT_CACHE[session_id] = (session_data, content)
+    return send_file(io.BytesIO(content), mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', as_attachment=True, download_name=f'google_maps_report_{session_id}.xlsx')
 
 @app.route('/api/download/zip/<session_id>', methods=['GET'])
 def download_zip(session_id):
-    session_data = SESSION_RESULTS_CACHE.get(session_id)
-    if not session_data: return "Session not found or expired.", 404
-    memory_file = io.BytesIO()
-    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for item in session_data: zf.write(item['image_local_path'], arcname=item['image_filename'])
-    memory_file.seek(0)
-    return send_file(memory_file, mimetype='application/zip', as_attachment=True, download_name=f'map_images_{session_id}.zip')
+    # 讀取前先鎖定 session，避免截圖在開始傳送前或傳送期間被淘汰；回應關閉時才解除
+    SESSION_RESULTS_CACHE.add_pin(session_id)
+    try:
+        session_data = SESSION_RESULTS_CACHE.get(session_id)
+        if not session_data:
+            SESSION_RESULTS_CACHE.remove_pin(session_id)
+            return "Session not found or expired.", 404
+        files = [(item['image_local_path'], item['image_filename']) for item in session_data
+                 if item.get('image_local_path')]
+        # 邊壓縮邊傳送，不在記憶體中組出整個 ZIP
+        response = Response(iter_zip(files), mimetype='application/zip')
+        response.headers.set('Content-Disposition', 'attachment', filename=f'map_images_{session_id}.zip')
+    except Exception:
+        SESSION_RESULTS_CACHE.remove_pin(session_id)
+        raise
+    response.call_on_close(lambda: SESSION_RESULTS_CACHE.remove_pin(session_id))
+    return response
 
 @app.route('/screenshots/<path:path>')
 def send_screenshot(path):
@@ -1293,9 +1310,18 @@ class OCRProcessPDF(Resource):
 def download_ocr_report(filename):
     return send_from_directory(app.config['REPORTS_FOLDER'], filename, as_attachment=True)
 
+# 設定 OCR_PRELOAD_ENGINES=True 並以 gunicorn --preload 啟動時，在主行程先載入 OCR 引擎，
+# fork 出的 worker 以 copy-on-write 共用同一份模型記憶體，不必每個 worker 各載一次。
+# 僅限沒有 GPU 的機器：在主行程初始化 CUDA 後，fork 出的 worker 無法再使用 CUDA
+if os.getenv('OCR_PRELOAD_ENGINES', 'False').lower() == 'true':
+    if can_preload_engines():
+        init_ocr_engines()
+    else:
+        print("偵測到 CUDA，略過 OCR 引擎預先載入，改由各 worker 首次使用時載入")
+
 # --- 主程式進入點 ---
 if __name__ == '__main__':
-    for folder_key in ['SCREENSHOTS_FOLDER', 'UPLOAD_FOLDER', 'REPORTS_FOLDER', 'TEMP_IMG_FOLDER', 'CROPPED_RECEIPTS_FOLDER']:
+    for folder_key in ['SCREENSHOTS_FOLDER', 'UPLOAD_FOLDER', 'REPORTS_FOLDER']:
         folder_path = app.config[folder_key]
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
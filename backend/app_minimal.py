@@ -54,14 +54,12 @@ def create_app():
     )
     
     # Initialize database client
+    # Routes and services call get_supabase() per request, so the client is created lazily
+    # and a failed connection is retried instead of being kept for the life of the process
     db_client = None
     try:
-        from supabase_client import supabase
-        db_client = supabase
-        if db_client:
-            logger.info("Database client initialized successfully")
-        else:
-            logger.warning("Database client is None - check Supabase configuration")
+        from supabase_client import get_supabase
+        db_client = get_supabase
     except ImportError as e:
         logger.error(f"Failed to import Supabase client: {str(e)}")
     except Exception as e:
@@ -142,8 +140,9 @@ def legacy_material_match():
     from flask import request
     try:
         from services.material_service import MaterialService
-        from supabase_client import supabase
+        from supabase_client import get_supabase
         
+        supabase = get_supabase()
         if not supabase:
             return jsonify({"error": "Database connection failed"}), 500
         
@@ -166,8 +165,9 @@ def legacy_materials_all():
     """Legacy endpoint to get all materials"""
     try:
         from services.material_service import MaterialService
-        from supabase_client import supabase
+        from supabase_client import get_supabase
         
+        supabase = get_supabase()
         if not supabase:
             return jsonify({"error": "Database connection failed"}), 500
         
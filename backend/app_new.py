@@ -18,6 +18,7 @@ except AttributeError:
 from config.config import get_config
 from models.exceptions import BaseAppException
 from utils.helpers import format_error_response, ensure_directory_exists
+from utils.json_provider import init_json
 
 # Import route modules
 from routes.general_routes import create_general_routes, create_static_routes
@@ -27,7 +28,7 @@ from routes.gmap_routes import create_gmap_routes
 
 # Setup logging
 logging.basicConfig(
-    level=logging.INFO,
+    level=getattr(logging, get_config().LOG_LEVEL, logging.INFO),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
@@ -55,15 +56,16 @@ def create_app():
         prefix='/api'
     )
     
+    # Serialize JSON responses with orjson when available
+    init_json(app, api)
+    
     # Initialize database client
+    # Routes and services call get_supabase() per request, so the client is created lazily
+    # and a failed connection is retried instead of being kept for the life of the process
     db_client = None
     try:
-        from supabase_client import supabase
-        db_client = supabase
-        if db_client:
-            logger.info("Database client initialized successfully")
-        else:
-            logger.warning("Database client is None - check Supabase configuration")
+        from supabase_client import get_supabase
+        db_client = get_supabase
     except ImportError as e:
         logger.error(f"Failed to import Supabase client: {str(e)}")
     except Exception as e:
@@ -163,9 +165,7 @@ def create_app():
     directories = [
         config.UPLOAD_FOLDER,
         config.SCREENSHOTS_FOLDER,
-        config.REPORTS_FOLDER,
-        config.TEMP_IMG_FOLDER,
-        config.CROPPED_RECEIPTS_FOLDER
+        config.REPORTS_FOLDER
     ]
     
     for directory in directories:
@@ -186,8 +186,9 @@ def legacy_material_match():
     from flask import request
     try:
         from services.material_service import MaterialService
-        from supabase_client import supabase
+        from supabase_client import get_supabase
         
+        supabase = get_supabase()
         if not supabase:
             return jsonify({"error": "Database connection failed"}), 500
         
@@ -9,13 +9,12 @@ from flask import Flask, jsonify, request, send_file, send_from_directory
 from flask_cors import CORS
 from gmap_robot import GoogleMapsRobot
 try:
-    from supabase_client import supabase
+    from supabase_client import get_supabase
     from services.material_service import MaterialService
     print("✅ Database connection available")
-    material_service = MaterialService(supabase) if supabase else None
+    material_service = MaterialService(get_supabase)
 except ImportError as e:
     print(f"⚠️ Database modules not available: {e}")
-    supabase = None
     material_service = None
 
 app = Flask(__name__)
@@ -160,7 +159,7 @@ def download_zip(session_id):
 @app.route('/api/materials/all', methods=['GET'])
 def get_all_materials():
     """Get all materials from database"""
-    if not material_service:
+    if not material_service or not material_service.db:
         return jsonify({"error": "Database connection not available"}), 500
     
     try:
@@ -346,7 +345,7 @@ def preview_excel_materials():
 @app.route('/api/materials/import-excel', methods=['POST'])
 def import_materials_from_excel():
     """Import materials from previewed Excel data"""
-    if not material_service:
+    if not material_service or not material_service.db:
         return jsonify({"error": "Database connection not available"}), 500
     
     try:
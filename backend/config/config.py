@@ -9,6 +9,8 @@ class Config:
     # Flask configuration
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key')
     DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
+    # Root log level (e.g. WARNING in production skips the per-request INFO logs)
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
     
     # Database configuration
     SUPABASE_URL = os.getenv('SUPABASE_URL')
@@ -25,6 +27,9 @@ class Config:
     TEMP_IMG_FOLDER = os.path.join(BASE_DIR, 'temp_imgs')
     CROPPED_RECEIPTS_FOLDER = os.path.join(BASE_DIR, 'cropped_receipts')
     
+    # Let a fronting nginx/Apache serve send_file downloads (X-Sendfile); only enable behind such a proxy
+    USE_X_SENDFILE = os.getenv('USE_X_SENDFILE', 'False').lower() == 'true'
+    
     # File upload limits
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
     ALLOWED_EXTENSIONS = {'pdf', 'xlsx', 'xls'}
@@ -33,9 +38,34 @@ class Config:
     API_TIMEOUT = 30
     RATE_LIMIT = "100 per hour"
     
+    # Google Maps session results kept in memory (least recently used are evicted)
+    SESSION_CACHE_MAXSIZE = int(os.getenv('SESSION_CACHE_MAXSIZE', '100'))
+    
+    # Geocoding results cached in memory; set GEOCODE_CACHE_DIR to also persist them with diskcache
+    GEOCODE_CACHE_MAXSIZE = int(os.getenv('GEOCODE_CACHE_MAXSIZE', '4096'))
+    GEOCODE_CACHE_DIR = os.getenv('GEOCODE_CACHE_DIR', '')
+    # Add driving durations to /gmap/process results with one distance_matrix call per 25 routes (billed per route)
+    GMAP_ROUTE_DURATIONS = os.getenv('GMAP_ROUTE_DURATIONS', 'False').lower() == 'true'
+    
     # OCR configuration
     OCR_DPI = 300
     OCR_CONTOUR_AREA_THRESHOLD = 5000
+    # Invoice crops are OCR'd in memory; set to also write them to CROPPED_RECEIPTS_FOLDER for debugging
+    OCR_SAVE_CROPS = os.getenv('OCR_SAVE_CROPS', 'False').lower() == 'true'
+    # Threads running background OCR jobs (/api/ocr/jobs) per worker process
+    OCR_JOB_WORKERS = int(os.getenv('OCR_JOB_WORKERS', '1'))
+    # Background OCR job records, one JSON file each so every worker can answer status polls;
+    # the newest OCR_JOB_MAXSIZE finished jobs are kept and unfinished jobs are never evicted
+    OCR_JOBS_FOLDER = os.getenv('OCR_JOBS_FOLDER', os.path.join(BASE_DIR, 'ocr_jobs'))
+    OCR_JOB_MAXSIZE = int(os.getenv('OCR_JOB_MAXSIZE', '100'))
+    # Unfinished jobs are marked failed (and their upload deleted) once their worker exits or after this many seconds
+    OCR_JOB_TIMEOUT = int(os.getenv('OCR_JOB_TIMEOUT', '3600'))
+    # Load OCR models at startup so gunicorn --preload workers share them copy-on-write.
+    # CPU-only: on a CUDA machine the preload is skipped, since forked workers cannot use the master's CUDA
+    OCR_PRELOAD_ENGINES = os.getenv('OCR_PRELOAD_ENGINES', 'False').lower() == 'true'
+    # OCR results per invoice crop, cached in memory; set OCR_CACHE_DIR to also persist them with diskcache
+    OCR_CACHE_MAXSIZE = int(os.getenv('OCR_CACHE_MAXSIZE', '1024'))
+    OCR_CACHE_DIR = os.getenv('OCR_CACHE_DIR', '')
 
 class DevelopmentConfig(Config):
     """Development configuration"""
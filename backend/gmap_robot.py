@@ -3,10 +3,15 @@
 
 import sys
 import time
+import atexit
 import os
+import queue
 import datetime
+import threading
 import pandas as pd
 import urllib.parse
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 # 解決輸出亂碼問題
 try:
@@ -20,9 +25,68 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.chrome.service import Service
 
+# Cookie 同意按鈕的 CSS 選擇器（CSS 比 XPath 快，且只保留實際會出現的按鈕）
+COOKIE_ACCEPT_SELECTORS = (
+    "button#L2AGLb",  # Google常用的接受按鈕ID
+    "div.QS5gu.sy4vM button:nth-of-type(2)",  # Google Maps特定選擇器
+    "button[aria-label*='Accept']",
+    "button[aria-label*='全部接受']",
+    "button[aria-label*='接受全部']",
+)
+COOKIE_ACCEPT_CONDITIONS = tuple(
+    EC.element_to_be_clickable((By.CSS_SELECTOR, selector)) for selector in COOKIE_ACCEPT_SELECTORS
+)
+
+# 點擊路線後出現的「此路線」詳細面板
+ROUTE_DETAIL_LOCATOR = (By.XPATH, "//*[contains(text(), '此路線')]")
+
+def route_selected(route_element):
+    """等待條件：路線區塊已標記為選取（class 含 selected）；區塊被重新渲染而失效也視為完成"""
+    def _condition(driver):
+        try:
+            return 'selected' in (route_element.get_attribute('class') or '')
+        except StaleElementReferenceException:
+            return True
+    return _condition
+
+class ScreenshotWriter:
+    """背景寫檔執行緒：截圖以 PNG bytes 排入佇列，瀏覽器不必等硬碟寫入就能載入下一頁"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            path, data = item
+            try:
+                with open(path, "wb") as f:
+                    f.write(data)
+            except OSError as e:
+                print(f"❌ 截圖寫入失敗 {path}: {e}")
+
+    def write(self, path, data):
+        self._queue.put((path, data))
+
+    def close(self):
+        """等待佇列中的截圖全部寫完"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 class GoogleMapsRobot:
     """Google Maps 自動化機器人類別"""
     
@@ -33,6 +97,17 @@ class GoogleMapsRobot:
         self.lang = lang
         self.driver = None
         self.wait = None
+        self._owns_driver = True
+        self.screenshot_writer = None
+
+    @classmethod
+    def from_driver(cls, driver, **kwargs):
+        """使用已啟動的瀏覽器建立機器人（例如從 DriverPool 借出的 driver）"""
+        robot = cls(**kwargs)
+        robot.driver = driver
+        robot.wait = WebDriverWait(driver, 10)
+        robot._owns_driver = False
+        return robot
         
     def _setup_driver(self):
         """設定Chrome瀏覽器"""
@@ -116,35 +191,19 @@ class GoogleMapsRobot:
     def _handle_cookies(self):
         """處理Google Maps的Cookie同意介面"""
         try:
-            # 等待並尋找Cookie同意按鈕
-            cookie_selectors = [
-                "//button[contains(text(), '全部接受')]",
-                "//button[contains(text(), 'Accept all')]", 
-                "//button[contains(text(), '接受全部')]",
-                "//button[contains(text(), '同意')]",
-                "//button[contains(text(), 'Agree')]",
-                "//button[@id='L2AGLb']",  # Google常用的接受按鈕ID
-                "//div[contains(@class, 'QS5gu sy4vM')]//button[2]",  # Google Maps特定選擇器
-                "//button[contains(@aria-label, 'Accept')]",
-                "//button[contains(@data-value, 'Accept')]"
-            ]
-            
-            # 嘗試點擊任何找到的Cookie同意按鈕
-            for selector in cookie_selectors:
-                try:
-                    accept_button = WebDriverWait(self.driver, 2).until(  # Reduced from 3 to 2 seconds
-                        EC.element_to_be_clickable((By.XPATH, selector))
-                    )
-                    accept_button.click()
-                    print("✅ 已自動接受Cookie")
-                    time.sleep(1)  # Reduced from 2 to 1 second
-                    return True
-                except:
-                    continue
-            
+            # 單一等待同時比對所有選擇器，最多等待 2 秒
+            accept_button = WebDriverWait(self.driver, 2).until(
+                EC.any_of(*COOKIE_ACCEPT_CONDITIONS)
+            )
+            accept_button.click()
+            print("✅ 已自動接受Cookie")
+            time.sleep(1)  # Reduced from 2 to 1 second
+            return True
+
+        except TimeoutException:
             print("ℹ️ 未發現Cookie同意介面")
             return False
-            
+
         except Exception as e:
             print(f"⚠️ 處理Cookie時發生錯誤: {e}")
             return False
@@ -171,9 +230,9 @@ class GoogleMapsRobot:
 
         print(f"查詢路線：{origin} -> {destination}")
         self.driver.get(url)
-        time.sleep(3)  # Reduced from 8 to 3 seconds
 
         try:
+            # self.wait 會輪詢直到路線區塊出現，不需要固定等待
             route_blocks = self.wait.until(
                 EC.presence_of_all_elements_located(
                     (By.XPATH, "//div[starts-with(@id, 'section-directions-trip-')]")
@@ -204,7 +263,14 @@ class GoogleMapsRobot:
 
                 print(f"✔ 取得最短距離：{distance_text}，點擊該路線")
                 route_element.click()
-                time.sleep(1)  # Reduced from 3 to 1 second
+                # 等到「此路線」面板出現或區塊變成選取狀態，取代固定 sleep；區塊點擊後不一定會消失
+                try:
+                    WebDriverWait(self.driver, 2).until(EC.any_of(
+                        EC.presence_of_element_located(ROUTE_DETAIL_LOCATOR),
+                        route_selected(route_element),
+                    ))
+                except TimeoutException:
+                    pass
             else:
                 distance_text = "查無距離資訊"
                 print("❌ 找不到距離資訊。")
@@ -215,11 +281,57 @@ class GoogleMapsRobot:
 
         # 截圖
         if screenshot_path:
-            self.driver.save_screenshot(screenshot_path)
+            if self.screenshot_writer is not None:
+                self.screenshot_writer.write(screenshot_path, self.driver.get_screenshot_as_png())
+            else:
+                self.driver.save_screenshot(screenshot_path)
             print(f"🖼️ 截圖儲存：{screenshot_path}")
 
         return distance_text
     
+    def open_maps(self):
+        """先訪問Google Maps主頁處理Cookie（每個瀏覽器只需要做一次）"""
+        try:
+            print("🔄 初始化Google Maps...")
+            self.driver.get("https://www.google.com/maps")
+            self._handle_cookies()
+            time.sleep(1)  # Reduced from 2 to 1 second
+            print("✅ Google Maps初始化完成")
+        except Exception as e:
+            print(f"⚠️ 初始化Google Maps時發生錯誤: {e}")
+
+    def process_route(self, idx, origin, origin_city, raw_dest, screenshot_folder=None):
+        """處理第 idx 個目的地：轉換地址、查詢距離並截圖"""
+        resolved = self.resolve_address(raw_dest, origin_city)
+        if isinstance(resolved, list):
+            print(f"❗ 地址「{raw_dest}」為區名，轉換為查詢公所：{resolved[0]}")
+            destination = resolved[0]
+        else:
+            destination = resolved
+
+        # 設定截圖路徑
+        screenshot_path = None
+        if screenshot_folder:
+            safe_dest_name = "".join(c for c in destination if c.isalnum())[:20]
+            screenshot_name = f"map_{idx}_{safe_dest_name}.png"
+            screenshot_path = os.path.join(screenshot_folder, screenshot_name)
+
+        # 查詢路線
+        distance_text = self.query_single_route(origin, destination, screenshot_path)
+
+        # 收集結果
+        result = {
+            "origin": origin,
+            "destination": destination,
+            "distance": distance_text,
+        }
+        
+        if screenshot_path:
+            result["image_filename"] = os.path.basename(screenshot_path)
+            result["image_local_path"] = screenshot_path
+        
+        return result
+
     def process_multiple_routes(self, origin, destinations, screenshot_folder=None):
         """處理多個目的地的路線查詢"""
         if not isinstance(destinations, list):
@@ -232,55 +344,20 @@ class GoogleMapsRobot:
         if screenshot_folder:
             os.makedirs(screenshot_folder, exist_ok=True)
         
-        # 初始化瀏覽器
-        self._setup_driver()
+        # 初始化瀏覽器（借用的 driver 已經啟動）
+        if self.driver is None:
+            self._setup_driver()
         
-        # 先訪問Google Maps主頁處理Cookie（只需要做一次）
-        try:
-            print("🔄 初始化Google Maps...")
-            self.driver.get("https://www.google.com/maps")
-            self._handle_cookies()
-            time.sleep(1)  # Reduced from 2 to 1 second
-            print("✅ Google Maps初始化完成")
-        except Exception as e:
-            print(f"⚠️ 初始化Google Maps時發生錯誤: {e}")
+        self.open_maps()
         
         try:
             for idx, raw_dest in enumerate(destinations):
-                resolved = self.resolve_address(raw_dest, origin_city)
-                if isinstance(resolved, list):
-                    print(f"❗ 地址「{raw_dest}」為區名，轉換為查詢公所：{resolved[0]}")
-                    destination = resolved[0]
-                else:
-                    destination = resolved
-
-                # 設定截圖路徑
-                screenshot_path = None
-                if screenshot_folder:
-                    safe_dest_name = "".join(c for c in destination if c.isalnum())[:20]
-                    screenshot_name = f"map_{idx}_{safe_dest_name}.png"
-                    screenshot_path = os.path.join(screenshot_folder, screenshot_name)
-
-                # 查詢路線
-                distance_text = self.query_single_route(origin, destination, screenshot_path)
-
-                # 收集結果
-                result = {
-                    "origin": origin,
-                    "destination": destination,
-                    "distance": distance_text,
-                }
-                
-                if screenshot_path:
-                    result["image_filename"] = os.path.basename(screenshot_path)
-                    result["image_local_path"] = screenshot_path
-                
-                results.append(result)
-                time.sleep(0.5)  # Reduced from 2 to 0.5 seconds
+                results.append(self.process_route(idx, origin, origin_city, raw_dest, screenshot_folder))
 
         finally:
-            # 清理瀏覽器
-            self._teardown_driver()
+            # 清理瀏覽器（借用的 driver 由 DriverPool 回收）
+            if self._owns_driver:
+                self._teardown_driver()
 
         return results
     
@@ -310,6 +387,199 @@ class GoogleMapsRobot:
         
         return results, csv_path
 
+# 單一請求同時使用的瀏覽器數，也是 DriverPool 的預設大小
+DEFAULT_ROBOT_WORKERS = 4
+
+class DriverPool:
+    """常駐的 Chrome driver 池，讓每個請求不必重新啟動瀏覽器
+
+    最多保留 max_idle 個閒置 driver；其餘閒置超過 idle_timeout 秒的 driver 由背景執行緒關閉。
+    """
+
+    def __init__(self, size=None, max_idle=1, idle_timeout=60, **robot_options):
+        self.size = size or DEFAULT_ROBOT_WORKERS
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.robot_options = robot_options
+        # (driver, 歸還時間)，依歸還時間由舊到新排列
+        self._idle = []
+        self._created = 0
+        self._reaper = None
+        # 歸還或丟棄 driver 時都會 notify，讓等待中的請求取用或補建 driver
+        self._cond = threading.Condition()
+
+    def _create_driver(self):
+        robot = GoogleMapsRobot(**self.robot_options)
+        robot._setup_driver()
+        return robot.driver
+
+    def _release_slot(self):
+        with self._cond:
+            self._created -= 1
+            self._cond.notify()
+
+    def _discard(self, driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        self._release_slot()
+
+    def _checkout(self):
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()[0]
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                # 池已滿，等待其他請求歸還或丟棄 driver
+                self._cond.wait()
+
+        try:
+            return self._create_driver()
+        except Exception:
+            self._release_slot()
+            raise
+
+    def _checkin(self, driver):
+        with self._cond:
+            self._idle.append((driver, time.monotonic()))
+            self._cond.notify()
+            if self._reaper is None and self.idle_timeout:
+                self._reaper = threading.Thread(target=self._reap_forever, name="driver-pool-reaper", daemon=True)
+                self._reaper.start()
+
+    def _reap_forever(self):
+        while True:
+            time.sleep(self.idle_timeout)
+            self.reap()
+
+    def reap(self):
+        """關閉超過 max_idle 且閒置超過 idle_timeout 的 driver"""
+        now = time.monotonic()
+        with self._cond:
+            surplus = self._idle[:max(len(self._idle) - self.max_idle, 0)]
+            expired = sum(1 for _, returned_at in surplus if now - returned_at >= self.idle_timeout)
+            drivers = [driver for driver, _ in self._idle[:expired]]
+            del self._idle[:expired]
+        for driver in drivers:
+            self._discard(driver)
+
+    def warm(self, count=None):
+        """預先啟動 driver，讓第一個請求也不必等待瀏覽器啟動"""
+        for _ in range(count or self.size):
+            with self._cond:
+                if self._created >= self.size:
+                    return
+                self._created += 1
+            try:
+                driver = self._create_driver()
+            except Exception:
+                self._release_slot()
+                raise
+            self._checkin(driver)
+
+    @contextmanager
+    def acquire(self):
+        """借出一個 driver；正常結束後清除 Cookie 並歸還，發生錯誤則關閉"""
+        driver = self._checkout()
+        try:
+            yield driver
+        except BaseException:
+            self._discard(driver)
+            raise
+
+        try:
+            driver.delete_all_cookies()
+        except Exception:
+            self._discard(driver)
+        else:
+            self._checkin(driver)
+
+    def close(self):
+        """關閉所有閒置的 driver"""
+        with self._cond:
+            drivers, self._idle = [driver for driver, _ in self._idle], []
+        for driver in drivers:
+            self._discard(driver)
+
+
+_driver_pool = None
+_driver_pool_lock = threading.Lock()
+
+def get_driver_pool():
+    """取得行程內共用的 DriverPool（延遲建立，避免 --preload 時在主行程啟動瀏覽器）"""
+    global _driver_pool
+    with _driver_pool_lock:
+        if _driver_pool is None:
+            size = int(os.getenv("GMAP_DRIVER_POOL_SIZE", 0)) or int(os.getenv("GMAP_ROBOT_WORKERS", DEFAULT_ROBOT_WORKERS))
+            _driver_pool = DriverPool(
+                size=size,
+                max_idle=int(os.getenv("GMAP_DRIVER_POOL_MAX_IDLE", 1)),
+                idle_timeout=int(os.getenv("GMAP_DRIVER_IDLE_TIMEOUT", 60)),
+                headless=True,
+            )
+            # --max-requests 回收 worker 時關閉瀏覽器，避免留下孤兒 Chrome 行程
+            atexit.register(_driver_pool.close)
+        return _driver_pool
+
+def warm_driver_pool_in_background():
+    """在背景執行緒預熱 DriverPool（由 gunicorn post_fork 在每個 worker 呼叫）"""
+    count = int(os.getenv("GMAP_DRIVER_POOL_WARM", 0))
+    if count <= 0:
+        return
+
+    def warm():
+        try:
+            get_driver_pool().warm(count)
+        except Exception as e:
+            print(f"⚠️ DriverPool 預熱失敗: {e}")
+
+    threading.Thread(target=warm, name="driver-pool-warm", daemon=True).start()
+
+def process_routes_concurrently(origin, destinations, screenshot_folder=None, max_workers=None):
+    """以多個 DriverPool 瀏覽器同時查詢路線，結果依目的地順序回傳"""
+    if screenshot_folder:
+        os.makedirs(screenshot_folder, exist_ok=True)
+    if not destinations:
+        return []
+
+    pool = get_driver_pool()
+    max_workers = max_workers or int(os.getenv("GMAP_ROBOT_WORKERS", DEFAULT_ROBOT_WORKERS))
+    workers = max(1, min(max_workers, pool.size, len(destinations)))
+
+    tasks = queue.Queue()
+    for task in enumerate(destinations):
+        tasks.put(task)
+    results = [None] * len(destinations)
+
+    def worker(writer):
+        # 每個執行緒借用自己的 driver（Selenium driver 不能跨執行緒共用），處理到佇列清空為止
+        try:
+            idx, raw_dest = tasks.get_nowait()
+        except queue.Empty:
+            return
+        with pool.acquire() as driver:
+            robot = GoogleMapsRobot.from_driver(driver)
+            robot.screenshot_writer = writer
+            robot.open_maps()
+            origin_city = robot.get_origin_city(origin)
+            while True:
+                results[idx] = robot.process_route(idx, origin, origin_city, raw_dest, screenshot_folder)
+                try:
+                    idx, raw_dest = tasks.get_nowait()
+                except queue.Empty:
+                    return
+
+    # 截圖由單一寫檔執行緒存檔；離開 with 前等所有檔案寫完，回傳的路徑即可下載
+    with ScreenshotWriter() as writer, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(worker, writer) for _ in range(workers)]
+        for future in futures:
+            future.result()
+
+    return results
+
 # 向後兼容的函式
 def process_gmap_from_excel(excel_file, address_column, origin, output_folder=None):
     """向後兼容的函式"""
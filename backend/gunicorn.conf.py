@@ -0,0 +1,10 @@
+# Gunicorn loads ./gunicorn.conf.py automatically; the command-line flags in
+# Procfile / railway.json still apply on top of it.
+
+
+def post_fork(server, worker):
+    # With GMAP_DRIVER_POOL_WARM set, start Chrome in each worker (never in the
+    # --preload master) so the first route request does not wait for a browser to boot.
+    from gmap_robot import warm_driver_pool_in_background
+
+    warm_driver_pool_in_background()
@@ -1,10 +1,59 @@
 from flask_restx import fields
 
+# Precompiled response marshallers for the hot list endpoints. They produce the
+# same output as marshal_with(gmap_response / ocr_response) without walking the
+# field definitions on every request; keep them in sync with the models below.
+
+def _string(value):
+    return None if value is None else str(value)
+
+def marshal_gmap_result(result):
+    return {
+        'origin': _string(result.get('origin')),
+        'destination': _string(result.get('destination')),
+        'distance': _string(result.get('distance')),
+        'image_filename': _string(result.get('image_filename')),
+        'screenshot_url': _string(result.get('screenshot_url')),
+        'duration': _string(result.get('duration'))
+    }
+
+def marshal_gmap_response(response):
+    results = response.get('results')
+    return {
+        'results': None if results is None else [marshal_gmap_result(r) for r in results],
+        'session_id': _string(response.get('session_id'))
+    }
+
+def marshal_ocr_result(result):
+    return {
+        '頁數': _string(result.get('頁數')),
+        '發票號碼': _string(result.get('發票號碼')),
+        '日期': _string(result.get('日期')),
+        '種類': _string(result.get('種類')),
+        '數量': _string(result.get('數量')),
+        '地址': _string(result.get('地址')),
+        '備註': _string(result.get('備註'))
+    }
+
+def marshal_ocr_response(response):
+    data = response.get('data')
+    return {
+        'message': _string(response.get('message')),
+        'download_url': _string(response.get('download_url')),
+        'data': None if data is None else [marshal_ocr_result(r) for r in data]
+    }
+
 class APISchemas:
     """Central location for API schemas"""
     
-    @staticmethod
-    def create_api_models(api):
+    # Models registered per Api instance; each route module asks for them
+    _cache = {}
+    
+    @classmethod
+    def create_api_models(cls, api):
+        if api in cls._cache:
+            return cls._cache[api]
+        
         # Error models
         error_model = api.model('Error', {
             'error': fields.String(required=True, description='Error message'),
@@ -43,6 +92,10 @@ class APISchemas:
             'queries': fields.List(fields.String, required=True, description='List of material names to search')
         })
 
+        material_list_model = api.model('MaterialList', {
+            'materials': fields.List(fields.Nested(material_model), required=True, description='Materials to create or update')
+        })
+
         # Google Maps models
         gmap_request_model = api.model('GMapRequest', {
             'origin': fields.String(required=True, description='Starting location'),
@@ -54,7 +107,8 @@ class APISchemas:
             'destination': fields.String(required=True, description='Destination'),
             'distance': fields.String(required=True, description='Distance information'),
             'image_filename': fields.String(description='Screenshot filename'),
-            'screenshot_url': fields.String(description='Screenshot URL')
+            'screenshot_url': fields.String(description='Screenshot URL'),
+            'duration': fields.String(description='Driving duration (when GMAP_ROUTE_DURATIONS is enabled)')
         })
 
         gmap_response_model = api.model('GMapResponse', {
@@ -86,16 +140,18 @@ class APISchemas:
             'data': fields.Raw(description='Response data')
         })
 
-        return {
+        cls._cache[api] = {
             'error': error_model,
             'material': material_model,
             'material_match': material_match_model,
             'material_batch_result': material_batch_result_model,
             'material_queries': material_queries_model,
+            'material_list': material_list_model,
             'gmap_request': gmap_request_model,
             'gmap_result': gmap_result_model,
             'gmap_response': gmap_response_model,
             'ocr_result': ocr_result_model,
             'ocr_response': ocr_response_model,
             'success_response': success_response_model
-        }
\ No newline at end of file
+        }
+        return cls._cache[api]
\ No newline at end of file
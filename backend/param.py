@@ -1,5 +1,11 @@
 import re
 from datetime import datetime
+from functools import lru_cache
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
 fuel_keywords = [
     '超级柴油','九五無鉛', '九二無鉛', '九八無鉛', '無鉛汽油', '超柴', '98號', '95號',
@@ -10,42 +16,146 @@ fuel_mapping = {
     '九八': '九八無鉛', '98': '九八無鉛', '超级柴油': '超級柴油', '超柴': '超級柴油',
     '柴油': '超級柴油',
 }
+# Canonical fuel names, for O(1) validation of a detected fuel type
+fuel_types = frozenset(fuel_mapping.values())
 fuel_fuzzy_mapping = {
     '無给': '無鉛', '无给': '無鉛', '無铅': '無鉛', '无铅': '無鉛', '柴油机': '柴油',
     '柴洒': '柴油', '超柴': '超級柴油', '超柴柴': '超級柴油', '九五無给': '九五無鉛',
     '九五無铅': '九五無鉛', '九二無给': '九二無鉛', '九八無给': '九八無鉛', '95+無给': '九五無鉛',
     '92+無给': '九二無鉛',  '98+無给': '九八無鉛', '超及柴油':'超級柴油', '超及柴油':'超級柴油'
 }
+# Any fuel keyword, for yes/no checks on a single OCR line
+fuel_keyword_pattern = re.compile('|'.join(map(re.escape, fuel_keywords)))
+# fuel_fuzzy_mapping applied key by key in order, collapsed into rules for one regex pass.
+# 無给/無铅 are fixed first, so the longer 九五無给-style keys and 超柴柴 can never match;
+# 柴油机/柴洒 are fixed before 超柴/超及柴油, so a 超 or 超及 in front of them is corrected too.
+fuel_fuzzy_rules = {
+    '無给': '無鉛', '无给': '無鉛', '無铅': '無鉛', '无铅': '無鉛',
+    '柴油机': '柴油', '柴洒': '柴油', '超柴': '超級柴油',
+    '超柴油机': '超級柴油油', '超柴洒': '超級柴油油',
+    '超及柴油': '超級柴油', '超及柴油机': '超級柴油', '超及柴洒': '超級柴油',
+}
+# Longest first, so 超柴油机 wins over 超柴 and 柴油机 at the same position
+fuel_fuzzy_pattern = re.compile(
+    '|'.join(re.escape(wrong) for wrong in sorted(fuel_fuzzy_rules, key=len, reverse=True))
+)
 district_keywords = ['台北', '台中', '高雄', '台南', '屏東', '新北', '桃園', '新竹', '宜蘭', '苗栗',
                      '彰化', '南投', '雲林', '嘉義', '台東', '花蓮', '金門', '連江', '澎湖']
 
+# === 關鍵字比對 (Aho-Corasick) ===
+def _build_keyword_automaton(keywords):
+    """
+    Build an Aho-Corasick automaton so a text is scanned once for all keywords
+    """
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for keyword in keywords:
+        automaton.add_word(keyword, keyword)
+    automaton.make_automaton()
+    return automaton
+
+district_automaton = _build_keyword_automaton(district_keywords)
+
+# Longest (most specific) first; sorted() is stable, so equal lengths keep fuel_keywords order
+fuel_keywords_longest_first = sorted(fuel_keywords, key=len, reverse=True)
+
+def find_longest_fuel_keyword(text):
+    """
+    Return the longest fuel keyword present in text (the earliest listed on ties), or None
+    """
+    return next((keyword for keyword in fuel_keywords_longest_first if keyword in text), None)
+
+def normalize_fuel_text(text):
+    """
+    Correct fuzzy fuel names in one pass (same result as applying fuel_fuzzy_mapping in order)
+    """
+    return fuel_fuzzy_pattern.sub(lambda m: fuel_fuzzy_rules[m.group()], text)
+
+# === 地址校正 ===
+# Single-character OCR misreads, applied in one str.translate pass
+address_char_fixes = str.maketrans({'号': '號', '锈': None, '娜': None, '川': '州', '鎖': '鎮'})
+
+def clean_address(address):
+    """
+    Correct common OCR misreads in an address
+    """
+    # 半禹锈娜 must be fixed before its 锈/娜 are dropped, and 潮洲 after, since dropping them can form it
+    return address.replace('半禹锈娜', '萬巒鄉').translate(address_char_fixes).replace('潮洲', '潮州')
+
+def has_district_keyword(text):
+    """
+    Check whether text contains any district keyword
+    """
+    if district_automaton is None:
+        return any(keyword in text for keyword in district_keywords)
+    return next(district_automaton.iter(text), None) is not None
+
 # === 正則表達式預編譯 ===
 # Invoice number patterns - handle multiple formats including OCR errors
-invoice_number_pattern = re.compile(r'[A-Z]{2}-\d{8}')  # Standard format like KF-12345678
-invoice_number_simple_pattern = re.compile(r'\d{7,8}')  # Simple numeric like 0118002
-invoice_number_mixed_pattern = re.compile(r'[A-Z]{2}\d{8}')  # Mixed like JJ75925092
+# Invoice numbers and dates are ASCII by definition: re.ASCII makes \d a plain [0-9] test.
+# Quantity/amount patterns stay Unicode - their \s must still match the ideographic space (U+3000)
+invoice_number_pattern = re.compile(r'[A-Z]{2}-\d{8}', re.ASCII)  # Standard format like KF-12345678
+invoice_number_simple_pattern = re.compile(r'\d{7,8}', re.ASCII)  # Simple numeric like 0118002
+invoice_number_mixed_pattern = re.compile(r'[A-Z]{2}\d{8}', re.ASCII)  # Mixed like JJ75925092
 
 # OCR error-tolerant patterns - handle common OCR misreads
-invoice_number_ocr_pattern = re.compile(r'([A-Z0-9|;%]{2})-?(\d{7,8})')  # Handle OCR errors, allow 7-8 digits
+invoice_number_ocr_pattern = re.compile(r'([A-Z0-9|;%]{2})-?(\d{7,8})', re.ASCII)  # Handle OCR errors, allow 7-8 digits
+
+# All three invoice formats in one scan; the outer group name tells which one matched
+combined_invoice_pattern = re.compile(
+    r'(?P<std>[A-Z]{2}-\d{8})'
+    r'|(?P<mixed>[A-Z]{2}\d{8})'
+    r'|(?P<ocr>(?P<prefix>[A-Z0-9|;%]{2})-?(?P<number>\d{7,8}))',
+    re.ASCII
+)
+
+# Voucher number lines (傳票號碼) - bare 7-8 digit lines, not invoice numbers
+voucher_line_pattern = re.compile(r'\A\d{7,8}\Z', re.ASCII)
+_VOUCHER_LABELS = frozenset(['傳票號碼', '傳票號碼：', '傳票號碼:'])
 
 # Date patterns - handle both Western and ROC calendar
-date_pattern = re.compile(r'\d{4}[-/]\d{2}[-/]\d{2}')  # Western: 2023-01-02
-roc_date_pattern = re.compile(r'(\d{2,3})年(\d{1,2})[-/](\d{1,2})月')  # ROC: 112年01-02月
-simple_date_pattern = re.compile(r'\d{4}[-/]\d{1,2}[-/]\d{1,2}')  # Flexible format
+date_pattern = re.compile(r'\d{4}[-/]\d{2}[-/]\d{2}', re.ASCII)  # Western: 2023-01-02
+roc_date_pattern = re.compile(r'(\d\d\d?)年(\d\d?)[-/](\d\d?)月', re.ASCII)  # ROC: 112年01-02月
+simple_date_pattern = re.compile(r'\d{4}[-/]\d{1,2}[-/]\d{1,2}', re.ASCII)  # Flexible format
 
 # Quantity patterns - handle various formats
 quantity_pattern = re.compile(r'(\d+\.?\d*)\s*[lL公升]')  # With unit like 30.6L
 quantity_fallback_pattern = re.compile(r'(\d+\.\d+)')  # Decimal numbers like 30.6
 simple_quantity_pattern = re.compile(r'(\d+\.?\d*)')  # Any number format
 quantity_with_context_pattern = re.compile(r'數量[:：]\s*(\d+\.?\d*)')  # With context
+any_digit_pattern = re.compile(r'\d')  # Prefilter: every quantity pattern needs a digit
 
 # Address patterns - more flexible matching
 address_pattern = re.compile(
     r'(台北|新北|桃園|新竹|苗栗|台中|彰化|南投|雲林|嘉義|台南|高雄|屏東|宜蘭|花蓮|台東|澎湖|金門|連江)[縣市]?'
     r'.{0,15}(鄉|鎮|市|區).{0,30}(路|街|巷|弄|大道|段).{0,30}\d+([-\d]*號?|号)?'
 )
+
+def find_city_anchor(text):
+    """
+    Return the index of the first city keyword in text, or -1 if there is none
+    """
+    if district_automaton is not None:
+        # All city keywords are two characters, so the first end position marks the first start
+        for end_index, _ in district_automaton.iter(text):
+            return end_index - 1
+        return -1
+    positions = [pos for pos in (text.find(keyword) for keyword in district_keywords) if pos >= 0]
+    return min(positions) if positions else -1
+
+def search_address(text):
+    """
+    address_pattern.search, started at the first city keyword instead of every position
+    """
+    anchor = find_city_anchor(text)
+    if anchor < 0:
+        return None
+    return address_pattern.search(text, anchor)
+
 # Simplified address pattern for fallback
-simple_address_pattern = re.compile(r'.*(市|縣).*(鄉|鎮|市|區).*\d+號?')
+# Bounded negated classes instead of '.*' keep the scan linear on noisy OCR lines
+simple_address_pattern = re.compile(r'(市|縣)[^鄉鎮市區]{0,30}(鄉|鎮|市|區)[^0-9]{0,50}\d+號?')
 
 # Gas station name patterns
 station_name_pattern = re.compile(r'(.*加油站|.*油站|.*站)')
@@ -55,37 +165,41 @@ fuel_context_pattern = re.compile(r'(品名|商品|燃料)[:：]\s*(\S+)')
 amount_pattern = re.compile(r'(金額|總額|合計)[:：]?\s*(\d+)')
 tax_id_pattern = re.compile(r'統編[:：]?\s*(\d{8})')
 
+# OCR error corrections for invoice numbers
+ocr_corrections = {
+    '|(F-': 'KF-',      # |(F-26523895 -> KF-26523895
+    '|F-': 'KF-',       # |F-26523895 -> KF-26523895
+    ';0-%': 'KA-99',    # ;0-%17734 -> KA-9917734
+    '00-': 'JJ-',       # 00-75925092 -> JJ-75925092
+    '0-': 'J-',         # 0- at start -> J-
+    '%': '9',           # General % -> 9
+    ';': 'K',           # ; -> K (if not already handled)
+    '|': 'J',           # | -> J (if not already handled)
+}
+ocr_correction_pattern = re.compile(
+    '|'.join(re.escape(wrong) for wrong in sorted(ocr_corrections, key=len, reverse=True))
+)
+
 # === Utility Functions ===
+# Extractors are pure functions of the OCR text; identical lines recur across
+# pages of a batch (headers, station names), so results are memoized.
 
+@lru_cache(maxsize=4096)
 def correct_ocr_errors(text):
     """
     Correct common OCR errors in invoice numbers
     """
-    corrected = text
+    # Fast path: clean OCR text has none of the trigger characters
+    # ('0-' also covers the '00-' prefix)
+    if '|' not in text and ';' not in text and '%' not in text and '0-' not in text:
+        return text
 
-    # Apply corrections in order of specificity (most specific first)
-    specific_corrections = [
-        ('|(F-', 'KF-'),      # |(F-26523895 -> KF-26523895
-        ('|F-', 'KF-'),       # |F-26523895 -> KF-26523895
-        (';0-%', 'KA-99'),    # ;0-%17734 -> KA-9917734
-        ('00-', 'JJ-'),       # 00-75925092 -> JJ-75925092
-        ('0-', 'J-'),         # 0- at start -> J-
-    ]
+    # Single pass over the text; longest keys win, so the specific
+    # multi-character corrections take precedence over single characters
+    return ocr_correction_pattern.sub(lambda m: ocr_corrections[m.group()], text)
 
-    for wrong, right in specific_corrections:
-        corrected = corrected.replace(wrong, right)
-
-    # Then apply single character corrections
-    char_corrections = {
-        '%': '9',    # General % -> 9
-        ';': 'K',    # ; -> K (if not already handled)
-        '|': 'J',    # | -> J (if not already handled)
-    }
-
-    for wrong, right in char_corrections.items():
-        corrected = corrected.replace(wrong, right)
-
-    return corrected
+# Precomputed ROC -> Western years for the range invoices actually use (民國90-129)
+_ROC_YEAR_CACHE = {str(y): y + 1911 for y in range(90, 130)}
 
 def convert_roc_to_western_date(roc_year, month, day=None):
     """
@@ -94,7 +208,7 @@ def convert_roc_to_western_date(roc_year, month, day=None):
     Example: ROC 112 = Western 2023
     """
     try:
-        western_year = int(roc_year) + 1911
+        western_year = _ROC_YEAR_CACHE.get(roc_year) or (int(roc_year) + 1911)
         month = int(month)
 
         # If day is not provided, use the first day of the month
@@ -113,6 +227,7 @@ def convert_roc_to_western_date(roc_year, month, day=None):
     except (ValueError, TypeError):
         return None
 
+@lru_cache(maxsize=4096)
 def extract_and_convert_date(text):
     """
     Extract date from text and convert ROC format to Western format if needed
@@ -137,6 +252,36 @@ def extract_and_convert_date(text):
 
     return None
 
+def _extract_invoice_from(text):
+    """
+    Find an invoice number in text and return it in standard format (JJ-12345678)
+    """
+    # One scan tells whether any invoice format is present
+    match = combined_invoice_pattern.search(text)
+    if not match:
+        return None
+
+    kind = match.lastgroup
+    # Standard format takes priority, then mixed, even if found later in the text
+    if kind != 'std':
+        later = invoice_number_pattern.search(text, match.start())
+        if later:
+            match, kind = later, 'std'
+    if kind == 'ocr':
+        later = invoice_number_mixed_pattern.search(text, match.start())
+        if later:
+            match, kind = later, 'mixed'
+
+    if kind == 'std':
+        return match.group()
+    if kind == 'mixed':
+        # Convert to standard format (JJ75925092 -> JJ-75925092)
+        result = match.group()
+        return f"{result[:2]}-{result[2:]}"
+    # OCR error-tolerant match, return in standard format
+    return f"{match.group('prefix')}-{match.group('number')}"
+
+@lru_cache(maxsize=4096)
 def extract_invoice_number(text):
     """
     Extract invoice number from text using multiple patterns
@@ -146,68 +291,38 @@ def extract_invoice_number(text):
     corrected_text = correct_ocr_errors(text)
 
     # Skip lines that contain the label "傳票號碼" as those are voucher numbers, not invoice numbers
-    lines = corrected_text.split('\n') if '\n' in corrected_text else [corrected_text]
+    # split() already returns [corrected_text] when there is no newline
+    lines = corrected_text.split('\n')
 
     for line in lines:
+        line_stripped = line.strip()
+
         # Skip lines that are just labels
-        if line.strip() in ['傳票號碼', '傳票號碼：', '傳票號碼:']:
+        if line_stripped in _VOUCHER_LABELS:
             continue
 
         # Skip lines that start with voucher number pattern (數字7-8位 without letters)
-        if re.match(r'^\d{7,8}$', line.strip()):
+        if voucher_line_pattern.match(line_stripped):
             continue
 
-        # Try standard format first (JJ-12345678, KF-12345678)
-        match = invoice_number_pattern.search(line)
-        if match:
-            return match.group()
-
-        # Try mixed format (JJ75925092 -> JJ-75925092)
-        match = invoice_number_mixed_pattern.search(line)
-        if match:
-            result = match.group()
-            # Convert to standard format
-            if len(result) == 10 and result[:2].isalpha():
-                return f"{result[:2]}-{result[2:]}"
-            return result
-
-        # Try OCR error-tolerant pattern
-        match = invoice_number_ocr_pattern.search(line)
-        if match:
-            prefix = match.group(1)
-            number = match.group(2)
-            # Return in standard format
-            return f"{prefix}-{number}"
-
-    # If no proper invoice number found, try the full text as fallback
-    # Try standard format first (JJ-12345678, KF-12345678)
-    match = invoice_number_pattern.search(corrected_text)
-    if match:
-        return match.group()
-
-    # Try mixed format (JJ75925092 -> JJ-75925092)
-    match = invoice_number_mixed_pattern.search(corrected_text)
-    if match:
-        result = match.group()
-        # Convert to standard format
-        if len(result) == 10 and result[:2].isalpha():
-            return f"{result[:2]}-{result[2:]}"
-        return result
-
-    # Try OCR error-tolerant pattern on full text
-    match = invoice_number_ocr_pattern.search(corrected_text)
-    if match:
-        prefix = match.group(1)
-        number = match.group(2)
-        # Return in standard format
-        return f"{prefix}-{number}"
+        invoice_number = _extract_invoice_from(line)
+        if invoice_number:
+            return invoice_number
 
+    # No full-text fallback: none of the invoice patterns can span a newline and the
+    # skipped label/voucher lines cannot hold a match, so rescanning corrected_text
+    # could only repeat the per-line misses
     return None
 
+@lru_cache(maxsize=4096)
 def extract_quantity(text):
     """
     Extract quantity from text using multiple patterns
     """
+    # No digit means none of the patterns below can match
+    if not any_digit_pattern.search(text):
+        return None
+
     # Try with unit context first
     match = quantity_with_context_pattern.search(text)
     if match:
@@ -1,3 +1,4 @@
+import time
 import logging
 from flask import send_from_directory
 from flask_restx import Namespace, Resource
@@ -8,12 +9,71 @@ from config.config import get_config
 
 logger = logging.getLogger(__name__)
 
+# Static payload for /general/info, built once at import
+_SERVICE_INFO = {
+    "name": "MFish Station Backend API",
+    "version": "1.0.0",
+    "description": "Backend API for MFish Station - OCR, Google Maps, and Material Management",
+    "endpoints": {
+        "materials": {
+            "search": "GET /api/materials/search",
+            "batch_match": "POST /api/materials/match-batch",
+            "create": "POST /api/materials",
+            "bulk_create": "POST /api/materials/bulk",
+            "bulk_update": "PUT /api/materials/bulk",
+            "get": "GET /api/materials/{id}",
+            "update": "PUT /api/materials/{id}",
+            "delete": "DELETE /api/materials/{id}"
+        },
+        "ocr": {
+            "process_pdf": "POST /api/ocr/process-pdf",
+            "submit_job": "POST /api/ocr/jobs",
+            "job_status": "GET /api/ocr/jobs/{job_id}",
+            "download_report": "GET /api/ocr/download-report/{filename}",
+            "status": "GET /api/ocr/status",
+            "reports": "GET /api/ocr/reports"
+        },
+        "gmap": {
+            "process": "POST /api/gmap/process",
+            "validate": "POST /api/gmap/validate-locations",
+            "geocode": "GET /api/gmap/geocode",
+            "download_excel": "GET /api/gmap/download/excel/{session_id}",
+            "download_zip": "GET /api/gmap/download/zip/{session_id}"
+        },
+        "general": {
+            "hello": "GET /api/general/hello",
+            "health": "GET /api/general/health",
+            "info": "GET /api/general/info"
+        }
+    },
+    "documentation": "/docs/"
+}
+
+# [epoch second, ISO string]; the health timestamp is formatted at most once per second
+_ts_cache = [0, '']
+
+def _utc_timestamp():
+    """Current UTC time as an ISO 8601 string with second granularity"""
+    now = int(time.time())
+    if now != _ts_cache[0]:
+        _ts_cache[1] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now))
+        _ts_cache[0] = now
+    return _ts_cache[1]
+
+# Last database connection-test result; /general/hello re-checks at most every DB_STATUS_TTL seconds
+DB_STATUS_TTL = 5
+_db_status_cache = {'t': None, 'ok': False}
+
 def create_general_routes(api, db_client):
     """Create general routes namespace"""
     
     ns = api.namespace('general', description='General operations')
     config = get_config()
     
+    def get_db():
+        # db_client may be a function (get_supabase) so the client is looked up per request
+        return db_client() if callable(db_client) else db_client
+    
     # Create API models
     models = APISchemas.create_api_models(api)
     
@@ -25,21 +85,28 @@ def create_general_routes(api, db_client):
         def get(self):
             """Test API connection and database status"""
             try:
-                if db_client:
-                    # Test database connection
-                    try:
-                        # Simple query to test connection
-                        response = db_client.table('materials').select('count', count='exact').limit(1).execute()
-                        
+                db = get_db()
+                if db:
+                    # Test database connection (cached for DB_STATUS_TTL seconds)
+                    now = time.monotonic()
+                    if _db_status_cache['t'] is None or now - _db_status_cache['t'] > DB_STATUS_TTL:
+                        try:
+                            # Simple query to test connection
+                            db.table('materials').select('count', count='exact').limit(1).execute()
+                            _db_status_cache['ok'] = True
+                        except Exception as db_error:
+                            logger.error(f"Database connection test failed: {str(db_error)}")
+                            _db_status_cache['ok'] = False
+                        _db_status_cache['t'] = now
+                    
+                    if _db_status_cache['ok']:
                         return format_success_response(
                             data={"database_status": "connected"},
                             message="哈囉！我來自成功連線到 Supabase 的 Python 後端！"
                         )
-                    except Exception as db_error:
-                        logger.error(f"Database connection test failed: {str(db_error)}")
-                        return format_error_response(
-                            Exception("Database connection failed"), 500
-                        )
+                    return format_error_response(
+                        Exception("Database connection failed"), 500
+                    )
                 else:
                     return format_error_response(
                         Exception("Database client not initialized"), 500
@@ -60,11 +127,11 @@ def create_general_routes(api, db_client):
                     "status": "healthy",
                     "version": "1.0.0",
                     "services": {
-                        "database": "connected" if db_client else "disconnected",
+                        "database": "connected" if get_db() else "disconnected",
                         "ocr": "available",
                         "google_maps": "available" if config.GOOGLE_MAPS_API_KEY else "unavailable"
                     },
-                    "timestamp": "2025-01-01T00:00:00Z"  # You might want to use actual timestamp
+                    "timestamp": _utc_timestamp()
                 }
                 
                 return format_success_response(
@@ -83,43 +150,8 @@ def create_general_routes(api, db_client):
         def get(self):
             """Get service information and available endpoints"""
             try:
-                info = {
-                    "name": "MFish Station Backend API",
-                    "version": "1.0.0",
-                    "description": "Backend API for MFish Station - OCR, Google Maps, and Material Management",
-                    "endpoints": {
-                        "materials": {
-                            "search": "GET /api/materials/search",
-                            "batch_match": "POST /api/materials/match-batch",
-                            "create": "POST /api/materials",
-                            "get": "GET /api/materials/{id}",
-                            "update": "PUT /api/materials/{id}",
-                            "delete": "DELETE /api/materials/{id}"
-                        },
-                        "ocr": {
-                            "process_pdf": "POST /api/ocr/process-pdf",
-                            "download_report": "GET /api/ocr/download-report/{filename}",
-                            "status": "GET /api/ocr/status",
-                            "reports": "GET /api/ocr/reports"
-                        },
-                        "gmap": {
-                            "process": "POST /api/gmap/process",
-                            "validate": "POST /api/gmap/validate-locations",
-                            "geocode": "GET /api/gmap/geocode",
-                            "download_excel": "GET /api/gmap/download/excel/{session_id}",
-                            "download_zip": "GET /api/gmap/download/zip/{session_id}"
-                        },
-                        "general": {
-                            "hello": "GET /api/general/hello",
-                            "health": "GET /api/general/health",
-                            "info": "GET /api/general/info"
-                        }
-                    },
-                    "documentation": "/docs/"
-                }
-                
                 return format_success_response(
-                    data=info,
+                    data=_SERVICE_INFO,
                     message="Service information retrieved successfully"
                 )
                 
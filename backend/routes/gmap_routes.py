@@ -1,26 +1,50 @@
-import os
 import io
-import zipfile
 import logging
-import pandas as pd
-from flask import request, send_file
+from flask import Response, request, send_file
 from flask_restx import Resource
 
-from services.gmap_service import GMapService
+from services.gmap_service import get_gmap_service
 from models.exceptions import BaseAppException, ValidationError
-from models.schemas import APISchemas
-from utils.helpers import format_error_response, format_success_response
+from models.schemas import APISchemas, marshal_gmap_response
+from utils.helpers import (
+    format_error_response, format_success_response, get_json_body,
+    create_session_cache, remove_session_images, iter_zip, split_nonempty_lines, build_route_report
+)
+from config.config import get_config
 
 logger = logging.getLogger(__name__)
 
-# Session cache for storing results
-SESSION_RESULTS_CACHE = {}
+# Per-session summary for /gmap/sessions, computed once when the results are stored
+SESSION_META = {}
+
+def build_session_meta(session_id, results):
+    """Summarize a session's results for the session listing"""
+    return {
+        "session_id": session_id,
+        "route_count": len(results),
+        "origin": results[0].get('origin', '') if results else '',
+        "has_images": any(item.get('image_filename') for item in results)
+    }
+
+def evict_session(session_id, results):
+    """Drop an evicted session's summary and screenshots"""
+    SESSION_META.pop(session_id, None)
+    remove_session_images(session_id, results)
+
+# Session cache for storing results (LRU-bounded; evicted sessions' screenshots are removed)
+SESSION_RESULTS_CACHE = create_session_cache(
+    maxsize=get_config().SESSION_CACHE_MAXSIZE,
+    on_evict=evict_session
+)
+
+# Built Excel reports keyed by session id, stored with the results they were built from
+EXCEL_EXPORT_CACHE = create_session_cache(maxsize=get_config().SESSION_CACHE_MAXSIZE)
 
 def create_gmap_routes(api):
     """Create Google Maps routes namespace"""
     
     ns = api.namespace('gmap', description='Google Maps operations')
-    gmap_service = GMapService()
+    gmap_service = get_gmap_service()
     
     # Create API models
     models = APISchemas.create_api_models(api)
@@ -29,17 +53,14 @@ def create_gmap_routes(api):
     class GMapProcess(Resource):
         @ns.doc('gmap_process')
         @ns.expect(models['gmap_request'])
-        @ns.marshal_with(models['gmap_response'])
+        @ns.response(200, 'Success', models['gmap_response'])
         @ns.response(400, 'Invalid request', models['error'])
         @ns.response(502, 'External service error', models['error'])
         @ns.response(500, 'Internal server error', models['error'])
         def post(self):
             """Process Google Maps routes and generate screenshots"""
             try:
-                if not request.is_json:
-                    raise ValidationError("Request must contain JSON data")
-                
-                data = request.get_json()
+                data = get_json_body()
                 origin = data.get('origin', '').strip()
                 destinations_text = data.get('destinations', '').strip()
                 
@@ -50,35 +71,33 @@ def create_gmap_routes(api):
                     raise ValidationError("At least one destination is required")
                 
                 # Parse destinations
-                destinations = [addr.strip() for addr in destinations_text.split('\n') 
-                              if addr.strip()]
+                destinations = split_nonempty_lines(destinations_text)
                 
                 if not destinations:
                     raise ValidationError("No valid destinations provided")
                 
-                logger.info(f"Processing {len(destinations)} routes from '{origin}'")
+                logger.info("Processing %s routes from '%s'", len(destinations), origin)
                 
                 # Process routes
                 session_id, results = gmap_service.process_routes(origin, destinations)
                 
                 # Cache results for downloads
+                SESSION_META[session_id] = build_session_meta(session_id, results)
                 SESSION_RESULTS_CACHE[session_id] = results
                 
-                logger.info(f"Route processing completed. Session ID: {session_id}")
+                logger.info("Route processing completed. Session ID: %s", session_id)
                 
-                return {
+                return marshal_gmap_response({
                     "results": results,
-                    "session_id": session_id,
-                    "total_routes": len(results),
-                    "origin": origin
-                }
+                    "session_id": session_id
+                })
                 
             except BaseAppException as e:
-                logger.error(f"Google Maps processing error: {str(e)}")
+                logger.error("Google Maps processing error: %s", e)
                 ns.abort(e.status_code, e.message)
             
             except Exception as e:
-                logger.error(f"Unexpected error in Google Maps processing: {str(e)}")
+                logger.error("Unexpected error in Google Maps processing: %s", e)
                 ns.abort(500, f"Route processing failed: {str(e)}")
     
     # Create location validation model
@@ -96,10 +115,7 @@ def create_gmap_routes(api):
         def post(self):
             """Validate that locations can be geocoded"""
             try:
-                if not request.is_json:
-                    raise ValidationError("Request must contain JSON data")
-                
-                data = request.get_json()
+                data = get_json_body()
                 locations = data.get('locations', [])
                 
                 if not locations or not isinstance(locations, list):
@@ -115,11 +131,11 @@ def create_gmap_routes(api):
                 )
                 
             except BaseAppException as e:
-                logger.error(f"Location validation error: {str(e)}")
+                logger.error("Location validation error: %s", e)
                 return format_error_response(e, e.status_code)
             
             except Exception as e:
-                logger.error(f"Unexpected error validating locations: {str(e)}")
+                logger.error("Unexpected error validating locations: %s", e)
                 return format_error_response(e, 500)
     
     @ns.route('/geocode')
@@ -145,11 +161,11 @@ def create_gmap_routes(api):
                 )
                 
             except BaseAppException as e:
-                logger.error(f"Geocoding error: {str(e)}")
+                logger.error("Geocoding error: %s", e)
                 return format_error_response(e, e.status_code)
             
             except Exception as e:
-                logger.error(f"Unexpected error geocoding address: {str(e)}")
+                logger.error("Unexpected error geocoding address: %s", e)
                 return format_error_response(e, 500)
     
     @ns.route('/download/excel/<string:session_id>')
@@ -165,35 +181,23 @@ def create_gmap_routes(api):
                 if not session_data:
                     ns.abort(404, "Session not found or expired")
                 
-                # Prepare data for Excel export
-                export_data = []
-                for item in session_data:
-                    export_data.append({
-                        "起始點": item.get('origin', ''),
-                        "終點": item.get('destination', ''),
-                        "距離": item.get('distance', ''),
-                        "圖片名稱": item.get('image_filename', ''),
-                        "備註": item.get('remarks', '')
-                    })
-                
-                # Create Excel file in memory
-                df = pd.DataFrame(export_data)
-                output = io.BytesIO()
-                
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    df.to_excel(writer, index=False, sheet_name='路線距離報告')
-                
-                output.seek(0)
+                # Reuse the report built on an earlier download of the same results
+                cached = EXCEL_EXPORT_CACHE.get(session_id)
+                if cached and cached[0] is session_data:
+                    content = cached[1]
+                else:
+                    content = build_route_report(session_data)
+                    EXCEL_EXPORT_CACHE[session_id] = (session_data, content)
                 
                 return send_file(
-                    output,
+                    io.BytesIO(content),
                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
                     as_attachment=True,
                     download_name=f'google_maps_report_{session_id}.xlsx'
                 )
                 
             except Exception as e:
-                logger.error(f"Error downloading Excel for session {session_id}: {str(e)}")
+                logger.error("Error downloading Excel for session %s: %s", session_id, e)
                 ns.abort(500, f"Failed to generate Excel report: {str(e)}")
     
     @ns.route('/download/zip/<string:session_id>')
@@ -203,35 +207,40 @@ def create_gmap_routes(api):
         @ns.response(500, 'Internal server error')
         def get(self, session_id):
             """Download ZIP archive of route images"""
+            # Session pinned before it is read, so its images are not evicted before or while the archive
+            # streams; the pin is released when the server closes the response
+            SESSION_RESULTS_CACHE.add_pin(session_id)
+            pinned = True
             try:
                 session_data = SESSION_RESULTS_CACHE.get(session_id)
                 
                 if not session_data:
                     ns.abort(404, "Session not found or expired")
                 
-                # Create ZIP file in memory
-                memory_file = io.BytesIO()
-                
-                with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-                    for item in session_data:
-                        image_path = item.get('image_local_path')
-                        image_filename = item.get('image_filename')
-                        
-                        if image_path and image_filename and os.path.exists(image_path):
-                            zf.write(image_path, arcname=image_filename)
-                
-                memory_file.seek(0)
-                
-                return send_file(
-                    memory_file,
-                    mimetype='application/zip',
-                    as_attachment=True,
-                    download_name=f'map_images_{session_id}.zip'
+                files = []
+                for item in session_data:
+                    image_path = item.get('image_local_path')
+                    image_filename = item.get('image_filename')
+                    
+                    # Missing files are skipped by iter_zip when it opens them
+                    if image_path and image_filename:
+                        files.append((image_path, image_filename))
+                
+                response = Response(iter_zip(files), mimetype='application/zip')
+                response.headers.set(
+                    'Content-Disposition', 'attachment',
+                    filename=f'map_images_{session_id}.zip'
                 )
+                response.call_on_close(lambda: SESSION_RESULTS_CACHE.remove_pin(session_id))
+                pinned = False
+                return response
                 
             except Exception as e:
-                logger.error(f"Error downloading ZIP for session {session_id}: {str(e)}")
+                logger.error("Error downloading ZIP for session %s: %s", session_id, e)
                 ns.abort(500, f"Failed to generate ZIP archive: {str(e)}")
+            finally:
+                if pinned:
+                    SESSION_RESULTS_CACHE.remove_pin(session_id)
     
     @ns.route('/sessions')
     class GMapSessions(Resource):
@@ -240,14 +249,8 @@ def create_gmap_routes(api):
         def get(self):
             """List active sessions with their basic info"""
             try:
-                sessions = []
-                for session_id, results in SESSION_RESULTS_CACHE.items():
-                    sessions.append({
-                        "session_id": session_id,
-                        "route_count": len(results),
-                        "origin": results[0].get('origin', '') if results else '',
-                        "has_images": any(item.get('image_filename') for item in results)
-                    })
+                # Summaries are maintained on insert/evict, so listing never walks the results
+                sessions = list(SESSION_META.values())
                 
                 return format_success_response(
                     data=sessions,
@@ -255,7 +258,7 @@ def create_gmap_routes(api):
                 )
                 
             except Exception as e:
-                logger.error(f"Error listing sessions: {str(e)}")
+                logger.error("Error listing sessions: %s", e)
                 return format_error_response(e, 500)
     
     return ns
\ No newline at end of file
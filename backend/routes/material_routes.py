@@ -1,12 +1,13 @@
 import logging
-from flask import request
-from flask_restx import Namespace, Resource
+from flask import Response, request
+from flask_restx import Namespace, Resource, marshal
 from werkzeug.exceptions import BadRequest
 
 from services.material_service import MaterialService
 from models.exceptions import BaseAppException, ValidationError
 from models.schemas import APISchemas
-from utils.helpers import format_error_response, format_success_response
+from utils.helpers import format_error_response, format_success_response, get_json_body
+from utils.json_provider import dumps_bytes
 
 logger = logging.getLogger(__name__)
 
@@ -44,27 +45,25 @@ def create_material_routes(api, db_client):
                 )
                 
             except BaseAppException as e:
-                logger.error(f"Material search error: {str(e)}")
+                logger.error("Material search error: %s", e)
                 return format_error_response(e, e.status_code)
             
             except Exception as e:
-                logger.error(f"Unexpected error in material search: {str(e)}")
+                logger.error("Unexpected error in material search: %s", e)
                 return format_error_response(e, 500)
     
     @ns.route('/match-batch')
     class MaterialMatchBatch(Resource):
         @ns.doc('match_materials_batch')
         @ns.expect(models['material_queries'])
-        @ns.marshal_list_with(models['material_batch_result'])
+        @ns.param('stream', 'Set to 1 to stream results as NDJSON, one line per query', type=int, default=0)
+        @ns.response(200, 'Success', [models['material_batch_result']])
         @ns.response(400, 'Invalid request', models['error'])
         @ns.response(500, 'Internal server error', models['error'])
         def post(self):
             """Batch match materials against database"""
             try:
-                if not request.is_json:
-                    raise ValidationError("Request must contain JSON data")
-                
-                data = request.get_json()
+                data = get_json_body()
                 queries = data.get('queries', []) if data else []
                 
                 if not queries:
@@ -73,17 +72,26 @@ def create_material_routes(api, db_client):
                 if not isinstance(queries, list):
                     raise ValidationError("Queries must be provided as a list")
                 
+                if request.args.get('stream') == '1':
+                    # NDJSON: each result is flushed as soon as its query is matched
+                    def generate():
+                        for result in material_service.batch_match_materials_iter(queries):
+                            yield dumps_bytes(marshal(result, models['material_batch_result'])) + b'\n'
+                        logger.info("Successfully streamed batch match for %s queries", len(queries))
+                    
+                    return Response(generate(), mimetype='application/x-ndjson')
+                
                 results = material_service.batch_match_materials(queries)
                 
-                logger.info(f"Successfully processed batch match for {len(queries)} queries")
-                return results
+                logger.info("Successfully processed batch match for %s queries", len(queries))
+                return marshal(results, models['material_batch_result'])
                 
             except BaseAppException as e:
-                logger.error(f"Batch material matching error: {str(e)}")
+                logger.error("Batch material matching error: %s", e)
                 ns.abort(e.status_code, e.message)
             
             except Exception as e:
-                logger.error(f"Unexpected error in batch matching: {str(e)}")
+                logger.error("Unexpected error in batch matching: %s", e)
                 ns.abort(500, f"Batch matching failed: {str(e)}")
     
     @ns.route('')
@@ -91,7 +99,7 @@ def create_material_routes(api, db_client):
         @ns.doc('get_materials')
         @ns.param('limit', 'Maximum number of materials to return', type=int, default=100)
         @ns.param('offset', 'Number of materials to skip', type=int, default=0)
-        @ns.marshal_with(models['success_response'])
+        @ns.response(200, 'Success', models['success_response'])
         def get(self):
             """Get list of materials"""
             try:
@@ -106,13 +114,14 @@ def create_material_routes(api, db_client):
                 
                 materials = material_service.list_materials(limit, offset)
                 
+                # Returned as-is (no marshal_with): walking up to 1000 rows through fields.Raw only copies them
                 return format_success_response(
                     data=materials,
                     message=f"Retrieved {len(materials)} materials"
                 )
                 
             except Exception as e:
-                logger.error(f"Error getting materials: {str(e)}")
+                logger.error("Error getting materials: %s", e)
                 return format_error_response(e, 500)
         
         @ns.doc('create_material')
@@ -124,10 +133,7 @@ def create_material_routes(api, db_client):
         def post(self):
             """Create a new material"""
             try:
-                if not request.is_json:
-                    raise ValidationError("Request must contain JSON data")
-                
-                material_data = request.get_json()
+                material_data = get_json_body()
                 if not material_data:
                     raise ValidationError("No material data provided")
                 
@@ -139,11 +145,71 @@ def create_material_routes(api, db_client):
                 ), 201
                 
             except BaseAppException as e:
-                logger.error(f"Material creation error: {str(e)}")
+                logger.error("Material creation error: %s", e)
+                return format_error_response(e, e.status_code)
+            
+            except Exception as e:
+                logger.error("Unexpected error creating material: %s", e)
+                return format_error_response(e, 500)
+    
+    def get_material_rows():
+        """Read the 'materials' list of a bulk request body"""
+        rows = get_json_body().get('materials')
+        if not rows or not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValidationError("'materials' must be a non-empty list of objects")
+        return rows
+    
+    @ns.route('/bulk')
+    class MaterialBulk(Resource):
+        @ns.doc('create_materials_bulk')
+        @ns.expect(models['material_list'])
+        @ns.marshal_with(models['success_response'])
+        @ns.response(201, 'Materials created successfully')
+        @ns.response(400, 'Invalid request', models['error'])
+        @ns.response(500, 'Internal server error', models['error'])
+        def post(self):
+            """Create many materials in one database write"""
+            try:
+                result = material_service.create_materials_bulk(get_material_rows())
+                
+                return format_success_response(
+                    data=result,
+                    message=f"Created {len(result)} materials"
+                ), 201
+                
+            except BaseAppException as e:
+                logger.error("Bulk material creation error: %s", e)
                 return format_error_response(e, e.status_code)
             
             except Exception as e:
-                logger.error(f"Unexpected error creating material: {str(e)}")
+                logger.error("Unexpected error creating materials: %s", e)
+                return format_error_response(e, 500)
+        
+        @ns.doc('update_materials_bulk')
+        @ns.expect(models['material_list'])
+        @ns.marshal_with(models['success_response'])
+        @ns.response(400, 'Invalid request', models['error'])
+        @ns.response(404, 'Material not found', models['error'])
+        @ns.response(500, 'Internal server error', models['error'])
+        def put(self):
+            """Update many existing materials (each with its material_id); rows that failed are listed in data.failed"""
+            try:
+                result = material_service.update_materials_bulk(get_material_rows())
+                
+                message = f"Updated {len(result['updated'])} materials"
+                if result['failed']:
+                    message += f", {len(result['failed'])} failed"
+                return format_success_response(
+                    data=result,
+                    message=message
+                )
+                
+            except BaseAppException as e:
+                logger.error("Bulk material update error: %s", e)
+                return format_error_response(e, e.status_code)
+            
+            except Exception as e:
+                logger.error("Unexpected error updating materials: %s", e)
                 return format_error_response(e, 500)
     
     @ns.route('/<string:material_id>')
@@ -163,11 +229,11 @@ def create_material_routes(api, db_client):
                 )
                 
             except BaseAppException as e:
-                logger.error(f"Error getting material {material_id}: {str(e)}")
+                logger.error("Error getting material %s: %s", material_id, e)
                 return format_error_response(e, e.status_code)
             
             except Exception as e:
-                logger.error(f"Unexpected error getting material {material_id}: {str(e)}")
+                logger.error("Unexpected error getting material %s: %s", material_id, e)
                 return format_error_response(e, 500)
         
         @ns.doc('update_material')
@@ -179,10 +245,7 @@ def create_material_routes(api, db_client):
         def put(self, material_id):
             """Update material by ID"""
             try:
-                if not request.is_json:
-                    raise ValidationError("Request must contain JSON data")
-                
-                update_data = request.get_json()
+                update_data = get_json_body()
                 if not update_data:
                     raise ValidationError("No update data provided")
                 
@@ -194,11 +257,11 @@ def create_material_routes(api, db_client):
                 )
                 
             except BaseAppException as e:
-                logger.error(f"Error updating material {material_id}: {str(e)}")
+                logger.error("Error updating material %s: %s", material_id, e)
                 return format_error_response(e, e.status_code)
             
             except Exception as e:
-                logger.error(f"Unexpected error updating material {material_id}: {str(e)}")
+                logger.error("Unexpected error updating material %s: %s", material_id, e)
                 return format_error_response(e, 500)
         
         @ns.doc('delete_material')
@@ -215,11 +278,11 @@ def create_material_routes(api, db_client):
                 )
                 
             except BaseAppException as e:
-                logger.error(f"Error deleting material {material_id}: {str(e)}")
+                logger.error("Error deleting material %s: %s", material_id, e)
                 return format_error_response(e, e.status_code)
             
             except Exception as e:
-                logger.error(f"Unexpected error deleting material {material_id}: {str(e)}")
+                logger.error("Unexpected error deleting material %s: %s", material_id, e)
                 return format_error_response(e, 500)
     
     return ns
\ No newline at end of file
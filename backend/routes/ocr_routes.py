@@ -1,108 +1,264 @@
 import os
+import time
+import uuid
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from flask import request, send_from_directory
 from flask_restx import Namespace, Resource
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException, NotFound
 
-from services.ocr_service_fixed import OCRServiceFixed as OCRService
+from services.ocr_service_fixed import get_ocr_service
+from services.ocr_engines import can_preload_engines
 from models.exceptions import BaseAppException, ValidationError, FileProcessingError
-from models.schemas import APISchemas
+from models.schemas import APISchemas, marshal_ocr_response
 from utils.helpers import (
     format_error_response, format_success_response, 
     allowed_file, secure_filename_with_timestamp,
-    ensure_directory_exists
+    ensure_directory_exists, REPORT_FORMATS
 )
+from utils.job_store import FileJobStore
 from config.config import get_config
 
 logger = logging.getLogger(__name__)
 
+def _remove_abandoned_upload(record):
+    """Delete the uploaded PDF of a job whose worker died or timed out"""
+    upload_path = record.get('upload_path')
+    if upload_path and os.path.exists(upload_path):
+        os.remove(upload_path)
+
+# Background OCR jobs: status records shared by all workers (on disk), and this worker's threads running them
+OCR_JOBS = FileJobStore(
+    get_config().OCR_JOBS_FOLDER,
+    maxsize=get_config().OCR_JOB_MAXSIZE,
+    timeout=get_config().OCR_JOB_TIMEOUT,
+    on_abandon=_remove_abandoned_upload
+)
+_ocr_job_executor = ThreadPoolExecutor(max_workers=get_config().OCR_JOB_WORKERS)
+
+REPORT_EXTENSIONS = tuple(f'.{report_format}' for report_format in REPORT_FORMATS)
+
+# /ocr/reports listing, rebuilt only when the reports folder's mtime changes
+_reports_cache = {"mtime": None, "data": []}
+
+def _list_reports(folder):
+    """Return OCR report entries, newest first, rescanning the folder only after it changed"""
+    mtime = os.stat(folder).st_mtime_ns
+    if mtime == _reports_cache["mtime"]:
+        return _reports_cache["data"]
+    
+    reports = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.endswith(REPORT_EXTENSIONS) and entry.name.startswith('ocr_report_'):
+                stat = entry.stat()
+                reports.append({
+                    "filename": entry.name,
+                    "size": stat.st_size,
+                    "created": stat.st_ctime,
+                    "download_url": f"api/ocr/download-report/{entry.name}"
+                })
+    
+    # Sort by creation time, newest first
+    reports.sort(key=lambda x: x["created"], reverse=True)
+    
+    _reports_cache["data"] = reports
+    _reports_cache["mtime"] = mtime
+    return reports
+
 def create_ocr_routes(api):
     """Create OCR routes namespace"""
     
     ns = api.namespace('ocr', description='OCR processing operations')
-    ocr_service = OCRService()
+    ocr_service = get_ocr_service()
     config = get_config()
     
+    if config.OCR_PRELOAD_ENGINES and not can_preload_engines():
+        logger.warning("CUDA detected, not preloading OCR engines; each worker loads them on first request")
+    elif config.OCR_PRELOAD_ENGINES:
+        try:
+            ocr_service.init_ocr_engine()
+        except FileProcessingError as e:
+            logger.warning("OCR engine preload failed, will retry on first request: %s", e)
+    
     # Create API models
     models = APISchemas.create_api_models(api)
     
-    @ns.route('/process-pdf')
-    class OCRProcessPDF(Resource):
-        @ns.doc('ocr_process_pdf')
-        @ns.expect(ns.parser().add_argument(
+    def validate_uploaded_pdf():
+        """Validate the uploaded PDF and return (file, upload path)"""
+        # Check if file is in request
+        if 'file' not in request.files:
+            raise ValidationError("No file part in request")
+        
+        file = request.files['file']
+        
+        # Validate file
+        if file.filename == '':
+            raise ValidationError("No file selected")
+        
+        if not file.filename.lower().endswith('.pdf'):
+            raise ValidationError("File must be a PDF")
+        
+        if not allowed_file(file.filename, {'pdf'}):
+            raise ValidationError("Invalid file type")
+        
+        ensure_directory_exists(config.UPLOAD_FOLDER)
+        unique_filename = secure_filename_with_timestamp(file.filename)
+        return file, os.path.join(config.UPLOAD_FOLDER, unique_filename)
+    
+    def remove_uploaded_file(pdf_path):
+        if os.path.exists(pdf_path):
+            try:
+                os.remove(pdf_path)
+            except Exception as e:
+                logger.warning("Failed to clean up uploaded file: %s", e)
+    
+    def requested_report_format():
+        """Report format from the upload form ('xlsx' unless report_format=csv is sent)"""
+        report_format = request.form.get('report_format', 'xlsx').lower()
+        if report_format not in REPORT_FORMATS:
+            raise ValidationError(f"Report format must be one of: {', '.join(REPORT_FORMATS)}")
+        return report_format
+    
+    def ocr_upload_parser():
+        return ns.parser().add_argument(
             'file', 
             location='files', 
             type='file', 
             required=True, 
             help='PDF file to process'
-        ))
-        @ns.marshal_with(models['ocr_response'])
+        ).add_argument(
+            'report_format',
+            location='form',
+            choices=REPORT_FORMATS,
+            default='xlsx',
+            help='Report file format; csv skips building a workbook'
+        )
+    
+    def run_ocr(pdf_path, report_format='xlsx'):
+        """Run OCR on a saved PDF and build the API response"""
+        logger.info("Starting OCR processing for file: %s", os.path.basename(pdf_path))
+        report_path, ocr_data = ocr_service.process_pdf(pdf_path, report_format)
+        
+        report_filename = os.path.basename(report_path)
+        
+        logger.info("OCR processing completed. Report: %s", report_filename)
+        
+        return marshal_ocr_response({
+            "message": "OCR processing completed successfully!",
+            "download_url": f"api/ocr/download-report/{report_filename}",
+            "data": ocr_data
+        })
+    
+    def run_ocr_job(job_id, pdf_path, report_format):
+        # Skip jobs that were evicted, or marked failed for waiting in the queue past OCR_JOB_TIMEOUT
+        job = OCR_JOBS.get(job_id)
+        if job is None or job.get('status') != 'queued':
+            remove_uploaded_file(pdf_path)
+            return
+        OCR_JOBS.update(job_id, status="running", started_at=time.time())
+        try:
+            result = {"result": run_ocr(pdf_path, report_format), "status": "finished"}
+        except Exception as e:
+            logger.error("OCR job %s failed: %s", job_id, e)
+            result = {"error": f"OCR processing failed: {str(e)}", "status": "failed"}
+        finally:
+            remove_uploaded_file(pdf_path)
+        OCR_JOBS.update(job_id, finished_at=time.time(), **result)
+    
+    @ns.route('/process-pdf')
+    class OCRProcessPDF(Resource):
+        @ns.doc('ocr_process_pdf')
+        @ns.expect(ocr_upload_parser())
+        @ns.response(200, 'Success', models['ocr_response'])
         @ns.response(400, 'Invalid request', models['error'])
         @ns.response(422, 'File processing error', models['error'])
         @ns.response(500, 'Internal server error', models['error'])
         def post(self):
             """Process PDF file with OCR to extract invoice information"""
             try:
-                # Check if file is in request
-                if 'file' not in request.files:
-                    raise ValidationError("No file part in request")
-                
-                file = request.files['file']
-                
-                # Validate file
-                if file.filename == '':
-                    raise ValidationError("No file selected")
-                
-                if not file.filename.lower().endswith('.pdf'):
-                    raise ValidationError("File must be a PDF")
-                
-                if not allowed_file(file.filename, {'pdf'}):
-                    raise ValidationError("Invalid file type")
-                
-                # Save uploaded file
-                ensure_directory_exists(config.UPLOAD_FOLDER)
-                unique_filename = secure_filename_with_timestamp(file.filename)
-                pdf_path = os.path.join(config.UPLOAD_FOLDER, unique_filename)
+                file, pdf_path = validate_uploaded_pdf()
+                report_format = requested_report_format()
                 
                 try:
                     file.save(pdf_path)
                     
                     # Process PDF with OCR
-                    logger.info(f"Starting OCR processing for file: {unique_filename}")
-                    report_path, ocr_data = ocr_service.process_pdf(pdf_path)
-                    
-                    report_filename = os.path.basename(report_path)
-                    
-                    logger.info(f"OCR processing completed. Report: {report_filename}")
-                    
-                    return {
-                        "message": "OCR processing completed successfully!",
-                        "download_url": f"api/ocr/download-report/{report_filename}",
-                        "data": ocr_data,
-                        "total_invoices": len(ocr_data),
-                        "report_filename": report_filename
-                    }
+                    return run_ocr(pdf_path, report_format)
                     
                 except Exception as e:
-                    logger.error(f"OCR processing failed: {str(e)}")
+                    logger.error("OCR processing failed: %s", e)
                     raise FileProcessingError(f"OCR processing failed: {str(e)}")
                 
                 finally:
                     # Clean up uploaded file
-                    if os.path.exists(pdf_path):
-                        try:
-                            os.remove(pdf_path)
-                        except Exception as e:
-                            logger.warning(f"Failed to clean up uploaded file: {str(e)}")
+                    remove_uploaded_file(pdf_path)
                 
             except BaseAppException as e:
-                logger.error(f"OCR processing error: {str(e)}")
+                logger.error("OCR processing error: %s", e)
                 ns.abort(e.status_code, e.message)
             
             except Exception as e:
-                logger.error(f"Unexpected error in OCR processing: {str(e)}")
+                logger.error("Unexpected error in OCR processing: %s", e)
                 ns.abort(500, f"OCR processing failed: {str(e)}")
     
+    @ns.route('/jobs')
+    class OCRJobs(Resource):
+        @ns.doc('ocr_submit_job')
+        @ns.expect(ocr_upload_parser())
+        @ns.marshal_with(models['success_response'], code=202)
+        @ns.response(400, 'Invalid request', models['error'])
+        @ns.response(500, 'Internal server error', models['error'])
+        def post(self):
+            """Queue a PDF for background OCR; poll the returned status_url for the result"""
+            try:
+                file, pdf_path = validate_uploaded_pdf()
+                report_format = requested_report_format()
+                file.save(pdf_path)
+                
+                job_id = uuid.uuid4().hex
+                OCR_JOBS.put(job_id, {
+                    "job_id": job_id,
+                    "status": "queued",
+                    "created_at": time.time(),
+                    # Lets any worker tell that this one exited (gunicorn recycled or killed it) mid-job
+                    "pid": os.getpid(),
+                    "upload_path": pdf_path
+                })
+                _ocr_job_executor.submit(run_ocr_job, job_id, pdf_path, report_format)
+                
+                logger.info("Queued OCR job %s for file: %s", job_id, os.path.basename(pdf_path))
+                
+                return format_success_response(
+                    data={"job_id": job_id, "status_url": f"api/ocr/jobs/{job_id}"},
+                    message="OCR job queued"
+                ), 202
+                
+            except BaseAppException as e:
+                logger.error("OCR job submission error: %s", e)
+                ns.abort(e.status_code, e.message)
+            
+            except Exception as e:
+                logger.error("Unexpected error queuing OCR job: %s", e)
+                ns.abort(500, f"Failed to queue OCR job: {str(e)}")
+    
+    @ns.route('/jobs/<string:job_id>')
+    class OCRJobStatus(Resource):
+        @ns.doc('ocr_job_status')
+        @ns.marshal_with(models['success_response'])
+        @ns.response(404, 'Job not found')
+        def get(self, job_id):
+            """Get the status (queued, running, finished, failed) and result of an OCR job"""
+            job = OCR_JOBS.get(job_id)
+            if job is None:
+                ns.abort(404, "Job not found or expired")
+            
+            return format_success_response(
+                data=job,
+                message=f"OCR job {job['status']}"
+            )
+    
     @ns.route('/download-report/<string:filename>')
     class OCRDownloadReport(Resource):
         @ns.doc('download_ocr_report')
@@ -114,22 +270,24 @@ def create_ocr_routes(api):
                 # Security check: ensure filename is safe
                 safe_filename = secure_filename(filename)
                 
-                if not safe_filename.endswith('.xlsx'):
+                if not safe_filename.endswith(REPORT_EXTENSIONS):
                     ns.abort(400, "Invalid file type")
                 
-                report_path = os.path.join(config.REPORTS_FOLDER, safe_filename)
-                
-                if not os.path.exists(report_path):
-                    ns.abort(404, "Report not found")
-                
+                # send_from_directory stats the file itself and raises NotFound if it is missing
                 return send_from_directory(
                     config.REPORTS_FOLDER, 
                     safe_filename, 
                     as_attachment=True
                 )
                 
+            except NotFound:
+                ns.abort(404, "Report not found")
+            
+            except HTTPException:
+                raise
+            
             except Exception as e:
-                logger.error(f"Error downloading report {filename}: {str(e)}")
+                logger.error("Error downloading report %s: %s", filename, e)
                 ns.abort(500, f"Failed to download report: {str(e)}")
     
     @ns.route('/status')
@@ -157,7 +315,7 @@ def create_ocr_routes(api):
                 )
                 
             except Exception as e:
-                logger.error(f"Error checking OCR status: {str(e)}")
+                logger.error("Error checking OCR status: %s", e)
                 return format_error_response(e, 500)
     
     @ns.route('/reports')
@@ -169,21 +327,7 @@ def create_ocr_routes(api):
             try:
                 ensure_directory_exists(config.REPORTS_FOLDER)
                 
-                reports = []
-                for filename in os.listdir(config.REPORTS_FOLDER):
-                    if filename.endswith('.xlsx') and filename.startswith('ocr_report_'):
-                        filepath = os.path.join(config.REPORTS_FOLDER, filename)
-                        stat = os.stat(filepath)
-                        
-                        reports.append({
-                            "filename": filename,
-                            "size": stat.st_size,
-                            "created": stat.st_ctime,
-                            "download_url": f"api/ocr/download-report/{filename}"
-                        })
-                
-                # Sort by creation time, newest first
-                reports.sort(key=lambda x: x["created"], reverse=True)
+                reports = _list_reports(config.REPORTS_FOLDER)
                 
                 return format_success_response(
                     data=reports,
@@ -191,7 +335,7 @@ def create_ocr_routes(api):
                 )
                 
             except Exception as e:
-                logger.error(f"Error listing OCR reports: {str(e)}")
+                logger.error("Error listing OCR reports: %s", e)
                 return format_error_response(e, 500)
     
     return ns
\ No newline at end of file
@@ -8,18 +8,25 @@ class BaseService:
     """Base service class with common functionality"""
     
     def __init__(self, db_client=None):
-        self.db = db_client
+        # A client, or a function returning one (e.g. get_supabase) that is called on every use
+        self._db = db_client
+    
+    @property
+    def db(self):
+        return self._db() if callable(self._db) else self._db
         
-    def validate_required_fields(self, data: dict, required_fields: list) -> None:
+    def validate_required_fields(self, data: dict, required_fields) -> None:
         """Validate that all required fields are present"""
+        # Success path stays in C (map + all); the missing list is only built to report an error
+        if all(map(data.get, required_fields)):
+            return
         missing_fields = [field for field in required_fields if not data.get(field)]
-        if missing_fields:
-            raise ValidationError(f"Missing required fields: {', '.join(missing_fields)}")
+        raise ValidationError(f"Missing required fields: {', '.join(missing_fields)}")
     
     def handle_db_error(self, error: Exception, operation: str) -> None:
         """Handle database errors consistently"""
         logger.error(f"Database error during {operation}: {str(error)}")
-        raise DatabaseError(f"Failed to {operation}")
+        raise DatabaseError(f"Failed to {operation}") from error
     
     def safe_get(self, data: dict, key: str, default: Any = None) -> Any:
         """Safely get value from dictionary"""
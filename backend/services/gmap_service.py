@@ -1,12 +1,60 @@
 import os
+import re
 import time
 import datetime
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Tuple
 import googlemaps
 
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+
 from .base_service import BaseService
 from models.exceptions import ValidationError, ExternalAPIError
 from config.config import get_config
+from utils.helpers import create_http_session, create_session_cache
+
+logger = logging.getLogger(__name__)
+
+# Destinations per distance_matrix request (the API allows 25 per origin row)
+DISTANCE_MATRIX_MAX_DESTINATIONS = 25
+
+# Concurrent geocoding requests in validate_locations (matches the pooled session's keep-alive connections)
+GEOCODE_WORKERS = 10
+
+def _geocode_cache_key(*parts) -> str:
+    """Stable cache key: SHA-256 of the normalized lookup arguments"""
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+CITY_KEYWORDS = (
+    "台北市", "新北市", "桃園市", "台中市", "台南市", "高雄市",
+    "基隆市", "新竹市", "嘉義市", "宜蘭縣", "新竹縣", "苗栗縣",
+    "彰化縣", "南投縣", "雲林縣", "嘉義縣", "屏東縣", "花蓮縣",
+    "台東縣", "澎湖縣", "金門縣", "連江縣"
+)
+
+# All city keywords in one compiled literal alternation (scanned in C), plus each keyword's list position
+_CITY_PATTERN = re.compile('|'.join(map(re.escape, CITY_KEYWORDS)))
+_CITY_PRIORITY = {city: priority for priority, city in enumerate(CITY_KEYWORDS)}
+
+# Process-wide Google Maps service (one googlemaps client per process)
+_GMAP_SERVICE = None
+_gmap_service_lock = threading.Lock()
+
+def get_gmap_service() -> 'GMapService':
+    """Return the shared GMapService instance, creating it on first call"""
+    global _GMAP_SERVICE
+    if _GMAP_SERVICE is None:
+        with _gmap_service_lock:
+            if _GMAP_SERVICE is None:
+                _GMAP_SERVICE = GMapService()
+    return _GMAP_SERVICE
 
 class GMapService(BaseService):
     """Service for Google Maps operations"""
@@ -17,15 +65,30 @@ class GMapService(BaseService):
         self.api_key = api_key or self.config.GOOGLE_MAPS_API_KEY
         self.gmaps_client = None
         self.robot = None
+        self._session = None
+        
+        # Geocoding results: in-memory LRU, backed by an on-disk cache when configured
+        self._geocode_cache = create_session_cache(maxsize=self.config.GEOCODE_CACHE_MAXSIZE)
+        self._geocode_disk_cache = None
+        if self.config.GEOCODE_CACHE_DIR and diskcache is not None:
+            self._geocode_disk_cache = diskcache.Cache(self.config.GEOCODE_CACHE_DIR)
         
         if not self.api_key:
             raise ValidationError("Google Maps API key is required")
             
         try:
-            self.gmaps_client = googlemaps.Client(key=self.api_key)
+            # Share one keep-alive pool across calls (and the concurrent geocoding threads)
+            self._session = create_http_session()
+            self.gmaps_client = googlemaps.Client(key=self.api_key, requests_session=self._session)
         except Exception as e:
             raise ExternalAPIError(f"Failed to initialize Google Maps client: {str(e)}")
     
+    def close(self) -> None:
+        """Close the pooled HTTP connections"""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+    
     def process_routes(self, origin: str, destinations: List[str]) -> Tuple[str, List[Dict[str, Any]]]:
         """Process multiple routes and generate screenshots"""
         if not origin or not origin.strip():
@@ -53,9 +116,15 @@ class GMapService(BaseService):
             # Initialize Google Maps robot
             robot_results = self._process_with_robot(origin, destinations, image_folder_path)
             
+            # Optional driving durations for every route in one batched (paid) distance_matrix call;
+            # distances stay the robot's, which match the route in the screenshot
+            durations = [""] * len(robot_results)
+            if self.config.GMAP_ROUTE_DURATIONS:
+                durations = self._route_durations(origin, [r["destination"] for r in robot_results])
+            
             # Format results for frontend
             results = []
-            for robot_result in robot_results:
+            for robot_result, duration in zip(robot_results, durations):
                 screenshot_url = ""
                 if "image_filename" in robot_result:
                     screenshot_url = f"screenshots/{today_str}/{session_id}/{robot_result['image_filename']}"
@@ -67,7 +136,7 @@ class GMapService(BaseService):
                     "image_filename": robot_result.get("image_filename", ""),
                     "image_local_path": robot_result.get("image_local_path", ""),
                     "screenshot_url": screenshot_url,
-                    "duration": robot_result.get("duration", ""),
+                    "duration": duration,
                     "travel_mode": robot_result.get("travel_mode", "driving")
                 })
             
@@ -81,16 +150,32 @@ class GMapService(BaseService):
         """Process routes using Google Maps robot"""
         try:
             # Import robot here to avoid circular imports
-            from gmap_robot import GoogleMapsRobot
+            from gmap_robot import process_routes_concurrently
             
-            robot = GoogleMapsRobot(headless=True)
-            results = robot.process_multiple_routes(origin, destinations, image_folder_path)
+            # Several warm pooled drivers work through the destinations in parallel
+            results = process_routes_concurrently(origin, destinations, image_folder_path)
             
             return results
             
         except Exception as e:
             raise ExternalAPIError(f"Google Maps robot processing failed: {str(e)}")
     
+    def _route_durations(self, origin: str, destinations: List[str]) -> List[str]:
+        """Driving duration text per destination from distance_matrix; blank where unavailable"""
+        durations = []
+        for start in range(0, len(destinations), DISTANCE_MATRIX_MAX_DESTINATIONS):
+            chunk = destinations[start:start + DISTANCE_MATRIX_MAX_DESTINATIONS]
+            try:
+                elements = self.get_distance_matrix([origin], chunk)["rows"][0]["elements"]
+            except Exception as e:
+                logger.warning("Distance matrix lookup failed: %s", e)
+                elements = []
+            
+            for i in range(len(chunk)):
+                element = elements[i] if i < len(elements) else {}
+                durations.append(element["duration"]["text"] if element.get("status") == "OK" else "")
+        return durations
+    
     def get_distance_matrix(self, origins: List[str], destinations: List[str], 
                            mode: str = "driving") -> Dict[str, Any]:
         """Get distance matrix using Google Maps API"""
@@ -116,33 +201,54 @@ class GMapService(BaseService):
         if not address or not address.strip():
             raise ValidationError("Address is required for geocoding")
         
+        key = _geocode_cache_key("geocode", address.strip().lower(), "zh-TW")
+        cached = self._get_cached_geocode(key)
+        if cached is not None:
+            return cached
+        
+        # Only the API call is wrapped; "no results" is raised outside so it stays a ValidationError
         try:
             result = self.gmaps_client.geocode(address, language="zh-TW")
-            
-            if not result:
-                raise ValidationError(f"No results found for address: {address}")
-            
-            return result[0]
-            
-        except ValidationError:
-            raise
         except Exception as e:
-            raise ExternalAPIError(f"Failed to geocode address: {str(e)}")
+            raise ExternalAPIError(f"Failed to geocode address: {str(e)}") from e
+        
+        if not result:
+            raise ValidationError(f"No results found for address: {address}")
+        
+        return self._set_cached_geocode(key, result[0])
+    
+    def _get_cached_geocode(self, key: str):
+        """Look a geocoding result up in memory, then on disk"""
+        result = self._geocode_cache.get(key)
+        if result is None and self._geocode_disk_cache is not None:
+            result = self._geocode_disk_cache.get(key)
+            if result is not None:
+                self._geocode_cache[key] = result
+        return result
+    
+    def _set_cached_geocode(self, key: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Remember a successful geocoding result (failures are not cached)"""
+        self._geocode_cache[key] = result
+        if self._geocode_disk_cache is not None:
+            self._geocode_disk_cache.set(key, result)
+        return result
     
     def reverse_geocode(self, lat: float, lng: float) -> Dict[str, Any]:
         """Reverse geocode coordinates to get address"""
+        key = _geocode_cache_key("reverse", round(lat, 6), round(lng, 6), "zh-TW")
+        cached = self._get_cached_geocode(key)
+        if cached is not None:
+            return cached
+        
         try:
             result = self.gmaps_client.reverse_geocode((lat, lng), language="zh-TW")
-            
-            if not result:
-                raise ValidationError(f"No results found for coordinates: {lat}, {lng}")
-            
-            return result[0]
-            
-        except ValidationError:
-            raise
         except Exception as e:
-            raise ExternalAPIError(f"Failed to reverse geocode coordinates: {str(e)}")
+            raise ExternalAPIError(f"Failed to reverse geocode coordinates: {str(e)}") from e
+        
+        if not result:
+            raise ValidationError(f"No results found for coordinates: {lat}, {lng}")
+        
+        return self._set_cached_geocode(key, result[0])
     
     def get_directions(self, origin: str, destination: str, 
                       mode: str = "driving") -> Dict[str, Any]:
@@ -158,16 +264,13 @@ class GMapService(BaseService):
                 language="zh-TW",
                 units="metric"
             )
-            
-            if not result:
-                raise ValidationError(f"No routes found from {origin} to {destination}")
-            
-            return result[0]
-            
-        except ValidationError:
-            raise
         except Exception as e:
-            raise ExternalAPIError(f"Failed to get directions: {str(e)}")
+            raise ExternalAPIError(f"Failed to get directions: {str(e)}") from e
+        
+        if not result:
+            raise ValidationError(f"No routes found from {origin} to {destination}")
+        
+        return result[0]
     
     def get_place_details(self, place_id: str) -> Dict[str, Any]:
         """Get detailed information about a place"""
@@ -207,37 +310,37 @@ class GMapService(BaseService):
     @staticmethod
     def get_origin_city(origin: str) -> str:
         """Extract city name from full origin address"""
-        city_keywords = [
-            "台北市", "新北市", "桃園市", "台中市", "台南市", "高雄市",
-            "基隆市", "新竹市", "嘉義市", "宜蘭縣", "新竹縣", "苗栗縣",
-            "彰化縣", "南投縣", "雲林縣", "嘉義縣", "屏東縣", "花蓮縣",
-            "台東縣", "澎湖縣", "金門縣", "連江縣"
-        ]
+        match = _CITY_PATTERN.search(origin)
+        if not match:
+            return ""
         
-        for city in city_keywords:
-            if city in origin:
-                return city
-        
-        return ""
+        # Usually there is a single city; with several, the earliest keyword in CITY_KEYWORDS wins, as in a list scan
+        if not _CITY_PATTERN.search(origin, match.end()):
+            return match.group(0)
+        return min(_CITY_PATTERN.findall(origin), key=_CITY_PRIORITY.__getitem__)
     
     def validate_locations(self, locations: List[str]) -> List[Dict[str, Any]]:
         """Validate that locations can be geocoded"""
-        results = []
+        if not locations:
+            return []
         
-        for location in locations:
-            try:
-                geocode_result = self.geocode_address(location)
-                results.append({
-                    "location": location,
-                    "valid": True,
-                    "formatted_address": geocode_result.get("formatted_address", ""),
-                    "coordinates": geocode_result.get("geometry", {}).get("location", {})
-                })
-            except Exception as e:
-                results.append({
-                    "location": location,
-                    "valid": False,
-                    "error": str(e)
-                })
-        
-        return results
\ No newline at end of file
+        # Geocoding calls are independent network round-trips; map keeps the input order
+        with ThreadPoolExecutor(max_workers=min(GEOCODE_WORKERS, len(locations))) as executor:
+            return list(executor.map(self._validate_location, locations))
+    
+    def _validate_location(self, location: str) -> Dict[str, Any]:
+        """Geocode one location into a valid/invalid record"""
+        try:
+            geocode_result = self.geocode_address(location)
+            return {
+                "location": location,
+                "valid": True,
+                "formatted_address": geocode_result.get("formatted_address", ""),
+                "coordinates": geocode_result.get("geometry", {}).get("location", {})
+            }
+        except Exception as e:
+            return {
+                "location": location,
+                "valid": False,
+                "error": str(e)
+            }
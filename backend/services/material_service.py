@@ -1,10 +1,102 @@
+import time
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional
 from .base_service import BaseService
 from models.exceptions import ValidationError, DatabaseError, NotFoundError
 
 logger = logging.getLogger(__name__)
 
+# Concurrent Supabase lookups per batch match request
+BATCH_MATCH_WORKERS = 8
+
+# Concurrent page requests when fetching every material
+ALL_MATERIALS_WORKERS = 8
+
+# Batch queries folded into one PostgREST or=(...) filter (keeps the request URL short)
+BATCH_OR_QUERY_SIZE = 50
+
+# Material IDs checked per in_() lookup before a bulk update
+BULK_ID_LOOKUP_SIZE = 200
+
+# Queries containing LIKE wildcards/escapes can't be bucketed by substring, so they are searched one by one
+_LIKE_SPECIAL_CHARS = ('%', '_', '*', '\\')
+
+MATERIAL_MATCH_FIELDS = ('material_id', 'material_name', 'carbon_footprint', 'declaration_unit')
+MATERIAL_MATCH_COLUMNS = ', '.join(MATERIAL_MATCH_FIELDS)
+
+# Columns the frontend reads from the full catalog (/materials/all); the cached catalog holds exactly these
+MATERIAL_CATALOG_COLUMNS = MATERIAL_MATCH_COLUMNS + ', data_source, announcement_year'
+
+MATERIAL_REQUIRED_FIELDS = ('material_name', 'carbon_footprint', 'declaration_unit')
+
+# Full material catalog, reused for ALL_MATERIALS_CACHE_TTL seconds and dropped on every material write.
+# 'version' is bumped by invalidation so a fetch that raced with a write is not stored.
+ALL_MATERIALS_CACHE_TTL = 300
+_all_materials_cache = {'rows': None, 't': 0.0, 'version': 0, 'names': None, 'index': None}
+_all_materials_lock = threading.Lock()
+
+def invalidate_materials_cache() -> None:
+    """Forget the cached material catalog (call after inserting, updating or deleting materials)"""
+    with _all_materials_lock:
+        _all_materials_cache['rows'] = None
+        _all_materials_cache['names'] = None
+        _all_materials_cache['index'] = None
+        _all_materials_cache['version'] += 1
+
+def _cached_materials() -> Optional[List[Dict[str, Any]]]:
+    with _all_materials_lock:
+        rows = _all_materials_cache['rows']
+        if rows is not None and time.monotonic() - _all_materials_cache['t'] < ALL_MATERIALS_CACHE_TTL:
+            return rows
+        return None
+
+def _build_name_index(rows: List[Dict[str, Any]]):
+    """Lowercased names plus a 2-gram -> ascending row positions inverted index"""
+    names = [(row.get('material_name') or '').lower() for row in rows]
+    index = {}
+    for position, name in enumerate(names):
+        for gram in {name[i:i + 2] for i in range(len(name) - 1)}:
+            index.setdefault(gram, []).append(position)
+    return names, index
+
+def _store_materials(rows: List[Dict[str, Any]], version: int) -> None:
+    names, index = _build_name_index(rows)
+    with _all_materials_lock:
+        if _all_materials_cache['version'] == version:
+            _all_materials_cache.update(rows=rows, names=names, index=index, t=time.monotonic())
+
+def _search_cached_catalog(term: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+    """Substring (ilike %term%) search over the cached catalog; None when the cache is cold"""
+    if any(c in term for c in _LIKE_SPECIAL_CHARS):
+        return None
+    with _all_materials_lock:
+        rows = _all_materials_cache['rows']
+        if rows is None or time.monotonic() - _all_materials_cache['t'] >= ALL_MATERIALS_CACHE_TTL:
+            return None
+        names, index = _all_materials_cache['names'], _all_materials_cache['index']
+    
+    term = term.lower()
+    if len(term) >= 2:
+        # Only rows containing every 2-gram can match; verify the shortest posting list
+        postings = [index.get(term[i:i + 2]) for i in range(len(term) - 1)]
+        if not all(postings):
+            return []
+        candidates = min(postings, key=len)
+    else:
+        candidates = range(len(rows))
+    
+    matches = []
+    for position in candidates:
+        if term in names[position]:
+            row = rows[position]
+            matches.append({field: row.get(field) for field in MATERIAL_MATCH_FIELDS})
+            if len(matches) >= limit:
+                break
+    return matches
+
 class MaterialService(BaseService):
     """Service for material-related operations"""
     
@@ -15,11 +107,17 @@ class MaterialService(BaseService):
         """Search materials by name"""
         if not query or not query.strip():
             raise ValidationError("Search query cannot be empty")
+        
+        # Answer from the in-memory name index while the catalog cache is warm; both paths
+        # return matches in material_id order
+        cached = _search_cached_catalog(query.strip(), limit)
+        if cached is not None:
+            return cached
             
         try:
             response = self.db.table('materials').select(
-                'material_id, material_name, carbon_footprint, declaration_unit'
-            ).ilike('material_name', f'%{query.strip()}%').limit(limit).execute()
+                MATERIAL_MATCH_COLUMNS
+            ).ilike('material_name', f'%{query.strip()}%').order('material_id').limit(limit).execute()
             
             return response.data if response.data else []
             
@@ -30,156 +128,345 @@ class MaterialService(BaseService):
         """Perform batch material matching"""
         if not queries:
             raise ValidationError("No queries provided for batch matching")
+        
+        return list(self.batch_match_materials_iter(queries))
+    
+    def batch_match_materials_iter(self, queries: List[str], limit: int = 5) -> Iterator[Dict[str, Any]]:
+        """Yield batch match results in query order as they become available"""
+        if not queries:
+            raise ValidationError("No queries provided for batch matching")
+        
+        # Each distinct stripped query is searched once; blank and non-string queries never reach the database
+        terms = list(dict.fromkeys(
+            q.strip() for q in queries if isinstance(q, str) and q.strip()
+        ))
+        
+        # One or=(...) request answers most queries; the rest fall back to their own search
+        found = self._search_materials_batched(terms, limit) if terms else {}
+        missing = [t for t in terms if t not in found]
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(BATCH_MATCH_WORKERS, len(missing)))) as executor:
+            pending = {term: executor.submit(self._search_term, term, limit) for term in missing}
+            for query in queries:
+                term = query.strip() if isinstance(query, str) else ''
+                if not term:
+                    yield self._format_match(query, [])
+                elif term in found:
+                    yield self._format_match(query, found[term])
+                else:
+                    yield self._format_match(query, pending[term].result())
+    
+    def _search_materials_batched(self, queries: List[str], limit: int) -> Dict[str, List[Dict[str, Any]]]:
+        """Search many queries with combined ilike filters, returning rows per stripped query"""
+        terms = list(dict.fromkeys(
+            q.strip() for q in queries
+            if isinstance(q, str) and q.strip() and not any(c in q for c in _LIKE_SPECIAL_CHARS)
+        ))
+        found = {}
+        for term in terms:
+            cached = _search_cached_catalog(term, limit)
+            if cached is None:
+                break
+            found[term] = cached
+        terms = [t for t in terms if t not in found]
+        
+        chunks = [terms[i:i + BATCH_OR_QUERY_SIZE] for i in range(0, len(terms), BATCH_OR_QUERY_SIZE)]
+        if not chunks:
+            return found
+        
+        with ThreadPoolExecutor(max_workers=min(BATCH_MATCH_WORKERS, len(chunks))) as executor:
+            for buckets in executor.map(lambda chunk: self._search_chunk(chunk, limit), chunks):
+                found.update(buckets)
+        return found
+    
+    def _search_chunk(self, terms: List[str], limit: int) -> Dict[str, List[Dict[str, Any]]]:
+        """Run one or=(...) ilike query and bucket the rows by the terms they contain"""
+        cap = limit * len(terms)
+        or_filter = ','.join(
+            'material_name.ilike."*{}*"'.format(t.replace('"', '\\"')) for t in terms
+        )
+        try:
+            response = self.db.table('materials').select(
+                MATERIAL_MATCH_COLUMNS
+            ).or_(or_filter).order('material_id').limit(cap).execute()
+        except Exception as e:
+            logger.warning("Batched material search failed, searching queries one by one: %s", e)
+            return {}
+        
+        rows = response.data if response.data else []
+        buckets = {t: [] for t in terms}
+        lowered = [(t, t.lower()) for t in terms]
+        for row in rows:
+            name = (row.get('material_name') or '').lower()
+            for term, term_lower in lowered:
+                if term_lower in name and len(buckets[term]) < limit:
+                    buckets[term].append(row)
+        
+        # When the row cap was hit, only full buckets are known to be complete
+        if len(rows) >= cap:
+            buckets = {t: r for t, r in buckets.items() if len(r) >= limit}
+        return buckets
+    
+    def _search_term(self, term: str, limit: int) -> List[Dict[str, Any]]:
+        """Search one batch query on its own; a failed search yields no matches"""
+        try:
+            return self.search_materials(term, limit)
             
-        results = []
+        except Exception as e:
+            logger.error("Error matching query '%s': %s", term, e)
+            # Empty result for failed query keeps the batch order
+            return []
+    
+    def _format_match(self, query: str, search_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Format search rows as one batch match result"""
+        scores = self._calculate_match_scores(
+            query, [material.get('material_name', '') for material in search_results]
+        )
         
-        for query in queries:
-            try:
-                search_results = self.search_materials(query)
-                
-                # Format matches for frontend compatibility
-                formatted_matches = []
-                for material in search_results:
-                    formatted_matches.append({
-                        "name": self.safe_get(material, 'material_name', ''),
-                        "id": self.safe_get(material, 'material_id', ''),
-                        "carbon_footprint": self.safe_get(material, 'carbon_footprint', 0),
-                        "declaration_unit": self.safe_get(material, 'declaration_unit', ''),
-                        "score": self._calculate_match_score(query, material.get('material_name', ''))
-                    })
-                
-                results.append({
-                    "query": query,
-                    "matches": formatted_matches,
-                    "default": 0 if formatted_matches else None
-                })
-                
-            except Exception as e:
-                logger.error(f"Error matching query '{query}': {str(e)}")
-                # Add empty result for failed query to maintain order
-                results.append({
-                    "query": query,
-                    "matches": [],
-                    "default": None
-                })
-        
-        return results
+        # Format matches for frontend compatibility
+        formatted_matches = []
+        for material, score in zip(search_results, scores):
+            formatted_matches.append({
+                "name": self.safe_get(material, 'material_name', ''),
+                "id": self.safe_get(material, 'material_id', ''),
+                "carbon_footprint": self.safe_get(material, 'carbon_footprint', 0),
+                "declaration_unit": self.safe_get(material, 'declaration_unit', ''),
+                "score": score
+            })
+        
+        return {
+            "query": query,
+            "matches": formatted_matches,
+            "default": 0 if formatted_matches else None
+        }
     
     def create_material(self, material_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create a new material"""
-        required_fields = ['material_name', 'carbon_footprint', 'declaration_unit']
-        self.validate_required_fields(material_data, required_fields)
-        
-        # Validate numeric fields
-        try:
-            material_data['carbon_footprint'] = float(material_data['carbon_footprint'])
-            if 'announcement_year' in material_data and material_data['announcement_year']:
-                material_data['announcement_year'] = int(material_data['announcement_year'])
-        except (ValueError, TypeError) as e:
-            raise ValidationError("Invalid numeric values provided")
+        self.validate_required_fields(material_data, MATERIAL_REQUIRED_FIELDS)
+        self._coerce_numeric_fields(material_data)
         
         try:
             response = self.db.table('materials').insert(material_data).execute()
             
             if not response.data:
                 raise DatabaseError("Failed to create material - no data returned")
-                
+            
+            invalidate_materials_cache()
             return response.data[0]
             
         except Exception as e:
             self.handle_db_error(e, "create material")
     
-    def list_materials(self, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+    def create_materials_bulk(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Create many materials with one INSERT per distinct set of fields"""
+        if not rows:
+            raise ValidationError("No materials provided")
+        
+        # Validate every row locally before anything is written
+        for row in rows:
+            self.validate_required_fields(row, MATERIAL_REQUIRED_FIELDS)
+            self._coerce_numeric_fields(row)
+        
+        return self._write_grouped(
+            rows, lambda group: self.db.table('materials').insert(group).execute(), "create materials"
+        )
+    
+    def update_materials_bulk(self, updates: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Update many existing materials (each row carries its material_id); never creates rows.
+        
+        Unknown IDs are rejected before anything is written. Rows with identical new values share
+        one UPDATE, so the write is several requests and not atomic: rows whose request fails are
+        returned under 'failed' while the others stay updated.
+        """
+        if not updates:
+            raise ValidationError("No material updates provided")
+        
+        groups = {}
+        for index, row in enumerate(updates):
+            if not row.get('material_id'):
+                raise ValidationError("Material ID is required")
+            self._coerce_numeric_fields(row)
+            fields = {k: v for k, v in row.items() if k != 'material_id'}
+            if not fields:
+                raise ValidationError(f"No fields to update for material {row['material_id']}")
+            try:
+                key = frozenset(fields.items())
+            except TypeError:
+                key = index
+            groups.setdefault(key, (fields, []))[1].append(row['material_id'])
+        
+        ids = list(dict.fromkeys(row['material_id'] for row in updates))
+        missing = set(ids) - self._existing_material_ids(ids)
+        if missing:
+            missing = [i for i in ids if i in missing]
+            raise NotFoundError(f"Materials not found: {', '.join(missing)}", payload={'missing': missing})
+        
+        updated = {}
+        failed = []
+        # Even a partly failed bulk write may have changed the catalog. Clear the cache before writing
+        # and again afterwards, so a catalog fetched while the writes were in flight is not kept.
+        invalidate_materials_cache()
+        try:
+            for fields, group_ids in groups.values():
+                try:
+                    response = self.db.table('materials').update(fields).in_('material_id', group_ids).execute()
+                except Exception as e:
+                    logger.error("Bulk material update failed for %s: %s", group_ids, e)
+                    failed.extend({'material_id': i, 'error': str(e)} for i in group_ids)
+                    continue
+                for row in response.data or []:
+                    updated[row['material_id']] = row
+        finally:
+            invalidate_materials_cache()
+        
+        return {
+            'updated': [updated[i] for i in ids if i in updated],
+            'failed': failed
+        }
+    
+    def _existing_material_ids(self, ids: List[str]) -> set:
+        """Return which of the given material IDs exist, looked up in URL-sized chunks"""
+        existing = set()
+        try:
+            for i in range(0, len(ids), BULK_ID_LOOKUP_SIZE):
+                response = self.db.table('materials').select('material_id').in_(
+                    'material_id', ids[i:i + BULK_ID_LOOKUP_SIZE]
+                ).execute()
+                existing.update(row['material_id'] for row in response.data or [])
+        except Exception as e:
+            self.handle_db_error(e, "look up materials")
+        return existing
+    
+    def _write_grouped(self, rows: List[Dict[str, Any]], write, operation: str) -> List[Dict[str, Any]]:
+        """Send rows in one request per key set (PostgREST bulk payloads need matching keys), keeping input order"""
+        groups = {}
+        for index, row in enumerate(rows):
+            groups.setdefault(frozenset(row), []).append(index)
+        
+        written = [None] * len(rows)
+        try:
+            # Even a partly failed bulk write may have changed the catalog. Clear the cache before writing
+            # and again afterwards, so a catalog fetched while the writes were in flight is not kept.
+            invalidate_materials_cache()
+            for indices in groups.values():
+                response = write([rows[i] for i in indices])
+                data = response.data if response.data else []
+                if len(data) != len(indices):
+                    raise DatabaseError(f"Failed to {operation} - unexpected number of rows returned")
+                for index, row in zip(indices, data):
+                    written[index] = row
+            
+            return written
+            
+        except Exception as e:
+            self.handle_db_error(e, operation)
+        finally:
+            invalidate_materials_cache()
+    
+    def _coerce_numeric_fields(self, material_data: Dict[str, Any]) -> None:
+        """Convert numeric material fields in place"""
+        try:
+            if 'carbon_footprint' in material_data:
+                material_data['carbon_footprint'] = float(material_data['carbon_footprint'])
+            if 'announcement_year' in material_data and material_data['announcement_year']:
+                material_data['announcement_year'] = int(material_data['announcement_year'])
+        except (ValueError, TypeError):
+            raise ValidationError("Invalid numeric values provided")
+    
+    def list_materials(self, limit: int = 100, offset: int = 0, columns: str = '*') -> List[Dict[str, Any]]:
         """List materials with pagination"""
         try:
-            response = self.db.table('materials').select('*').range(offset, offset + limit - 1).execute()
+            response = self.db.table('materials').select(columns).range(offset, offset + limit - 1).execute()
             
             return response.data if response.data else []
             
         except Exception as e:
             self.handle_db_error(e, "list materials")
     
-    def get_all_materials(self) -> List[Dict[str, Any]]:
-        """Get all materials without pagination limits"""
+    def get_all_materials(self, columns: str = MATERIAL_CATALOG_COLUMNS) -> List[Dict[str, Any]]:
+        """Get all materials without pagination limits (served from the catalog cache when fresh)"""
+        cacheable = columns == MATERIAL_CATALOG_COLUMNS
+        cached = _cached_materials() if cacheable else None
+        if cached is not None:
+            return list(cached)
+        
+        version = _all_materials_cache['version']
         try:
-            print("🚀 Starting to fetch ALL materials from database...")
-            
             # First, get total count using a simple count query
-            try:
-                count_response = self.db.table('materials').select('material_id', count='exact').execute()
-                total_count = count_response.count if hasattr(count_response, 'count') else 'unknown'
-                print(f"📊 Database reports {total_count} total materials")
-            except Exception as e:
-                print(f"⚠️ Could not get count: {e}")
-                total_count = 'unknown'
+            total_count = self.count_materials()
+            logger.debug("Fetching all materials (database reports %s)", total_count)
             
-            # Fetch ALL materials using progressive pagination with improved logic
-            all_materials = []
-            batch_size = 500  # Reduced batch size for better Supabase compatibility
-            current_offset = 0
-            batch_number = 1
-            consecutive_empty_batches = 0
-
-            while True:
-                print(f"🔄 Batch {batch_number}: Requesting range [{current_offset}, {current_offset + batch_size - 1}]")
-
-                try:
-                    # Use range() instead of offset() for Supabase Python client compatibility
-                    response = self.db.table('materials').select('*').range(current_offset, current_offset + batch_size - 1).execute()
-
-                    batch_data = response.data if response.data else []
-                    batch_count = len(batch_data)
-
-                    print(f"✅ Batch {batch_number}: Received {batch_count} materials (expected up to {batch_size})")
-
-                    # If we get no data, increment empty batch counter
-                    if batch_count == 0:
-                        consecutive_empty_batches += 1
-                        print(f"📭 Empty batch #{consecutive_empty_batches}")
-
-                        # Stop only after getting 2 consecutive empty batches to be sure
-                        if consecutive_empty_batches >= 2:
-                            print("🏁 No more materials found (2 consecutive empty batches), stopping pagination")
-                            break
-                    else:
-                        # Reset empty batch counter when we get data
-                        consecutive_empty_batches = 0
-                        all_materials.extend(batch_data)
-                        print(f"📊 Total accumulated: {len(all_materials)} materials")
-
-                    # Continue to next batch regardless of batch_count
-                    # This fixes the issue where we stopped at 999 records
-                    current_offset += batch_size
-                    batch_number += 1
-
-                    # Safety break for very large databases (increased for your 2,394+ materials)
-                    if current_offset >= 50000:
-                        print(f"⚠️ Safety limit: stopped at {current_offset} records to prevent timeouts")
-                        break
-
-                except Exception as batch_error:
-                    print(f"❌ Error in batch {batch_number}: {batch_error}")
-                    consecutive_empty_batches += 1
-                    if consecutive_empty_batches >= 3:
-                        print("❌ Too many consecutive errors, stopping pagination")
-                        break
-                    current_offset += batch_size
-                    batch_number += 1
+            # 0 skips the concurrent pages when the count is unknown
+            all_materials = list(self.iter_all_materials(total_count=total_count or 0, columns=columns))
             
             final_count = len(all_materials)
-            print(f"🎉 SUCCESS: Retrieved {final_count} materials total")
+            logger.info("Fetched %d/%s materials", final_count, total_count if total_count is not None else 'unknown')
             
-            if total_count != 'unknown' and final_count != total_count:
-                print(f"⚠️ WARNING: Retrieved {final_count} but database has {total_count}")
+            if total_count is not None and final_count != total_count:
+                logger.warning("Retrieved %d materials but database has %d", final_count, total_count)
             
-            return all_materials
+            if cacheable:
+                _store_materials(all_materials, version)
+            return list(all_materials)
             
         except Exception as e:
-            print(f"❌ CRITICAL ERROR in get_all_materials: {e}")
-            import traceback
-            print(f"Full traceback: {traceback.format_exc()}")
+            logger.exception("Error fetching all materials")
             self.handle_db_error(e, "get all materials")
     
+    def iter_all_materials(self, batch_size: int = 500, total_count: Optional[int] = None,
+                           columns: str = MATERIAL_CATALOG_COLUMNS) -> Iterator[Dict[str, Any]]:
+        """Yield every material in material_id order, holding only a few pages in memory
+        
+        Pages covered by total_count are fetched concurrently with bounded look-ahead;
+        after them (or without a count) pages are read one by one until a short page.
+        """
+        if total_count is None:
+            total_count = self.count_materials()
+        
+        last_batch_count = batch_size
+        current_offset = 0
+        
+        offsets = range(0, total_count or 0, batch_size)
+        if offsets:
+            with ThreadPoolExecutor(max_workers=min(ALL_MATERIALS_WORKERS, len(offsets))) as executor:
+                pending = deque()
+                for offset in offsets:
+                    pending.append(executor.submit(self._fetch_materials_range, offset, batch_size, columns))
+                    if len(pending) >= ALL_MATERIALS_WORKERS:
+                        batch_data = pending.popleft().result()
+                        last_batch_count = len(batch_data)
+                        yield from batch_data
+                while pending:
+                    batch_data = pending.popleft().result()
+                    last_batch_count = len(batch_data)
+                    yield from batch_data
+            current_offset = len(offsets) * batch_size
+        
+        # Unknown count, or rows added since counting: keep reading until a short batch
+        while last_batch_count == batch_size:
+            batch_data = self._fetch_materials_range(current_offset, batch_size, columns)
+            last_batch_count = len(batch_data)
+            current_offset += batch_size
+            yield from batch_data
+    
+    def count_materials(self) -> Optional[int]:
+        """Exact number of materials, or None when the count is unavailable"""
+        try:
+            response = self.db.table('materials').select('material_id', count='exact').limit(1).execute()
+            return response.count if isinstance(getattr(response, 'count', None), int) else None
+        except Exception as e:
+            logger.warning("Could not count materials: %s", e)
+            return None
+    
+    def _fetch_materials_range(self, offset: int, batch_size: int,
+                               columns: str = MATERIAL_CATALOG_COLUMNS) -> List[Dict[str, Any]]:
+        """Fetch one page of materials, ordered so concurrent pages don't overlap"""
+        # Use range() instead of offset() for Supabase Python client compatibility
+        response = self.db.table('materials').select(columns).order('material_id').range(
+            offset, offset + batch_size - 1
+        ).execute()
+        return response.data if response.data else []
+    
     def get_material_by_id(self, material_id: str) -> Dict[str, Any]:
         """Get material by ID"""
         if not material_id:
@@ -187,16 +474,13 @@ class MaterialService(BaseService):
             
         try:
             response = self.db.table('materials').select('*').eq('material_id', material_id).execute()
-            
-            if not response.data:
-                raise NotFoundError(f"Material with ID {material_id} not found")
-                
-            return response.data[0]
-            
-        except NotFoundError:
-            raise
         except Exception as e:
             self.handle_db_error(e, "get material")
+        
+        if not response.data:
+            raise NotFoundError(f"Material with ID {material_id} not found")
+        
+        return response.data[0]
     
     def update_material(self, material_id: str, update_data: Dict[str, Any]) -> Dict[str, Any]:
         """Update material by ID"""
@@ -204,26 +488,18 @@ class MaterialService(BaseService):
             raise ValidationError("Material ID is required")
             
         # Validate numeric fields if present
-        try:
-            if 'carbon_footprint' in update_data:
-                update_data['carbon_footprint'] = float(update_data['carbon_footprint'])
-            if 'announcement_year' in update_data and update_data['announcement_year']:
-                update_data['announcement_year'] = int(update_data['announcement_year'])
-        except (ValueError, TypeError):
-            raise ValidationError("Invalid numeric values provided")
+        self._coerce_numeric_fields(update_data)
         
         try:
             response = self.db.table('materials').update(update_data).eq('material_id', material_id).execute()
-            
-            if not response.data:
-                raise NotFoundError(f"Material with ID {material_id} not found")
-                
-            return response.data[0]
-            
-        except NotFoundError:
-            raise
         except Exception as e:
             self.handle_db_error(e, "update material")
+        
+        if not response.data:
+            raise NotFoundError(f"Material with ID {material_id} not found")
+        
+        invalidate_materials_cache()
+        return response.data[0]
     
     def delete_material(self, material_id: str) -> bool:
         """Delete material by ID"""
@@ -232,6 +508,7 @@ class MaterialService(BaseService):
             
         try:
             response = self.db.table('materials').delete().eq('material_id', material_id).execute()
+            invalidate_materials_cache()
             return True
             
         except Exception as e:
@@ -239,26 +516,44 @@ class MaterialService(BaseService):
     
     def _calculate_match_score(self, query: str, material_name: str) -> float:
         """Calculate basic match score between query and material name"""
-        if not query or not material_name:
-            return 0.0
+        return self._calculate_match_scores(query, [material_name])[0]
+    
+    def _calculate_match_scores(self, query: str, material_names: List[str]) -> List[float]:
+        """Score every candidate name against one query, normalizing the query only once"""
+        if not query or not material_names:
+            return [0.0] * len(material_names)
             
         query_lower = query.lower().strip()
-        material_lower = material_name.lower().strip()
-        
-        # Simple scoring algorithm - can be improved with fuzzy matching
-        if query_lower == material_lower:
-            return 1.0
-        elif query_lower in material_lower or material_lower in query_lower:
-            return 0.8
-        else:
-            # Basic word overlap scoring
-            query_words = set(query_lower.split())
-            material_words = set(material_lower.split())
+        query_words = set(query_lower.split())
+        # A one-word query that is not a substring of the name cannot share a word with it
+        single_word_query = query_words == {query_lower}
+        
+        scores = []
+        for material_name in material_names:
+            if not material_name:
+                scores.append(0.0)
+                continue
             
-            if not query_words or not material_words:
-                return 0.2
-                
-            overlap = len(query_words.intersection(material_words))
-            total_words = len(query_words.union(material_words))
+            material_lower = material_name.lower().strip()
             
-            return (overlap / total_words) * 0.7 + 0.1  # Base score + overlap score
\ No newline at end of file
+            # Simple scoring algorithm - can be improved with fuzzy matching
+            if query_lower == material_lower:
+                scores.append(1.0)
+            elif query_lower in material_lower or material_lower in query_lower:
+                scores.append(0.8)
+            elif single_word_query:
+                scores.append(0.1)  # zero word overlap, base score only
+            else:
+                # Basic word overlap scoring
+                material_words = set(material_lower.split())
+                
+                if not query_words or not material_words:
+                    scores.append(0.2)
+                    continue
+                    
+                overlap = len(query_words & material_words)
+                total_words = len(query_words | material_words)
+                
+                scores.append((overlap / total_words) * 0.7 + 0.1)  # Base score + overlap score
+        
+        return scores
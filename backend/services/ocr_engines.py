@@ -0,0 +1,125 @@
+import os
+import functools
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Shared OCR engines: each model is loaded once per process and reused by every service.
+# The OCR libraries (torch / paddle) are imported only when an engine is first requested.
+
+# Text lines of one crop that EasyOCR recognises per forward pass (readtext defaults to 1)
+EASYOCR_BATCH_SIZE = int(os.getenv('EASYOCR_BATCH_SIZE', '16'))
+
+# Invoice crops OCR'd concurrently per PDF. Threads share the engines above (a process pool would
+# load every model again per process); the inference calls release the GIL.
+INVOICE_OCR_WORKERS = max(1, int(os.getenv('OCR_CONCURRENCY', min(4, os.cpu_count() or 4))))
+
+# Engines are built under one lock so requests arriving together load each model once
+# (lru_cache alone lets concurrent first calls each run the factory)
+_engine_lock = threading.Lock()
+# A PaddleOCR predictor reuses its input/output tensors, so only one thread may run it at a time
+_paddleocr_lock = threading.Lock()
+
+def _shared_engine(factory):
+    """Cache an engine factory's result per arguments and build it at most once"""
+    cached = functools.lru_cache(maxsize=None)(factory)
+
+    @functools.wraps(factory)
+    def get_engine(*args, **kwargs):
+        with _engine_lock:
+            return cached(*args, **kwargs)
+
+    get_engine.cache_clear = cached.cache_clear
+    return get_engine
+
+def use_gpu() -> bool:
+    """True when torch can see a CUDA device"""
+    try:
+        import torch
+    except ImportError:
+        return False
+    return torch.cuda.is_available()
+
+def can_preload_engines() -> bool:
+    """True when the OCR models may be loaded in the gunicorn master before it forks
+
+    A model loaded on a GPU initialises CUDA, and fork()ed workers cannot use the
+    parent's CUDA context, so preloading is only safe on CPU-only machines. Torch is
+    asked through NVML (PYTORCH_NVML_BASED_CUDA_CHECK) so the check itself does not
+    initialise CUDA; a CUDA build of Paddle is treated as a GPU machine.
+    """
+    try:
+        import torch
+    except ImportError:
+        pass
+    else:
+        os.environ.setdefault('PYTORCH_NVML_BASED_CUDA_CHECK', '1')
+        if torch.cuda.is_available():
+            return False
+    try:
+        import paddle
+    except ImportError:
+        return True
+    return not paddle.is_compiled_with_cuda()
+
+@_shared_engine
+def get_easyocr_reader():
+    """EasyOCR Reader for Traditional Chinese + English"""
+    import easyocr
+    gpu = use_gpu()
+    logger.info("Loading EasyOCR reader (gpu=%s)", gpu)
+    return easyocr.Reader(['ch_tra', 'en'], gpu=gpu)
+
+@_shared_engine
+def get_cnocr():
+    """CnOCR engine with its default models"""
+    from cnocr import CnOcr
+    logger.info("Loading CnOCR engine")
+    return CnOcr()
+
+@_shared_engine
+def get_paddleocr(lang: str = 'ch'):
+    """PaddleOCR engine for `lang`, without text-line orientation classification"""
+    from paddleocr import PaddleOCR
+    logger.info("Loading PaddleOCR engine (lang=%s)", lang)
+    try:
+        # Newer PaddleOCR renamed use_angle_cls
+        return PaddleOCR(use_textline_orientation=False, lang=lang)
+    except Exception as e:
+        logger.info("PaddleOCR rejected use_textline_orientation (%s), using use_angle_cls", e)
+        return PaddleOCR(use_angle_cls=False, lang=lang)
+
+def release_gpu_memory() -> None:
+    """Hand cached CUDA blocks back to the driver once a PDF is done (no-op without a GPU)"""
+    try:
+        import torch
+    except ImportError:
+        return
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+        torch.cuda.ipc_collect()
+
+def easyocr_readtext(reader, image) -> list:
+    """reader.readtext(detail=0) for a BGR crop held in memory
+
+    For an image file readtext detects on the RGB pixels and recognises on the grayscale;
+    a 3-channel array would be detected as-is, so the two inputs are prepared here instead.
+    """
+    import cv2
+    import torch
+    # inference_mode is per thread, so it is entered here rather than around the worker pool
+    with torch.inference_mode():
+        horizontal_list, free_list = reader.detect(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        return reader.recognize(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), horizontal_list[0], free_list[0],
+                                detail=0, batch_size=EASYOCR_BATCH_SIZE, reformat=False)
+
+def paddleocr_ocr(engine, image) -> list:
+    """PaddleOCR.ocr for a BGR crop, one call at a time per process"""
+    with _paddleocr_lock:
+        return engine.ocr(image)
+
+def cnocr_ocr(engine, image) -> list:
+    """CnOcr.ocr for a BGR crop (CnOCR takes RGB arrays, as it reads image files)"""
+    import cv2
+    return engine.ocr(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
@@ -1,34 +1,37 @@
 import os
-import cv2
 import time
 import shutil
-import numpy as np
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Tuple
-from cnocr import CnOcr
-import easyocr
-from pdf2image import convert_from_path
-from paddleocr import PaddleOCR
 
 from .base_service import BaseService
+from .ocr_engines import (
+    INVOICE_OCR_WORKERS, cnocr_ocr, easyocr_readtext, get_cnocr, get_easyocr_reader, get_paddleocr,
+    paddleocr_ocr, release_gpu_memory
+)
 from models.exceptions import FileProcessingError, ValidationError
 from config.config import get_config
+from utils.ocr_cache import get_ocr_result_cache
+from utils.helpers import REPORT_FORMATS, write_records_to_csv, write_records_to_excel
 
 # Import OCR parameters from the original param.py
 try:
     from param import (
-        fuel_keywords, fuel_mapping, fuel_fuzzy_mapping,
+        fuel_keywords, fuel_mapping, fuel_types, normalize_fuel_text, find_longest_fuel_keyword,
         invoice_number_pattern, date_pattern, quantity_pattern,
         quantity_fallback_pattern, simple_quantity_pattern,
-        address_pattern, simple_address_pattern, district_keywords,
+        address_pattern, simple_address_pattern, district_keywords, search_address, clean_address,
         extract_and_convert_date, extract_invoice_number, extract_quantity,
-        roc_date_pattern, invoice_number_simple_pattern, invoice_number_mixed_pattern
+        roc_date_pattern
     )
 except ImportError:
     # Fallback values if param.py is not available
     fuel_keywords = ['汽油', '柴油', '天然氣']
     fuel_mapping = {'汽油': '汽油', '柴油': '柴油', '天然氣': '天然氣'}
-    fuel_fuzzy_mapping = {}
+    fuel_types = frozenset(fuel_mapping.values())
+    normalize_fuel_text = lambda text: text
+    find_longest_fuel_keyword = lambda text: next(
+        (fuel for fuel in sorted(fuel_keywords, key=len, reverse=True) if fuel in text), None)
     import re
     invoice_number_pattern = re.compile(r'\w{8}')
     date_pattern = re.compile(r'\d{4}[-/]\d{2}[-/]\d{2}')
@@ -36,7 +39,12 @@ except ImportError:
     quantity_fallback_pattern = re.compile(r'(\d+\.?\d*)')
     simple_quantity_pattern = re.compile(r'(\d+\.?\d*)')
     address_pattern = re.compile(r'.*號.*')
+    search_address = address_pattern.search
     district_keywords = ['市', '縣', '區', '鄉', '鎮']
+    def clean_address(address):
+        for wrong, right in (('半禹锈娜', '萬巒鄉'), ('号', '號'), ('锈', ''), ('娜', ''), ('潮洲', '潮州'), ('川', '州'), ('鎖', '鎮')):
+            address = address.replace(wrong, right)
+        return address
 
 class OCRService(BaseService):
     """Service for OCR operations"""
@@ -45,26 +53,30 @@ class OCRService(BaseService):
         super().__init__()
         self.config = get_config()
         self.ocr_engines = {"cnocr": None, "easyocr": None, "paddleocr": None}
+        self.ocr_cache = get_ocr_result_cache()
         
     def init_ocr_engines(self) -> None:
         """Initialize all OCR engines lazily"""
         if self.ocr_engines["cnocr"] is None:
             print("Initializing OCR engines (this may take a few minutes)...")
             try:
-                self.ocr_engines["cnocr"] = CnOcr()
-                self.ocr_engines["easyocr"] = easyocr.Reader(['ch_tra', 'en'])
-                self.ocr_engines["paddleocr"] = PaddleOCR(use_angle_cls=False, lang='en')
+                self.ocr_engines["cnocr"] = get_cnocr()
+                self.ocr_engines["easyocr"] = get_easyocr_reader()
+                self.ocr_engines["paddleocr"] = get_paddleocr('en')
                 print("OCR engines initialized successfully!")
             except Exception as e:
                 raise FileProcessingError(f"Failed to initialize OCR engines: {str(e)}")
     
-    def process_pdf(self, pdf_path: str) -> Tuple[str, List[Dict[str, Any]]]:
-        """Process PDF file and extract invoice information"""
+    def process_pdf(self, pdf_path: str, report_format: str = 'xlsx') -> Tuple[str, List[Dict[str, Any]]]:
+        """Process PDF file and extract invoice information into an .xlsx or .csv report"""
         if not os.path.exists(pdf_path):
             raise FileProcessingError(f"PDF file not found: {pdf_path}")
             
         if not pdf_path.lower().endswith('.pdf'):
             raise ValidationError("File must be a PDF")
+
+        if report_format not in REPORT_FORMATS:
+            raise ValidationError(f"Report format must be one of: {', '.join(REPORT_FORMATS)}")
         
         self.init_ocr_engines()
         
@@ -73,13 +85,18 @@ class OCRService(BaseService):
             invoice_images = self._detect_invoices_from_pdf(pdf_path)
             print(f"Detected {len(invoice_images)} invoices, starting OCR recognition...")
             
+            # Crops are independent; map keeps the results in page order
             results = []
-            for img_path in invoice_images:
-                result = self._extract_invoice_info(img_path)
-                results.append(result)
+            if invoice_images:
+                crop_names, crop_images = zip(*invoice_images)
+                with ThreadPoolExecutor(max_workers=min(INVOICE_OCR_WORKERS, len(invoice_images))) as executor:
+                    results = list(executor.map(self._extract_invoice_info, crop_names, crop_images))
             
             # Generate report
-            report_path = self._generate_excel_report(results)
+            if report_format == 'csv':
+                report_path = self._generate_csv_report(results)
+            else:
+                report_path = self._generate_excel_report(results)
             
             # Clean up temporary files
             self._cleanup_temp_files()
@@ -89,138 +106,73 @@ class OCRService(BaseService):
         except Exception as e:
             self._cleanup_temp_files()
             raise FileProcessingError(f"Failed to process PDF: {str(e)}")
+        finally:
+            # Intermediate tensors of this PDF would otherwise stay in PyTorch's CUDA cache
+            release_gpu_memory()
     
-    def _detect_invoices_from_pdf(self, pdf_path: str) -> List[str]:
-        """Split PDF into individual invoice images"""
-        os.makedirs(self.config.TEMP_IMG_FOLDER, exist_ok=True)
-        os.makedirs(self.config.CROPPED_RECEIPTS_FOLDER, exist_ok=True)
+    def _detect_invoices_from_pdf(self, pdf_path: str) -> List[Tuple[str, Any]]:
+        """Split PDF into individual invoice images, as (name, BGR array) pairs"""
+        # OpenCV / PyMuPDF load on first PDF, not when the service module is imported
+        import cv2
+        from utils.pdf_render import detect_invoice_boxes, iter_pdf_pages
+
+        if self.config.OCR_SAVE_CROPS:
+            os.makedirs(self.config.CROPPED_RECEIPTS_FOLDER, exist_ok=True)
         
         invoice_images = []
         
         try:
-            images = convert_from_path(pdf_path, dpi=self.config.OCR_DPI)
-            
-            for i, img in enumerate(images):
+            # Pages are rendered straight into arrays and the crops are OCR'd in memory
+            for i, image in enumerate(iter_pdf_pages(pdf_path, dpi=self.config.OCR_DPI)):
                 page_filename = f'page_{i + 1}.png'
-                img_path = os.path.join(self.config.TEMP_IMG_FOLDER, page_filename)
-                img.save(img_path, 'PNG')
-                
-                # Process image to find invoice regions
-                image = cv2.imread(img_path)
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-                
-                # Apply adaptive threshold
-                bin_img = cv2.adaptiveThreshold(
-                    gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 25, 15
-                )
-                
-                # Calculate kernel size based on image dimensions
-                height, width = gray.shape[:2]
-                scale = max(width, height) / 1000
-                ksize = int(30 * scale)
-                ksize = max(20, min(ksize, 80))
                 
-                # Morphological operations to connect text
-                kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (ksize, ksize))
-                dilated = cv2.dilate(bin_img, kernel, iterations=1)
-                
-                # Find contours
-                contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                
-                # Filter contours by area
-                boxes = [cv2.boundingRect(c) for c in contours 
-                        if cv2.contourArea(c) > self.config.OCR_CONTOUR_AREA_THRESHOLD]
-                
-                # Sort boxes by position (top to bottom, left to right)
-                boxes = sorted(boxes, key=lambda b: (b[1], b[0]))
+                # Find invoice regions (on a downscaled copy; boxes come back in page coordinates)
+                boxes = detect_invoice_boxes(image, self.config.OCR_CONTOUR_AREA_THRESHOLD)
                 
                 # Crop individual invoices
                 for j, (x, y, w, h) in enumerate(boxes):
                     crop_img = image[y:y + h, x:x + w]
-                    crop_path = os.path.join(
-                        self.config.CROPPED_RECEIPTS_FOLDER, 
-                        f'{page_filename}_block{j}.png'
-                    )
-                    cv2.imwrite(crop_path, crop_img)
-                    invoice_images.append(crop_path)
+                    crop_name = f'{page_filename}_block{j}.png'
+                    if self.config.OCR_SAVE_CROPS:
+                        cv2.imwrite(os.path.join(self.config.CROPPED_RECEIPTS_FOLDER, crop_name), crop_img)
+                    # Copy so the full page array can be freed once its crops are taken
+                    invoice_images.append((crop_name, crop_img.copy()))
             
             return invoice_images
             
         except Exception as e:
             raise FileProcessingError(f"Failed to detect invoices from PDF: {str(e)}")
     
-    def _extract_invoice_info(self, img_path: str) -> Dict[str, Any]:
-        """Extract information from a single invoice image"""
+    def _extract_invoice_info(self, crop_name: str, image: Any) -> Dict[str, Any]:
+        """Extract information from a single invoice image (BGR array)"""
         try:
-            print(f"  > Processing image: {os.path.basename(img_path)}")
-
-            # Use CnOCR for Chinese text
-            cnocr_result = self.ocr_engines["cnocr"].ocr(img_path)
-            cnocr_lines = [''.join(block['text']) for block in cnocr_result]
+            print(f"  > Processing image: {crop_name}")
 
-            # Use EasyOCR for mixed language text
-            zh_lines = self.ocr_engines["easyocr"].readtext(img_path, detail=0)
+            # Repeated crops reuse earlier OCR output (keyed by the image content)
+            image_digest = self.ocr_cache.array_digest(image)
 
-            all_lines = cnocr_lines + zh_lines
-            all_text_combined = ' '.join(all_lines)
+            # EasyOCR first; CnOCR only runs when EasyOCR's text is missing a field
+            zh_lines = self.ocr_cache.get_or_run(
+                image_digest, "easyocr", lambda: easyocr_readtext(self.ocr_engines["easyocr"], image))
+            fields = self._extract_fields(zh_lines)
 
-            print(f"    > Extracted {len(all_lines)} text lines")
+            if all(fields):
+                print(f"    > EasyOCR found every field in {len(zh_lines)} text lines, skipping CnOCR")
+            else:
+                # Use CnOCR for Chinese text; its lines take precedence, as before
+                cnocr_result = self.ocr_cache.get_or_run(
+                    image_digest, "cnocr", lambda: cnocr_ocr(self.ocr_engines["cnocr"], image))
+                cnocr_lines = [''.join(block['text']) for block in cnocr_result]
+                fields = self._extract_fields(cnocr_lines + zh_lines)
+                print(f"    > Extracted {len(cnocr_lines) + len(zh_lines)} text lines")
 
-            # Initialize extracted fields
-            invoice_number, date, quantity, fuel_type, address = None, None, None, None, None
-
-            # Extract invoice number using new patterns
-            for line in all_lines:
-                if not invoice_number:
-                    invoice_number = extract_invoice_number(line)
-                    if invoice_number:
-                        print(f"    > Found invoice number: {invoice_number}")
-                        break
-
-            # Extract date using new date conversion
-            for line in all_lines:
-                if not date:
-                    date = extract_and_convert_date(line)
-                    if date:
-                        print(f"    > Found date: {date}")
-                        break
-
-            # Extract quantity using improved patterns
-            for line in all_lines:
-                if not quantity:
-                    quantity = extract_quantity(line)
-                    if quantity:
-                        print(f"    > Found quantity: {quantity}")
-                        break
-
-            # Detect fuel type
-            fuel_type = self._detect_fuel_type(all_text_combined)
-            if fuel_type:
-                print(f"    > Found fuel type: {fuel_type}")
-
-            # Extract address using improved patterns
-            for line in all_lines:
-                if not address:
-                    match = address_pattern.search(line)
-                    if match:
-                        address = line
-                        print(f"    > Found address: {address}")
-                        break
-
-            # Fallback address detection
-            if not address:
-                for line in all_lines:
-                    match = simple_address_pattern.search(line)
-                    if match:
-                        address = line
-                        print(f"    > Found address (fallback): {address}")
-                        break
+            invoice_number, date, quantity, fuel_type, address = fields
 
             # Use PaddleOCR as fallback for missing information
-            if not all([invoice_number, date, quantity, fuel_type]):
+            if not (invoice_number and date and quantity and fuel_type):
                 print("    > Using PaddleOCR for missing information")
                 invoice_number, date, quantity, fuel_type = self._extract_with_paddle_ocr(
-                    img_path, invoice_number, date, quantity, fuel_type)
+                    image, image_digest, invoice_number, date, quantity, fuel_type)
 
             # Clean extracted data
             address = self._clean_address(address) if address else None
@@ -233,7 +185,7 @@ class OCRService(BaseService):
             print(f"    > Final results: Invoice={invoice_number}, Date={date}, Fuel={fuel_type}, Quantity={quantity}, Address={address[:50] if address else None}...")
 
             return {
-                '頁數': os.path.basename(img_path),
+                '頁數': crop_name,
                 '發票號碼': invoice_number,
                 '日期': date,
                 '種類': fuel_type,
@@ -243,38 +195,45 @@ class OCRService(BaseService):
             }
 
         except Exception as e:
-            print(f"Error extracting info from {img_path}: {str(e)}")
+            print(f"Error extracting info from {crop_name}: {str(e)}")
             return {
-                '頁數': os.path.basename(img_path),
+                '頁數': crop_name,
                 '發票號碼': None, '日期': None, '種類': None,
                 '數量': None, '地址': None, '備註': f'Processing error: {str(e)}'
             }
     
+    def _extract_fields(self, all_lines: List[str]) -> Tuple[Any, ...]:
+        """Extract (invoice_number, date, quantity, fuel_type, address) from OCR lines; the first matching line wins"""
+        invoice_number = next(filter(None, map(extract_invoice_number, all_lines)), None)
+        date = next(filter(None, map(extract_and_convert_date, all_lines)), None)
+        quantity = next(filter(None, map(extract_quantity, all_lines)), None)
+        fuel_type = self._detect_fuel_type(' '.join(all_lines))
+
+        # Extract address using improved patterns, then the simple fallback pattern
+        address = next((line for line in all_lines if search_address(line)), None)
+        if not address:
+            address = next((line for line in all_lines if simple_address_pattern.search(line)), None)
+
+        return invoice_number, date, quantity, fuel_type, address
+    
     def _detect_fuel_type(self, text_combined: str) -> str:
         """Detect fuel type from combined text"""
-        matches = []
-        
-        # Apply fuzzy mappings
-        for wrong, correct in fuel_fuzzy_mapping.items():
-            text_combined = text_combined.replace(wrong, correct)
-        
-        # Find fuel keywords
-        for fuel in fuel_keywords:
-            if fuel in text_combined:
-                mapped = fuel_mapping.get(fuel, fuel)
-                matches.append((fuel, mapped))
-        
-        if matches:
-            # Return the longest match (most specific)
-            return sorted(matches, key=lambda x: -len(x[0]))[0][1]
-        
+        # Apply fuzzy mappings in a single pass
+        text_combined = normalize_fuel_text(text_combined)
+
+        # Longest match (most specific), keywords are tried longest first
+        fuel = find_longest_fuel_keyword(text_combined)
+        if fuel:
+            return fuel_mapping.get(fuel, fuel)
+
         return None
     
-    def _extract_with_paddle_ocr(self, img_path: str, invoice_number: str,
+    def _extract_with_paddle_ocr(self, image: Any, image_digest: str, invoice_number: str,
                                 date: str, quantity: str, fuel_type: str) -> tuple:
         """Use PaddleOCR as fallback for missing information"""
         try:
-            paddle_result = self.ocr_engines["paddleocr"].ocr(img_path)
+            paddle_result = self.ocr_cache.get_or_run(
+                image_digest, "paddleocr:en", lambda: paddleocr_ocr(self.ocr_engines["paddleocr"], image))
 
             if paddle_result and paddle_result[0]:
                 paddle_lines = [line[1][0] for line in paddle_result[0]]
@@ -319,29 +278,17 @@ class OCRService(BaseService):
         """Clean and correct address text"""
         if not address:
             return address
-            
-        replacements = {
-            '半禹锈娜': '萬巒鄉', '号': '號', '锈': '', '娜': '',
-            '潮洲': '潮州', '川': '州', '鎖': '鎮'
-        }
-        
-        for wrong, right in replacements.items():
-            address = address.replace(wrong, right)
-        
-        return address
+
+        return clean_address(address)
     
     def _validate_invoice_number(self, invoice_number: str) -> str:
         """Validate invoice number format"""
         if not invoice_number:
             return None
 
-        # Check against various patterns
-        if (invoice_number_pattern.fullmatch(invoice_number) or
-            invoice_number_simple_pattern.fullmatch(invoice_number) or
-            invoice_number_mixed_pattern.fullmatch(invoice_number)):
-            return invoice_number
-
-        return invoice_number  # Return as-is if doesn't match, let user decide
+        # Numbers are returned as-is whether or not they match a known format (let user decide),
+        # so no pattern needs to run here
+        return invoice_number
     
     def _validate_date(self, date: str) -> str:
         """Validate date format"""
@@ -372,7 +319,7 @@ class OCRService(BaseService):
     
     def _validate_fuel_type(self, fuel_type: str) -> str:
         """Validate fuel type is in allowed values"""
-        if fuel_type and fuel_type not in fuel_mapping.values():
+        if fuel_type and fuel_type not in fuel_types:
             return None
         return fuel_type
     
@@ -385,32 +332,20 @@ class OCRService(BaseService):
         if len(address) < 5:
             return None
 
-        # Check if it contains key address components
-        has_location_marker = ('號' in address or '号' in address)
-        has_district = any(city in address for city in district_keywords)
-        has_road_marker = any(marker in address for marker in ['路', '街', '巷', '弄', '大道', '段'])
-
-        # More flexible validation - at least 2 out of 3 criteria
-        criteria_met = sum([has_location_marker, has_district, has_road_marker])
-
-        if criteria_met >= 2:
-            return address
-
-        # If not enough criteria met, still return the address but let user decide
+        # Addresses missing 號 / a district / a road marker are still kept; the user decides
         return address
     
     def _generate_excel_report(self, results: List[Dict[str, Any]]) -> str:
         """Generate Excel report from OCR results"""
         try:
-            df = pd.DataFrame(results)
-            
             report_filename = f'ocr_report_{int(time.time())}.xlsx'
             report_path = os.path.join(self.config.REPORTS_FOLDER, report_filename)
             
             # Ensure reports directory exists
             os.makedirs(self.config.REPORTS_FOLDER, exist_ok=True)
             
-            df.to_excel(report_path, index=False)
+            # Rows are streamed to xlsxwriter (constant memory) instead of going through a DataFrame
+            write_records_to_excel(report_path, results)
             print(f"Report generated: {report_path}")
             
             return report_path
@@ -418,13 +353,32 @@ class OCRService(BaseService):
         except Exception as e:
             raise FileProcessingError(f"Failed to generate Excel report: {str(e)}")
     
+    def _generate_csv_report(self, results: List[Dict[str, Any]]) -> str:
+        """Generate CSV report from OCR results (UTF-8 with BOM so Excel opens it directly)"""
+        try:
+            report_filename = f'ocr_report_{int(time.time())}.csv'
+            report_path = os.path.join(self.config.REPORTS_FOLDER, report_filename)
+            
+            # Ensure reports directory exists
+            os.makedirs(self.config.REPORTS_FOLDER, exist_ok=True)
+            
+            # Plain csv.writer rows, no workbook XML to build
+            write_records_to_csv(report_path, results)
+            print(f"Report generated: {report_path}")
+            
+            return report_path
+            
+        except Exception as e:
+            raise FileProcessingError(f"Failed to generate CSV report: {str(e)}")
+    
     def _cleanup_temp_files(self) -> None:
         """Clean up temporary files and directories"""
         try:
             if os.path.exists(self.config.TEMP_IMG_FOLDER):
                 shutil.rmtree(self.config.TEMP_IMG_FOLDER)
             
-            if os.path.exists(self.config.CROPPED_RECEIPTS_FOLDER):
+            # Crops saved for debugging (OCR_SAVE_CROPS) are kept for inspection
+            if not self.config.OCR_SAVE_CROPS and os.path.exists(self.config.CROPPED_RECEIPTS_FOLDER):
                 shutil.rmtree(self.config.CROPPED_RECEIPTS_FOLDER)
                 
         except Exception as e:
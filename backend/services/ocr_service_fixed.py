@@ -1,33 +1,53 @@
 import os
-import cv2
 import time
 import shutil
-import numpy as np
-import pandas as pd
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Tuple
-import easyocr
-from pdf2image import convert_from_path
 
 from .base_service import BaseService
+from .ocr_engines import INVOICE_OCR_WORKERS, easyocr_readtext, get_easyocr_reader, release_gpu_memory
 from models.exceptions import FileProcessingError, ValidationError
 from config.config import get_config
+from utils.ocr_cache import get_ocr_result_cache
+from utils.helpers import REPORT_FORMATS, write_records_to_csv, write_records_to_excel
 
 # Import OCR parameters from the original param.py
 try:
     from param import (
-        fuel_keywords, fuel_mapping, fuel_fuzzy_mapping,
-        address_pattern, simple_address_pattern, district_keywords,
+        fuel_keywords, fuel_mapping, normalize_fuel_text, find_longest_fuel_keyword,
+        address_pattern, simple_address_pattern, district_keywords, search_address, clean_address,
         extract_and_convert_date, extract_invoice_number, extract_quantity
     )
 except ImportError:
     # Fallback values if param.py is not available
     fuel_keywords = ['汽油', '柴油', '天然氣']
     fuel_mapping = {'汽油': '汽油', '柴油': '柴油', '天然氣': '天然氣'}
-    fuel_fuzzy_mapping = {}
+    normalize_fuel_text = lambda text: text
+    find_longest_fuel_keyword = lambda text: next(
+        (fuel for fuel in sorted(fuel_keywords, key=len, reverse=True) if fuel in text), None)
     import re
     address_pattern = re.compile(r'.*號.*')
-    simple_address_pattern = re.compile(r'.*(市|縣).*(鄉|鎮|市|區).*\d+號?')
+    simple_address_pattern = re.compile(r'(市|縣)[^鄉鎮市區]{0,30}(鄉|鎮|市|區)[^0-9]{0,50}\d+號?')
+    search_address = address_pattern.search
     district_keywords = ['市', '縣', '區', '鄉', '鎮']
+    def clean_address(address):
+        for wrong, right in (('半禹锈娜', '萬巒鄉'), ('号', '號'), ('锈', ''), ('娜', ''), ('潮洲', '潮州'), ('川', '州'), ('鎖', '鎮')):
+            address = address.replace(wrong, right)
+        return address
+
+# Process-wide OCR service; created on first use, or before fork when preloaded under gunicorn --preload
+_OCR_SERVICE = None
+_ocr_service_lock = threading.Lock()
+
+def get_ocr_service() -> 'OCRServiceFixed':
+    """Return the shared OCRServiceFixed instance, creating it on first call"""
+    global _OCR_SERVICE
+    if _OCR_SERVICE is None:
+        with _ocr_service_lock:
+            if _OCR_SERVICE is None:
+                _OCR_SERVICE = OCRServiceFixed()
+    return _OCR_SERVICE
 
 class OCRServiceFixed(BaseService):
     """Fixed OCR Service using only EasyOCR"""
@@ -36,25 +56,29 @@ class OCRServiceFixed(BaseService):
         super().__init__()
         self.config = get_config()
         self.ocr_engine = None
+        self.ocr_cache = get_ocr_result_cache()
 
     def init_ocr_engine(self) -> None:
         """Initialize EasyOCR engine only"""
         if self.ocr_engine is None:
             print("Initializing OCR engine (EasyOCR)...")
             try:
-                self.ocr_engine = easyocr.Reader(['ch_tra', 'en'])
+                self.ocr_engine = get_easyocr_reader()
                 print("OCR engine initialized successfully!")
             except Exception as e:
                 raise FileProcessingError(f"Failed to initialize OCR engine: {str(e)}")
 
-    def process_pdf(self, pdf_path: str) -> Tuple[str, List[Dict[str, Any]]]:
-        """Process PDF file and extract invoice information"""
+    def process_pdf(self, pdf_path: str, report_format: str = 'xlsx') -> Tuple[str, List[Dict[str, Any]]]:
+        """Process PDF file and extract invoice information into an .xlsx or .csv report"""
         if not os.path.exists(pdf_path):
             raise FileProcessingError(f"PDF file not found: {pdf_path}")
 
         if not pdf_path.lower().endswith('.pdf'):
             raise ValidationError("File must be a PDF")
 
+        if report_format not in REPORT_FORMATS:
+            raise ValidationError(f"Report format must be one of: {', '.join(REPORT_FORMATS)}")
+
         self.init_ocr_engine()
 
         try:
@@ -62,13 +86,18 @@ class OCRServiceFixed(BaseService):
             invoice_images = self._detect_invoices_from_pdf(pdf_path)
             print(f"Detected {len(invoice_images)} invoices, starting OCR recognition...")
 
+            # Crops are independent; map keeps the results in page order
             results = []
-            for img_path in invoice_images:
-                result = self._extract_invoice_info(img_path)
-                results.append(result)
+            if invoice_images:
+                crop_names, crop_images = zip(*invoice_images)
+                with ThreadPoolExecutor(max_workers=min(INVOICE_OCR_WORKERS, len(invoice_images))) as executor:
+                    results = list(executor.map(self._extract_invoice_info, crop_names, crop_images))
 
             # Generate report
-            report_path = self._generate_excel_report(results)
+            if report_format == 'csv':
+                report_path = self._generate_csv_report(results)
+            else:
+                report_path = self._generate_excel_report(results)
 
             # Clean up temporary files
             self._cleanup_temp_files()
@@ -78,73 +107,52 @@ class OCRServiceFixed(BaseService):
         except Exception as e:
             self._cleanup_temp_files()
             raise FileProcessingError(f"Failed to process PDF: {str(e)}")
+        finally:
+            # Intermediate tensors of this PDF would otherwise stay in PyTorch's CUDA cache
+            release_gpu_memory()
+
+    def _detect_invoices_from_pdf(self, pdf_path: str) -> List[Tuple[str, Any]]:
+        """Split PDF into individual invoice images, as (name, BGR array) pairs"""
+        # OpenCV / PyMuPDF load on first PDF, not when the service module is imported
+        import cv2
+        from utils.pdf_render import detect_invoice_boxes, iter_pdf_pages
 
-    def _detect_invoices_from_pdf(self, pdf_path: str) -> List[str]:
-        """Split PDF into individual invoice images"""
-        os.makedirs(self.config.TEMP_IMG_FOLDER, exist_ok=True)
-        os.makedirs(self.config.CROPPED_RECEIPTS_FOLDER, exist_ok=True)
+        if self.config.OCR_SAVE_CROPS:
+            os.makedirs(self.config.CROPPED_RECEIPTS_FOLDER, exist_ok=True)
 
         invoice_images = []
 
         try:
-            images = convert_from_path(pdf_path, dpi=self.config.OCR_DPI)
-
-            for i, img in enumerate(images):
+            # Pages are rendered straight into arrays and the crops are OCR'd in memory
+            for i, image in enumerate(iter_pdf_pages(pdf_path, dpi=self.config.OCR_DPI)):
                 page_filename = f'page_{i + 1}.png'
-                img_path = os.path.join(self.config.TEMP_IMG_FOLDER, page_filename)
-                img.save(img_path, 'PNG')
-
-                # Process image to find invoice regions
-                image = cv2.imread(img_path)
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
-                # Apply adaptive threshold
-                bin_img = cv2.adaptiveThreshold(
-                    gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 25, 15
-                )
-
-                # Calculate kernel size based on image dimensions
-                height, width = gray.shape[:2]
-                scale = max(width, height) / 1000
-                ksize = int(30 * scale)
-                ksize = max(20, min(ksize, 80))
-
-                # Morphological operations to connect text
-                kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (ksize, ksize))
-                dilated = cv2.dilate(bin_img, kernel, iterations=1)
-
-                # Find contours
-                contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-                # Filter contours by area
-                boxes = [cv2.boundingRect(c) for c in contours
-                        if cv2.contourArea(c) > self.config.OCR_CONTOUR_AREA_THRESHOLD]
-
-                # Sort boxes by position (top to bottom, left to right)
-                boxes = sorted(boxes, key=lambda b: (b[1], b[0]))
+                # Find invoice regions (on a downscaled copy; boxes come back in page coordinates)
+                boxes = detect_invoice_boxes(image, self.config.OCR_CONTOUR_AREA_THRESHOLD)
 
                 # Crop individual invoices
                 for j, (x, y, w, h) in enumerate(boxes):
                     crop_img = image[y:y + h, x:x + w]
-                    crop_path = os.path.join(
-                        self.config.CROPPED_RECEIPTS_FOLDER,
-                        f'{page_filename}_block{j}.png'
-                    )
-                    cv2.imwrite(crop_path, crop_img)
-                    invoice_images.append(crop_path)
+                    crop_name = f'{page_filename}_block{j}.png'
+                    if self.config.OCR_SAVE_CROPS:
+                        cv2.imwrite(os.path.join(self.config.CROPPED_RECEIPTS_FOLDER, crop_name), crop_img)
+                    # Copy so the full page array can be freed once its crops are taken
+                    invoice_images.append((crop_name, crop_img.copy()))
 
             return invoice_images
 
         except Exception as e:
             raise FileProcessingError(f"Failed to detect invoices from PDF: {str(e)}")
 
-    def _extract_invoice_info(self, img_path: str) -> Dict[str, Any]:
-        """Extract information from a single invoice image"""
+    def _extract_invoice_info(self, crop_name: str, image: Any) -> Dict[str, Any]:
+        """Extract information from a single invoice image (BGR array)"""
         try:
-            print(f"  > Processing image: {os.path.basename(img_path)}")
+            print(f"  > Processing image: {crop_name}")
 
-            # Use EasyOCR for text extraction
-            ocr_result = self.ocr_engine.readtext(img_path, detail=0)
+            # Use EasyOCR for text extraction (repeated crops reuse the cached output)
+            ocr_result = self.ocr_cache.get_or_run(
+                self.ocr_cache.array_digest(image), "easyocr",
+                lambda: easyocr_readtext(self.ocr_engine, image))
             all_text = ' '.join(ocr_result)
 
             print(f"    > Extracted {len(ocr_result)} text lines")
@@ -182,7 +190,7 @@ class OCRServiceFixed(BaseService):
             # Extract address using improved patterns
             for line in ocr_result:
                 if not address:
-                    match = address_pattern.search(line)
+                    match = search_address(line)
                     if match:
                         address = line
                         print(f"    > Found address: {address}")
@@ -208,7 +216,7 @@ class OCRServiceFixed(BaseService):
             print(f"    > Final results: Invoice={invoice_number}, Date={date}, Fuel={fuel_type}, Quantity={quantity}")
 
             return {
-                '頁數': os.path.basename(img_path),
+                '頁數': crop_name,
                 '發票號碼': invoice_number,
                 '日期': date,
                 '種類': fuel_type,
@@ -218,30 +226,22 @@ class OCRServiceFixed(BaseService):
             }
 
         except Exception as e:
-            print(f"Error extracting info from {img_path}: {str(e)}")
+            print(f"Error extracting info from {crop_name}: {str(e)}")
             return {
-                '頁數': os.path.basename(img_path),
+                '頁數': crop_name,
                 '發票號碼': None, '日期': None, '種類': None,
                 '數量': None, '地址': None, '備註': f'Processing error: {str(e)}'
             }
 
     def _detect_fuel_type(self, text_combined: str) -> str:
         """Detect fuel type from combined text"""
-        matches = []
-
-        # Apply fuzzy mappings
-        for wrong, correct in fuel_fuzzy_mapping.items():
-            text_combined = text_combined.replace(wrong, correct)
+        # Apply fuzzy mappings in a single pass
+        text_combined = normalize_fuel_text(text_combined)
 
-        # Find fuel keywords
-        for fuel in fuel_keywords:
-            if fuel in text_combined:
-                mapped = fuel_mapping.get(fuel, fuel)
-                matches.append((fuel, mapped))
-
-        if matches:
-            # Return the longest match (most specific)
-            return sorted(matches, key=lambda x: -len(x[0]))[0][1]
+        # Longest match (most specific), keywords are tried longest first
+        fuel = find_longest_fuel_keyword(text_combined)
+        if fuel:
+            return fuel_mapping.get(fuel, fuel)
 
         return None
 
@@ -250,15 +250,7 @@ class OCRServiceFixed(BaseService):
         if not address:
             return address
 
-        replacements = {
-            '半禹锈娜': '萬巒鄉', '号': '號', '锈': '', '娜': '',
-            '潮洲': '潮州', '川': '州', '鎖': '鎮'
-        }
-
-        for wrong, right in replacements.items():
-            address = address.replace(wrong, right)
-
-        return address
+        return clean_address(address)
 
     def _validate_invoice_number(self, invoice_number: str) -> str:
         """Validate invoice number format"""
@@ -289,15 +281,14 @@ class OCRServiceFixed(BaseService):
     def _generate_excel_report(self, results: List[Dict[str, Any]]) -> str:
         """Generate Excel report from OCR results"""
         try:
-            df = pd.DataFrame(results)
-
             report_filename = f'ocr_report_{int(time.time())}.xlsx'
             report_path = os.path.join(self.config.REPORTS_FOLDER, report_filename)
 
             # Ensure reports directory exists
             os.makedirs(self.config.REPORTS_FOLDER, exist_ok=True)
 
-            df.to_excel(report_path, index=False)
+            # Rows are streamed to xlsxwriter (constant memory) instead of going through a DataFrame
+            write_records_to_excel(report_path, results)
             print(f"Report generated: {report_path}")
 
             return report_path
@@ -305,13 +296,32 @@ class OCRServiceFixed(BaseService):
         except Exception as e:
             raise FileProcessingError(f"Failed to generate Excel report: {str(e)}")
 
+    def _generate_csv_report(self, results: List[Dict[str, Any]]) -> str:
+        """Generate CSV report from OCR results (UTF-8 with BOM so Excel opens it directly)"""
+        try:
+            report_filename = f'ocr_report_{int(time.time())}.csv'
+            report_path = os.path.join(self.config.REPORTS_FOLDER, report_filename)
+
+            # Ensure reports directory exists
+            os.makedirs(self.config.REPORTS_FOLDER, exist_ok=True)
+
+            # Plain csv.writer rows, no workbook XML to build
+            write_records_to_csv(report_path, results)
+            print(f"Report generated: {report_path}")
+
+            return report_path
+
+        except Exception as e:
+            raise FileProcessingError(f"Failed to generate CSV report: {str(e)}")
+
     def _cleanup_temp_files(self) -> None:
         """Clean up temporary files and directories"""
         try:
             if os.path.exists(self.config.TEMP_IMG_FOLDER):
                 shutil.rmtree(self.config.TEMP_IMG_FOLDER)
 
-            if os.path.exists(self.config.CROPPED_RECEIPTS_FOLDER):
+            # Crops saved for debugging (OCR_SAVE_CROPS) are kept for inspection
+            if not self.config.OCR_SAVE_CROPS and os.path.exists(self.config.CROPPED_RECEIPTS_FOLDER):
                 shutil.rmtree(self.config.CROPPED_RECEIPTS_FOLDER)
 
         except Exception as e:
@@ -1,14 +1,43 @@
 import os
+import threading
 from supabase import create_client
+from supabase.lib.client_options import ClientOptions
 from dotenv import load_dotenv
 
 load_dotenv()  # load .env
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Seconds before a PostgREST / storage request times out
+SUPABASE_TIMEOUT = int(os.getenv("SUPABASE_TIMEOUT", "30"))
 
-try:
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-except Exception as e:
-    print(f"Failed to create Supabase client: {e}")
-    supabase = None
+_client = None
+_client_lock = threading.Lock()
+
+def get_supabase():
+    """Return the process-wide Supabase client (None if it could not be created)
+
+    The client holds one keep-alive connection pool to PostgREST that every query reuses.
+    It is built on first use instead of at import; call this at use time rather than
+    binding the result at import. A failed attempt is not cached, so the next call retries.
+    """
+    global _client
+    if _client is not None:
+        return _client
+    with _client_lock:
+        if _client is None:
+            try:
+                _client = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(
+                    schema="public",
+                    postgrest_client_timeout=SUPABASE_TIMEOUT,
+                    storage_client_timeout=SUPABASE_TIMEOUT
+                ))
+            except Exception as e:
+                print(f"Failed to create Supabase client: {e}")
+        return _client
+
+def reset_supabase():
+    """Drop the cached client; the next get_supabase() call creates a new one"""
+    global _client
+    with _client_lock:
+        _client = None
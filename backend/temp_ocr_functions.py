@@ -10,7 +10,7 @@ def extract_invoice_info(img_path: str) -> dict:
         if not date and (match := date_pattern.search(line)): date = match.group()
 
     for i, line in enumerate(all_lines):
-        if not quantity and any(k in line for k in fuel_keywords):
+        if not quantity and fuel_keyword_pattern.search(line):
             if (match := quantity_pattern.search(line)): quantity = match.group(1); break
             if (match := quantity_fallback_pattern.search(line)): quantity = match.group(); break
             if i + 1 < len(all_lines):
@@ -29,7 +29,7 @@ def extract_invoice_info(img_path: str) -> dict:
         if not address and (match := address_pattern.search(line)): address = line; break
     if not address:
         for line in zh_lines:
-            if any(keyword in line for keyword in district_keywords) and '號' in line and re.search(r'\d+', line): address = line; break
+            if '號' in line and has_district_keyword(line) and any_digit_pattern.search(line): address = line; break
 
     # --- 關鍵：完整的 PaddleOCR 備用方案 ---
     if not all([invoice_number, date, quantity, fuel_type, address]):
@@ -51,15 +51,14 @@ def extract_invoice_info(img_path: str) -> dict:
 
     # --- 關鍵：完整的資料清理 ---
     if address:
-        replacements = {'半禹锈娜': '萬巒鄉', '号': '號', '锈': '', '娜': '', '潮洲': '潮州', '川': '州', '鎖': '鎮'}
-        for wrong, right in replacements.items(): address = address.replace(wrong, right)
+        address = clean_address(address)
     if invoice_number and not invoice_number_pattern.fullmatch(invoice_number): invoice_number = None
     if date and not date_pattern.fullmatch(date): date = None
     if quantity:
         try: float(quantity)
         except ValueError: quantity = None
-    if fuel_type and fuel_type not in fuel_mapping.values(): fuel_type = None
-    if address and (len(address) < 6 or '號' not in address or not any(city in address for city in district_keywords)): address = None
+    if fuel_type and fuel_type not in fuel_types: fuel_type = None
+    if address and (len(address) < 6 or '號' not in address or not has_district_keyword(address)): address = None
 
     print(f"  > OCR 結果: {invoice_number}, {date}, {fuel_type}, {quantity}, {address}")
     return {
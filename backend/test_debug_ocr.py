@@ -4,11 +4,11 @@ Debug script to see exactly what OCR text is being extracted
 """
 import os
 import sys
-import easyocr
 from pdf2image import convert_from_path
 
 sys.path.append(os.getcwd())
 from param import extract_invoice_number
+from services.ocr_engines import get_easyocr_reader
 
 # Process the PDF and show what OCR text is extracted
 pdf_path = '/Users/yangping/Studio/mfish/work_station/岡展-加油發票-1-3-3.pdf'
@@ -16,7 +16,8 @@ print(f"Testing OCR debug with: {pdf_path}")
 
 # Convert to image
 images = convert_from_path(pdf_path, dpi=300)
-reader = easyocr.Reader(['ch_tra', 'en'])
+# Same process-wide Reader the app uses (loaded once per interpreter)
+reader = get_easyocr_reader()
 
 # Process the full page first
 print("\\n=== FULL PAGE OCR ===")
@@ -35,13 +36,13 @@ full_text = ' '.join(full_page_text)
 # Find all patterns that could be invoice numbers
 import re
 patterns = [
-    (r'[A-Z]{2}-\d{8}', 'Standard format (XX-12345678)'),
-    (r'[A-Z]{2}\d{8}', 'Mixed format (XX12345678)'),
-    (r'傳票號碼[：:]\s*(\d{7,8})', 'Voucher numbers'),
+    (re.compile(r'[A-Z]{2}-\d{8}'), 'Standard format (XX-12345678)'),
+    (re.compile(r'[A-Z]{2}\d{8}'), 'Mixed format (XX12345678)'),
+    (re.compile(r'傳票號碼[：:]\s*(\d{7,8})'), 'Voucher numbers'),
 ]
 
 for pattern, description in patterns:
-    matches = re.findall(pattern, full_text)
+    matches = pattern.findall(full_text)
     if matches:
         print(f"{description}: {matches}")
 
@@ -8,10 +8,7 @@ import cv2
 import time
 import shutil
 import numpy as np
-import pandas as pd
 from typing import List, Dict, Any
-import easyocr
-from pdf2image import convert_from_path
 
 # Add the current directory to the path
 sys.path.append(os.getcwd())
@@ -19,6 +16,9 @@ sys.path.append(os.getcwd())
 # Import our updated patterns and functions
 from param import *
 from config.config import get_config
+from utils.pdf_render import invoice_boxes, iter_pdf_pages
+from utils.helpers import write_records_to_excel
+from services.ocr_engines import get_easyocr_reader
 
 def test_ocr_simple(pdf_path: str):
     """Test OCR with simplified approach using only EasyOCR"""
@@ -28,29 +28,22 @@ def test_ocr_simple(pdf_path: str):
     config = get_config()
 
     # Create necessary directories
-    os.makedirs(config.TEMP_IMG_FOLDER, exist_ok=True)
     os.makedirs(config.CROPPED_RECEIPTS_FOLDER, exist_ok=True)
     os.makedirs(config.REPORTS_FOLDER, exist_ok=True)
 
     try:
-        # Convert PDF to images
-        print("Converting PDF to images...")
-        images = convert_from_path(pdf_path, dpi=300)
-        print(f"Converted to {len(images)} images")
-
         # Initialize EasyOCR
         print("Initializing EasyOCR...")
-        reader = easyocr.Reader(['ch_tra', 'en'])
+        reader = get_easyocr_reader()
 
-        # Process each page to detect invoice regions
+        # Render the PDF page by page (PyMuPDF, or multi-threaded pdftoppm as fallback) and
+        # process each page to detect invoice regions as soon as it is rendered
+        print("Converting PDF to images...")
         all_invoice_images = []
-        for i, img in enumerate(images):
+        for i, image in enumerate(iter_pdf_pages(pdf_path, dpi=300)):
             page_filename = f'page_{i + 1}.png'
-            img_path = os.path.join(config.TEMP_IMG_FOLDER, page_filename)
-            img.save(img_path, 'PNG')
 
             # Process image to find invoice regions (simplified approach)
-            image = cv2.imread(img_path)
             gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
             # Apply adaptive threshold
@@ -71,12 +64,8 @@ def test_ocr_simple(pdf_path: str):
             # Find contours
             contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-            # Filter contours by area
-            boxes = [cv2.boundingRect(c) for c in contours
-                    if cv2.contourArea(c) > 5000]  # Using default threshold
-
-            # Sort boxes by position (top to bottom, left to right)
-            boxes = sorted(boxes, key=lambda b: (b[1], b[0]))
+            # Filter contours by area (default threshold) and sort top to bottom, left to right
+            boxes = invoice_boxes(contours, 5000)
 
             print(f"Found {len(boxes)} potential invoice regions on page {i+1}")
 
@@ -118,7 +107,7 @@ def test_ocr_simple(pdf_path: str):
             # Extract address (simplified)
             address = None
             for line in ocr_result:
-                if any(keyword in line for keyword in district_keywords) and '號' in line:
+                if '號' in line and has_district_keyword(line):
                     address = line
                     break
 
@@ -136,10 +125,10 @@ def test_ocr_simple(pdf_path: str):
 
         # Generate Excel report
         if results:
-            df = pd.DataFrame(results)
             report_filename = f'ocr_report_{int(time.time())}.xlsx'
             report_path = os.path.join(config.REPORTS_FOLDER, report_filename)
-            df.to_excel(report_path, index=False)
+            # Rows are streamed to xlsxwriter (constant memory) instead of going through a DataFrame
+            write_records_to_excel(report_path, results)
             print(f"Report generated: {report_path}")
 
             # Display results
@@ -1,10 +1,21 @@
+import io
 import os
+import re
+import csv
 import time
 import logging
 import functools
-from typing import Any, Dict, List
+import threading
+import zipfile
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 import werkzeug.utils
-from flask import jsonify
+import xlsxwriter
+from flask import jsonify, request
+
+from models.exceptions import ValidationError
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +36,20 @@ def ensure_directory_exists(directory: str) -> None:
     if not os.path.exists(directory):
         os.makedirs(directory, exist_ok=True)
 
+def get_json_body() -> Dict[str, Any]:
+    """Parse the request's JSON object body in one step
+    
+    Replaces the is_json check + get_json() pair in POST/PUT handlers; missing,
+    malformed or non-object bodies raise ValidationError (400) instead of leaking
+    werkzeug's BadRequest or an AttributeError as a 500.
+    """
+    data = request.get_json(silent=True)
+    if data is None:
+        raise ValidationError("Request must contain JSON data")
+    if not isinstance(data, dict):
+        raise ValidationError("Request body must be a JSON object")
+    return data
+
 def format_error_response(error: Exception, status_code: int = 500) -> Dict[str, Any]:
     """Format error response consistently"""
     return {
@@ -65,19 +90,21 @@ def validate_file_size(file_size: int, max_size: int) -> bool:
     """Validate file size against maximum allowed size"""
     return file_size <= max_size
 
+# Potentially dangerous characters removed by sanitize_string, in one str.translate pass
+_SANITIZE_TABLE = str.maketrans('', '', '<>"\'&\0')
+
 def sanitize_string(input_string: str) -> str:
     """Basic string sanitization"""
     if not isinstance(input_string, str):
         return ""
     
-    # Remove potentially dangerous characters
-    dangerous_chars = ['<', '>', '"', "'", '&', '\0']
-    sanitized = input_string
-    
-    for char in dangerous_chars:
-        sanitized = sanitized.replace(char, '')
-    
-    return sanitized.strip()
+    return input_string.translate(_SANITIZE_TABLE).strip()
+
+_LINE_BREAK_PATTERN = re.compile(r'[\r\n]+')
+
+def split_nonempty_lines(text: str) -> List[str]:
+    """Split text on any line ending (\n, \r\n, \r) into stripped, non-empty lines"""
+    return [line for line in (part.strip() for part in _LINE_BREAK_PATTERN.split(text)) if line]
 
 def paginate_list(items: List[Any], page: int, per_page: int) -> Dict[str, Any]:
     """Paginate a list of items"""
@@ -107,32 +134,303 @@ def extract_file_info(file) -> Dict[str, Any]:
     }
 
 class RateLimiter:
-    """Simple in-memory rate limiter"""
+    """Simple in-memory, thread-safe sliding-window rate limiter"""
     
     def __init__(self):
+        # key -> deque of request times (time.monotonic), oldest first
         self.requests = {}
+        self._lock = threading.Lock()
+        # Idle keys are purged at most once per (longest) window, from is_allowed
+        self._max_window = 0
+        self._last_purge = time.monotonic()
     
     def is_allowed(self, key: str, limit: int, window: int) -> bool:
         """Check if request is allowed based on rate limit"""
-        current_time = time.time()
+        current_time = time.monotonic()
         
-        if key not in self.requests:
-            self.requests[key] = []
-        
-        # Remove old requests outside the window
-        self.requests[key] = [req_time for req_time in self.requests[key] 
-                             if current_time - req_time < window]
-        
-        # Check if under limit
-        if len(self.requests[key]) < limit:
-            self.requests[key].append(current_time)
-            return True
-        
-        return False
+        with self._lock:
+            self._max_window = max(self._max_window, window)
+            if current_time - self._last_purge >= self._max_window:
+                self._purge(current_time, self._max_window)
+            
+            requests = self.requests.get(key)
+            if requests is None:
+                requests = self.requests[key] = deque()
+            
+            # Times are appended in order, so expired requests are always at the head
+            while requests and current_time - requests[0] >= window:
+                requests.popleft()
+            
+            # Check if under limit
+            if len(requests) < limit:
+                requests.append(current_time)
+                return True
+            
+            return False
+    
+    def purge(self, window: int) -> None:
+        """Drop keys with no request inside the window, so idle clients do not accumulate"""
+        with self._lock:
+            self._purge(time.monotonic(), window)
+    
+    def _purge(self, current_time: float, window: int) -> None:
+        # Caller holds the lock
+        for key in [key for key, requests in self.requests.items()
+                    if not requests or current_time - requests[-1] >= window]:
+            del self.requests[key]
+        self._last_purge = current_time
+
+class LRUSessionCache:
+    """Thread-safe, size-bounded LRU cache for per-session results
+    
+    Reads and writes move a session to the most-recently-used end; once more than
+    maxsize sessions are stored the least recently used one is evicted. Sessions
+    pinned with pin() (e.g. while their ZIP is being streamed) are never evicted.
+    on_evict(session_id, value) runs on a background thread.
+    """
+    
+    def __init__(self, maxsize: int = 100, on_evict: Optional[Callable[[str, Any], None]] = None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self._data = OrderedDict()
+        self._pinned = {}
+        self._lock = threading.RLock()
+        self._evict_executor = ThreadPoolExecutor(max_workers=1) if on_evict else None
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+    
+    def __getitem__(self, key: str) -> Any:
+        with self._lock:
+            value = self._data[key]
+            self._data.move_to_end(key)
+            return value
+    
+    def __setitem__(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            evicted = self._evict()
+        for item in evicted:
+            self._evict_executor.submit(self._run_on_evict, *item)
+    
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._data
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+    
+    def items(self) -> List[Any]:
+        """Snapshot of (session_id, value) pairs, least recently used first"""
+        with self._lock:
+            return list(self._data.items())
+    
+    @contextmanager
+    def pin(self, key: str):
+        """Keep a session from being evicted while the block runs"""
+        self.add_pin(key)
+        try:
+            yield
+        finally:
+            self.remove_pin(key)
+    
+    def add_pin(self, key: str) -> None:
+        """Keep a session from being evicted until the matching remove_pin()"""
+        with self._lock:
+            self._pinned[key] = self._pinned.get(key, 0) + 1
+    
+    def remove_pin(self, key: str) -> None:
+        """Release one add_pin(); the session can be evicted again once no pins remain"""
+        with self._lock:
+            self._pinned[key] -= 1
+            if not self._pinned[key]:
+                del self._pinned[key]
+            evicted = self._evict()
+        for item in evicted:
+            self._evict_executor.submit(self._run_on_evict, *item)
+    
+    def _evict(self) -> List[Any]:
+        # Caller holds the lock; pinned sessions are skipped, so the cache may briefly exceed maxsize
+        evicted = []
+        if len(self._data) <= self.maxsize:
+            return evicted
+        for key in list(self._data):
+            if len(self._data) <= self.maxsize:
+                break
+            if key in self._pinned:
+                continue
+            evicted.append((key, self._data.pop(key)))
+        if not self.on_evict:
+            return []
+        return evicted
+    
+    def _run_on_evict(self, key: str, value: Any) -> None:
+        try:
+            self.on_evict(key, value)
+        except Exception as e:
+            logger.warning("Session cache eviction callback failed for %s: %s", key, e)
 
-def create_session_cache():
-    """Create a simple session cache for storing temporary results"""
-    return {}
+def remove_session_images(session_id: str, results: List[Dict[str, Any]]) -> None:
+    """Delete the screenshots of an evicted session (and its folder once empty)"""
+    folders = set()
+    for item in results or []:
+        image_path = item.get('image_local_path')
+        if image_path and os.path.isfile(image_path):
+            os.remove(image_path)
+            folders.add(os.path.dirname(image_path))
+    for folder in folders:
+        try:
+            os.rmdir(folder)
+        except OSError:
+            pass
+    logger.info("Evicted session %s from results cache", session_id)
+
+class _ZipChunkBuffer:
+    """Write-only, non-seekable sink that collects what ZipFile writes until it is drained"""
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self) -> None:
+        pass
+    
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _read_file(path: str) -> Optional[Tuple[bytes, os.stat_result]]:
+    # One open + fstat; a file that vanished or is unreadable is skipped rather than checked up front
+    try:
+        with open(path, 'rb') as f:
+            return f.read(), os.fstat(f.fileno())
+    except OSError as e:
+        logger.warning("Skipping unreadable file %s: %s", path, e)
+        return None
+
+def prefetch_files(paths: Iterable[str], max_workers: int = 8,
+                   window: int = 16) -> Iterator[Optional[Tuple[bytes, os.stat_result]]]:
+    """Read files on a thread pool, yielding (contents, stat) in input order, or None for unreadable files
+    
+    At most `window` reads are in flight (or buffered) at a time, so memory stays bounded.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append(executor.submit(_read_file, path))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def iter_zip(files: Iterable[Tuple[str, str]], compression: int = zipfile.ZIP_STORED,
+             max_workers: int = 8, window: int = 16) -> Iterator[bytes]:
+    """Yield a ZIP archive of (path, arcname) files chunk by chunk instead of building it in memory
+    
+    File contents are prefetched in parallel (see prefetch_files) and written in order;
+    files that no longer exist are left out. ZIP_STORED is the default because
+    screenshots (PNG/JPEG) are already compressed.
+    """
+    files = list(files)
+    buffer = _ZipChunkBuffer()
+    contents = prefetch_files((path for path, _ in files), max_workers=max_workers, window=window)
+    with zipfile.ZipFile(buffer, 'w', compression) as zf:
+        for (path, arcname), content in zip(files, contents):
+            if content is None:
+                continue
+            data, stat = content
+            zinfo = zipfile.ZipInfo(arcname, time.localtime(stat.st_mtime)[:6])
+            zinfo.external_attr = (stat.st_mode & 0xFFFF) << 16
+            zinfo.compress_type = compression
+            zf.writestr(zinfo, data)
+            yield buffer.drain()
+    # Central directory
+    yield buffer.drain()
+
+def write_records_to_excel(path, records: List[Dict[str, Any]], sheet_name: str = 'Sheet1') -> None:
+    """Write dicts as an .xlsx sheet (header row from their keys) like DataFrame.to_excel(index=False)
+    
+    path is a file path or a binary file object such as io.BytesIO. Rows go straight to
+    xlsxwriter in constant_memory mode, so each one is flushed to a temp file as it is
+    written and no DataFrame is built. None values become empty cells.
+    """
+    headers = list(dict.fromkeys(key for record in records for key in record))
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'strings_to_urls': False})
+    worksheet = workbook.add_worksheet(sheet_name)
+    if headers:
+        worksheet.write_row(0, 0, headers)
+    for row, record in enumerate(records, 1):
+        worksheet.write_row(row, 0, [record.get(key) for key in headers])
+    workbook.close()
+
+def write_records_to_csv(path: str, records: List[Dict[str, Any]]) -> None:
+    """Write dicts as CSV with the same header and cells as write_records_to_excel
+
+    Rows are streamed through csv.writer. The file is UTF-8 with a BOM so Excel
+    detects the encoding of the Chinese headers.
+    """
+    headers = list(dict.fromkeys(key for record in records for key in record))
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        if headers:
+            writer.writerow(headers)
+        writer.writerows([record.get(key) for key in headers] for record in records)
+
+# Google Maps route report columns as (header, result key), shared by every route Excel export
+ROUTE_REPORT_COLUMNS = (
+    ("起始點", "origin"),
+    ("終點", "destination"),
+    ("距離", "distance"),
+    ("圖片名稱", "image_filename"),
+    ("備註", "remarks")
+)
+# Added after 距離 only when some route has a duration (GMAP_ROUTE_DURATIONS)
+ROUTE_DURATION_COLUMN = ("行車時間", "duration")
+
+def build_route_report(results: List[Dict[str, Any]]) -> bytes:
+    """Route results as .xlsx bytes, one row per route in ROUTE_REPORT_COLUMNS"""
+    columns = ROUTE_REPORT_COLUMNS
+    if any(item.get('duration') for item in results):
+        columns = columns[:3] + (ROUTE_DURATION_COLUMN,) + columns[3:]
+    output = io.BytesIO()
+    write_records_to_excel(
+        output,
+        [{header: item.get(key, '') for header, key in columns} for item in results],
+        sheet_name='路線距離報告'
+    )
+    return output.getvalue()
+
+# File formats an OCR report can be written in
+REPORT_FORMATS = ('xlsx', 'csv')
+
+def create_session_cache(maxsize: int = 100, on_evict: Optional[Callable[[str, Any], None]] = None) -> LRUSessionCache:
+    """Create a bounded session cache for storing temporary results"""
+    return LRUSessionCache(maxsize=maxsize, on_evict=on_evict)
+
+def create_http_session(pool_maxsize: int = 20, retries: int = 3):
+    """requests.Session with a larger keep-alive pool and retries on connection errors"""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=pool_maxsize,
+        max_retries=Retry(total=retries, backoff_factor=0.3, status_forcelist=())
+    )
+    session.mount('https://', adapter)
+    return session
 
 def cleanup_old_files(directory: str, max_age_hours: int = 24) -> int:
     """Clean up old files in a directory"""
@@ -144,16 +442,16 @@ def cleanup_old_files(directory: str, max_age_hours: int = 24) -> int:
     cleaned_count = 0
     
     try:
-        for filename in os.listdir(directory):
-            filepath = os.path.join(directory, filename)
-            
-            if os.path.isfile(filepath):
-                file_age = current_time - os.path.getmtime(filepath)
-                
-                if file_age > max_age_seconds:
-                    os.remove(filepath)
-                    cleaned_count += 1
-                    logger.info(f"Cleaned up old file: {filepath}")
+        # DirEntry caches the file type from the directory listing and its stat() result
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    file_age = current_time - entry.stat().st_mtime
+                    
+                    if file_age > max_age_seconds:
+                        os.remove(entry.path)
+                        cleaned_count += 1
+                        logger.info(f"Cleaned up old file: {entry.path}")
     
     except Exception as e:
         logger.error(f"Error cleaning up directory {directory}: {str(e)}")
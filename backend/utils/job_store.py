@@ -0,0 +1,146 @@
+import json
+import os
+import re
+import logging
+import tempfile
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+class FileJobStore:
+    """Background job records kept as one JSON file per job
+
+    The files are shared by every gunicorn worker, so a job can be polled from
+    any worker, not only the one running it. Only the newest `maxsize` finished
+    or failed jobs are kept; queued and running jobs are never evicted.
+
+    Records carry the `pid` of the worker running them. A queued or running job
+    whose worker has exited, or that has run longer than `timeout` seconds since
+    `started_at` (`created_at` while queued), is marked failed when read or pruned,
+    and `on_abandon(record)` runs so the job's files can be cleaned up.
+    """
+
+    DONE_STATUSES = ('finished', 'failed')
+
+    def __init__(self, directory: str, maxsize: int = 100, timeout: Optional[float] = None,
+                 on_abandon: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.on_abandon = on_abandon
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id: str) -> Optional[str]:
+        if not isinstance(job_id, str) or not _JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the job record, or None for an unknown or evicted job"""
+        record = self._read(job_id)
+        reason = record and self._abandon_reason(record)
+        if reason:
+            record = self._fail_abandoned(job_id, record, reason)
+        return record
+
+    def _read(self, job_id: str) -> Optional[Dict[str, Any]]:
+        path = self._path(job_id)
+        if path is None:
+            return None
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _abandon_reason(self, record: Dict[str, Any]) -> Optional[str]:
+        """Why an unfinished job will never finish (worker gone or timed out), or None"""
+        if record.get('status') in self.DONE_STATUSES:
+            return None
+        pid = record.get('pid')
+        if pid and not _pid_alive(pid):
+            return "worker process exited"
+        started = record.get('started_at') or record.get('created_at')
+        if self.timeout and started and time.time() - started > self.timeout:
+            return f"no result after {self.timeout:g} seconds"
+        return None
+
+    def _fail_abandoned(self, job_id: str, record: Dict[str, Any], reason: str) -> Dict[str, Any]:
+        logger.warning("Marking job %s failed: %s", job_id, reason)
+        record.update(status='failed', error=f"Job abandoned: {reason}", finished_at=time.time())
+        self._write(job_id, record)
+        if self.on_abandon:
+            try:
+                self.on_abandon(record)
+            except Exception as e:
+                logger.warning("Cleanup for abandoned job %s failed: %s", job_id, e)
+        return record
+
+    def put(self, job_id: str, record: Dict[str, Any]) -> None:
+        """Write the whole job record atomically, so readers never see a partial file"""
+        self._write(job_id, record)
+        # Also prune when a job is queued, so abandoned jobs are cleaned up even if none finish
+        if record.get('status') in self.DONE_STATUSES or record.get('status') == 'queued':
+            self._prune()
+
+    def _write(self, job_id: str, record: Dict[str, Any]) -> None:
+        path = self._path(job_id)
+        if path is None:
+            raise ValueError(f"Invalid job id: {job_id!r}")
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def update(self, job_id: str, **fields: Any) -> Optional[Dict[str, Any]]:
+        """Merge fields into an existing record (only the worker running the job writes it)"""
+        record = self._read(job_id)
+        if record is None:
+            return None
+        record.update(fields)
+        self.put(job_id, record)
+        return record
+
+    def _prune(self) -> None:
+        """Mark abandoned jobs failed and delete the oldest finished/failed jobs beyond maxsize"""
+        with os.scandir(self.directory) as entries:
+            files = sorted(
+                (entry for entry in entries if entry.name.endswith('.json')),
+                key=lambda entry: entry.stat().st_mtime,
+                reverse=True
+            )
+        done = 0
+        for entry in files:
+            job_id = entry.name[:-len('.json')]
+            record = self._read(job_id)
+            reason = record and self._abandon_reason(record)
+            if reason:
+                record = self._fail_abandoned(job_id, record, reason)
+            if record is None or record.get('status') not in self.DONE_STATUSES:
+                continue
+            done += 1
+            if done > self.maxsize:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning("Could not remove expired job %s: %s", entry.name, e)
+
+def _pid_alive(pid: int) -> bool:
+    """Whether a process with this pid exists on this machine"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to someone else (PermissionError), or cannot be probed here
+        return True
+    return True
@@ -0,0 +1,65 @@
+import json
+import decimal
+import logging
+from typing import Any, Dict, Optional
+from flask import make_response, current_app
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+def _orjson_default(obj: Any) -> Any:
+    """Types orjson does not handle natively, matching Flask's default provider"""
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def _orjson_dumps(obj: Any, indent: bool = False) -> bytes:
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(obj, default=_orjson_default, option=option)
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Compact JSON as UTF-8 bytes, via orjson when it is installed"""
+    if orjson is not None:
+        return _orjson_dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson (used by jsonify and plain Flask routes)"""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return _orjson_dumps(obj).decode('utf-8')
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            _orjson_dumps(obj, indent=self._app.debug) + b"\n",
+            mimetype=self.mimetype
+        )
+
+def output_orjson(data: Any, code: int, headers: Optional[Dict[str, str]] = None):
+    """flask-restx representation for application/json using orjson"""
+    resp = make_response(_orjson_dumps(data, indent=current_app.debug) + b"\n", code)
+    resp.headers.extend(headers or {})
+    return resp
+
+def init_json(app, api=None) -> bool:
+    """Serialize JSON responses of app (and the flask-restx api) with orjson when it is installed"""
+    if orjson is None:
+        logger.warning("orjson not installed; using the standard json module for responses")
+        return False
+    app.json = ORJSONProvider(app)
+    if api is not None:
+        api.representations['application/json'] = output_orjson
+    return True
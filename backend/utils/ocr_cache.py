@@ -0,0 +1,77 @@
+import hashlib
+import logging
+import threading
+from typing import Any, Callable
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+from config.config import get_config
+from utils.helpers import create_session_cache
+
+logger = logging.getLogger(__name__)
+
+# Part of every cache key; bump when an OCR engine, its model or its arguments change
+OCR_CACHE_VERSION = 1
+
+class OCRResultCache:
+    """Memoise OCR engine output per invoice crop, keyed by a hash of the crop's content
+
+    Results live in an in-memory LRU and, when cache_dir is set (and diskcache is
+    installed), on disk so they survive restarts and are shared between workers.
+    """
+
+    def __init__(self, maxsize: int = 1024, cache_dir: str = ''):
+        self._memory = create_session_cache(maxsize=maxsize)
+        self._disk = None
+        if cache_dir and diskcache is not None:
+            self._disk = diskcache.Cache(cache_dir)
+
+    @staticmethod
+    def array_digest(image) -> str:
+        """blake2b of a crop's shape and pixels
+
+        The pixels are hashed in place (same bytes as image.tobytes()): a crop is a
+        non-contiguous slice of its page, but each of its rows is contiguous.
+        """
+        digest = hashlib.blake2b(str(image.shape).encode(), digest_size=16)
+        if image.flags.c_contiguous:
+            digest.update(image)
+        else:
+            for row in image:
+                digest.update(row if row.flags.c_contiguous else row.copy())
+        return digest.hexdigest()
+
+    def get_or_run(self, digest: str, engine: str, run: Callable[[], Any]) -> Any:
+        """Return the cached result of `engine` for the image, running it on a miss"""
+        key = f"{digest}:{engine}:v{OCR_CACHE_VERSION}"
+        result = self._memory.get(key)
+        if result is None and self._disk is not None:
+            result = self._disk.get(key)
+            if result is not None:
+                self._memory[key] = result
+        if result is not None:
+            logger.debug("OCR cache hit for %s", key)
+            return result
+
+        result = run()
+        if result is not None:
+            self._memory[key] = result
+            if self._disk is not None:
+                self._disk.set(key, result)
+        return result
+
+_OCR_RESULT_CACHE = None
+_ocr_result_cache_lock = threading.Lock()
+
+def get_ocr_result_cache() -> OCRResultCache:
+    """Return the process-wide OCR result cache, creating it from config on first call"""
+    global _OCR_RESULT_CACHE
+    if _OCR_RESULT_CACHE is None:
+        with _ocr_result_cache_lock:
+            if _OCR_RESULT_CACHE is None:
+                config = get_config()
+                _OCR_RESULT_CACHE = OCRResultCache(config.OCR_CACHE_MAXSIZE, config.OCR_CACHE_DIR)
+    return _OCR_RESULT_CACHE
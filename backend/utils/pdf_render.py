@@ -0,0 +1,85 @@
+import os
+import logging
+import tempfile
+from typing import Iterator
+
+import cv2
+import numpy as np
+
+# PyMuPDF renders in-process, one page at a time; pdf2image (pdftoppm) is the fallback
+try:
+    import fitz
+except ImportError:
+    fitz = None
+
+logger = logging.getLogger(__name__)
+
+def iter_pdf_pages(pdf_path: str, dpi: int = 300) -> Iterator[np.ndarray]:
+    """Render a PDF page by page as BGR arrays (the same layout cv2.imread returns)"""
+    if fitz is not None:
+        with fitz.open(pdf_path) as doc:
+            for page in doc:
+                pix = page.get_pixmap(dpi=dpi)
+                rgb = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+                yield cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+        return
+
+    logger.debug("PyMuPDF not installed, rendering %s with pdf2image", pdf_path)
+    from pdf2image import convert_from_path
+    # pdftoppm runs one process per thread and writes the pages itself; paths_only skips loading
+    # them into PIL, and PPM is read back by OpenCV without any decompression
+    with tempfile.TemporaryDirectory(prefix='pdf_pages_') as output_folder:
+        page_paths = convert_from_path(
+            pdf_path, dpi=dpi, output_folder=output_folder, fmt='ppm', paths_only=True,
+            thread_count=max(1, (os.cpu_count() or 1) - 1)
+        )
+        for page_path in page_paths:
+            yield cv2.imread(page_path)
+
+def invoice_boxes(contours, min_area: float) -> np.ndarray:
+    """Bounding boxes (x, y, w, h) of contours larger than min_area, top to bottom then left to right"""
+    areas = np.fromiter((cv2.contourArea(c) for c in contours), dtype=np.float64, count=len(contours))
+    boxes = np.array([cv2.boundingRect(contours[k]) for k in np.flatnonzero(areas > min_area)],
+                     dtype=np.int64).reshape(-1, 4)
+    # lexsort is stable and uses the last key (y) first, like sorted(key=(y, x))
+    return boxes[np.lexsort((boxes[:, 0], boxes[:, 1]))]
+
+# Long side (px) of the copy used to find invoice blocks; an A4 page at 300 DPI is ~3500px
+DETECTION_MAX_SIDE = 1024
+
+def detect_invoice_boxes(image: np.ndarray, min_area: float, max_side: int = DETECTION_MAX_SIDE) -> np.ndarray:
+    """Invoice blocks (x, y, w, h) on a BGR page, in the page's own pixel coordinates
+
+    Thresholding, dilation and the contour search run on a grayscale copy shrunk to
+    max_side; the threshold block, kernel and min_area are scaled to match, and the
+    boxes are mapped back so crops are cut from the full-resolution page.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    height, width = gray.shape[:2]
+
+    # Kernel size for the full-resolution page
+    ksize = max(20, min(int(30 * max(width, height) / 1000), 80))
+    block_size = 25
+    factor = min(1.0, max_side / max(width, height))
+    if factor < 1.0:
+        gray = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+        ksize = max(1, round(ksize * factor))
+        block_size = max(3, round(block_size * factor) | 1)
+        min_area = min_area * factor * factor
+
+    # Adaptive threshold, then dilate to connect each invoice's text into one block
+    bin_img = cv2.adaptiveThreshold(
+        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, block_size, 15
+    )
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (ksize, ksize))
+    dilated = cv2.dilate(bin_img, kernel, iterations=1)
+    contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = invoice_boxes(contours, min_area)
+
+    if factor < 1.0 and len(boxes):
+        x0 = np.floor(boxes[:, 0] / factor)
+        y0 = np.floor(boxes[:, 1] / factor)
+        x1 = np.minimum(np.ceil((boxes[:, 0] + boxes[:, 2]) / factor), width)
+        y1 = np.minimum(np.ceil((boxes[:, 1] + boxes[:, 3]) / factor), height)
+        boxes = np.stack([x0, y0, x1 - x0, y1 - y0], axis=1).astype(np.int64)
+    return boxes